@@ -0,0 +1,224 @@
+import argparse
+import json
+import multiprocessing
+import os
+import sys
+import time
+from collections import deque
+from multiprocessing.pool import AsyncResult
+from pathlib import Path
+
+import numpy as np
+
+sys.path.append(str(Path(__file__).resolve().parents[1] / "src"))
+
+from duplicate_index import DuplicateIndex  # noqa: E402
+from exact_index import ExactIndex  # noqa: E402
+from ingredient_index import IngredientIndex  # noqa: E402
+from lru_cache import LRUCache  # noqa: E402
+from recommendation import Recommendation  # noqa: E402
+from sharded_index import limit_blas_threads  # noqa: E402
+from translation_cache import TranslationCache  # noqa: E402
+from translator import Translator  # noqa: E402
+from user_profile import UserProfile  # noqa: E402
+from vectorizer import Vectorizer  # noqa: E402
+
+_worker_index = None
+_worker_ingredient_index = None
+_worker_masks = None
+_worker_duplicate_mask = None
+
+
+def _init_worker(dataset_path):
+    """Open the memory-mapped embeddings and the ingredient index once per search process."""
+    global _worker_index, _worker_ingredient_index, _worker_masks, _worker_duplicate_mask
+    dataset_path = Path(dataset_path)
+    _worker_index = ExactIndex(np.load(dataset_path.with_name("embeddings.npy"), mmap_mode="r"))
+    _worker_ingredient_index = IngredientIndex.load(dataset_path.with_name("ingredient_index.npz"))
+    duplicate_index_path = dataset_path.with_name("duplicate_index.npz")
+    if duplicate_index_path.exists():
+        _worker_duplicate_mask = DuplicateIndex.load(duplicate_index_path).mask
+    # Profiles tend to share a few exclusion sets, so their masks are built once
+    _worker_masks = LRUCache(max_size=64)
+
+
+def _search_batch(query_vectors, exclusions, top_n):
+    """Return the (scores, indices) of the top_n recipes of every query, skipping their excluded ingredients."""
+    masks = []
+    for exclusion in exclusions:
+        mask = _worker_masks.get(exclusion)
+        if mask is None:
+            excluded_ingredients, sugar_free = exclusion
+            mask = _worker_ingredient_index.excluded_mask(excluded_ingredients, sugar_free=sugar_free)
+            if _worker_duplicate_mask is not None:
+                # Near-duplicate recipes never take a result slot, only the representative of their group
+                mask = _worker_duplicate_mask if mask is None else mask | _worker_duplicate_mask
+            if mask is not None:
+                _worker_masks.put(exclusion, mask)
+        masks.append(mask)
+    return _worker_index.search_batch(query_vectors, top_n, excluded=masks)
+
+
+def iter_profiles(path):
+    """Yield (record id, UserProfile or error message) for every JSON line of the profiles file."""
+    with open(path) if path != "-" else sys.stdin as f:
+        for line_number, line in enumerate(f, start=1):
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+                yield record.get("id", line_number), UserProfile(record)
+            except (json.JSONDecodeError, AttributeError, ValueError) as e:
+                yield line_number, f"Invalid profile on line {line_number}: {e}"
+
+
+def iter_batches(items, batch_size):
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def recommend_batch(batch, search_results, recipes, get_translator=None):
+    """Return the result record of every profile of a batch, translating the recipes when get_translator is given."""
+    valid_rows = [row for row, (_, profile) in enumerate(batch) if not isinstance(profile, str)]
+    meals = {}
+    if valid_rows:
+        scores, indices = search_results
+        for i, row in enumerate(valid_rows):
+            meals[row] = [
+                {**recipes.get(index), "score": float(score)}
+                for score, index in zip(scores[i], indices[i])
+                if index >= 0
+            ]
+
+    if get_translator is not None:
+        languages = {batch[row][1].language for row in valid_rows} - {"english"}
+        for language in languages:
+            rows = [row for row in valid_rows if batch[row][1].language == language]
+            # All the recipes of a language are translated together, in concurrent batched requests
+            translations = iter(get_translator(language).translate_meals([meal for row in rows for meal in meals[row]]))
+            for row in rows:
+                meals[row] = [{**meal, **next(translations)} for meal in meals[row]]
+
+    return [
+        (
+            {"id": record_id, "error": profile}
+            if isinstance(profile, str)
+            else {"id": record_id, "recommendations": meals[row]}
+        )
+        for row, (record_id, profile) in enumerate(batch)
+    ]
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description=(
+            "Recommend recipes for many user profiles at once. The profiles file has one JSON object per line, with "
+            'the fields of a UserProfile ("dietary", "ingredients", "sugar_content", "excluded_ingredients", '
+            '"language") and an optional "id"; the results are written as JSON lines in the same order.'
+        )
+    )
+    parser.add_argument("profiles", help="Path to the JSON lines file with the profiles, or - for stdin.")
+    parser.add_argument("--output", default="-", help="Path of the JSON lines results (default: stdout).")
+    parser.add_argument("--file-path", default="./tastyai/src/dataset/full_dataset.csv", help="Path to the dataset.")
+    parser.add_argument("--top", type=int, default=5, help="Number of recommendations per profile.")
+    parser.add_argument("--batch-size", type=int, default=1024, help="Number of profiles searched together.")
+    parser.add_argument("--encode-batch-size", type=int, default=256, help="Number of queries per model call.")
+    parser.add_argument(
+        "--workers", type=int, default=os.cpu_count() or 1, help="Number of search processes (default: all cores)."
+    )
+    parser.add_argument(
+        "--translate",
+        action="store_true",
+        help="Translate the recipes of non-english profiles (calls the OpenAI API on translation cache misses).",
+    )
+    parser.add_argument(
+        "--openai-api-key", default=os.environ.get("OPENAI_API_KEY"), help="OpenAI API key (default: $OPENAI_API_KEY)."
+    )
+    return parser.parse_args()
+
+
+def run():
+    args = parse_args()
+    if args.translate and not args.openai_api_key:
+        sys.exit("An OpenAI API key is required to translate, use --openai-api-key or set OPENAI_API_KEY.")
+
+    # Makes sure the embeddings and indexes exist and match the dataset before the workers open them
+    vectorizer = Vectorizer(args.file_path, batch_size=args.encode_batch_size)
+    vectorizer.vectorize()
+    recipes = vectorizer.load_recipe_store()
+
+    cache = TranslationCache(Path(args.file_path).with_name("translation_cache.sqlite")) if args.translate else None
+    translators = {}
+
+    def get_translator(language):
+        if language not in translators:
+            translators[language] = Translator(openai_key=args.openai_api_key, language=language, cache=cache)
+        return translators[language]
+
+    if args.workers > 1:
+        with limit_blas_threads(max(1, (os.cpu_count() or 1) // args.workers)):
+            context = multiprocessing.get_context("spawn")
+            pool = context.Pool(args.workers, initializer=_init_worker, initargs=(args.file_path,))
+    else:
+        _init_worker(args.file_path)
+        pool = None
+
+    output = open(args.output, "w") if args.output != "-" else sys.stdout
+    start_time = time.time()
+    num_profiles = 0
+
+    def write_oldest(in_flight):
+        batch, search_results = in_flight.popleft()
+        if isinstance(search_results, AsyncResult):
+            search_results = search_results.get()
+        results = recommend_batch(batch, search_results, recipes, get_translator if args.translate else None)
+        output.writelines(json.dumps(result, ensure_ascii=False) + "\n" for result in results)
+        output.flush()
+
+    try:
+        in_flight = deque()
+        for batch in iter_batches(iter_profiles(args.profiles), args.batch_size):
+            valid = [profile for _, profile in batch if not isinstance(profile, str)]
+            search_results = None
+            if valid:
+                query_vectors = vectorizer.model.encode(
+                    [Recommendation.query_string(profile) for profile in valid],
+                    batch_size=vectorizer.batch_size,
+                    normalize_embeddings=True,
+                )
+                exclusions = [Recommendation.exclusion_key(profile) for profile in valid]
+                if pool is None:
+                    search_results = _search_batch(query_vectors, exclusions, args.top)
+                else:
+                    search_results = pool.apply_async(_search_batch, (query_vectors, exclusions, args.top))
+            in_flight.append((batch, search_results))
+            num_profiles += len(batch)
+
+            # The next batches are encoded while the workers search, with a bounded number of batches in flight
+            if len(in_flight) >= (args.workers * 2 if pool is not None else 1):
+                write_oldest(in_flight)
+        while in_flight:
+            write_oldest(in_flight)
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+        if output is not sys.stdout:
+            output.close()
+
+    run_time = time.time() - start_time
+    profiles_per_second = num_profiles / run_time if run_time > 0 else 0.0
+    print(
+        f"Recommended recipes for {num_profiles} profiles in {run_time:.2f}s ({profiles_per_second:.1f} profiles/sec)",
+        file=sys.stderr,
+    )
+
+
+if __name__ == "__main__":
+    run()
@@ -0,0 +1,382 @@
+"""Offline benchmark of the TastyAI pipeline.
+
+Generates a synthetic RecipeNLG-shaped dataset, vectorizes it and measures the query path with fake OpenAI backends,
+so it runs without network access or API keys. The results are written as JSON, tagged with the current git commit,
+so they can be compared across commits.
+"""
+
+import argparse
+import asyncio
+import csv
+import json
+import os
+import platform
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import numpy as np
+import torch
+from langchain_core.messages import AIMessage
+from langchain_core.runnables import RunnableLambda
+
+sys.path.append(str(Path(__file__).resolve().parents[1] / "src"))
+
+import image_generator  # noqa: E402
+import langchain_openai  # noqa: E402
+import nlp  # noqa: E402
+from image_generator import ImageGenerator  # noqa: E402
+from recommendation import Recommendation  # noqa: E402
+from translation_cache import TranslationCache  # noqa: E402
+from user_profile import UserProfile  # noqa: E402
+from vectorizer import MODEL_NAME, Vectorizer  # noqa: E402
+
+INGREDIENTS = (
+    "sugar,brown sugar,flour,butter,eggs,milk,salt,baking soda,vanilla,chicken,beef,pork,rice,onion,garlic,tomatoes,"
+    "lime,lemon,cheese,cream,potatoes,carrots,celery,pepper,olive oil,honey,cinnamon,chocolate,pecans,walnuts,oats,"
+    "broccoli,spinach,mushrooms,shrimp,salmon,beans,corn,bacon,yogurt"
+).split(",")
+DISHES = ["Cake", "Pie", "Casserole", "Soup", "Salad", "Stew", "Cookies", "Bread", "Dip", "Pasta", "Tacos", "Curry"]
+DIETARY = ["vegetarian", "vegan", "low-carb", "gluten-free", "dessert", "dinner", "breakfast", "healthy"]
+UNITS = ["1 c.", "2 c.", "1/2 c.", "1 tsp.", "1 Tbsp.", "1 lb.", "2", "3 oz."]
+STEPS = ["Preheat oven to 350°.", "Mix well.", "Bake for 30 minutes.", "Stir occasionally.", "Serve warm.", "Chill."]
+
+
+class HashingEncoder:
+    """Stand-in for the SentenceTransformer: a hashed bag-of-words random projection, fast and fully offline.
+
+    Throughput measured with it reflects the pipeline overhead (parsing, storage, indexing), not the model cost.
+    """
+
+    def __init__(self, dim=384, buckets=1 << 16, seed=0):
+        self.dim = dim
+        self.buckets = buckets
+        self.projection = np.random.default_rng(seed).standard_normal((buckets, dim)).astype(np.float32)
+
+    def get_sentence_embedding_dimension(self):
+        return self.dim
+
+    def encode(self, texts, convert_to_tensor=False, normalize_embeddings=False, **kwargs):
+        embeddings = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for i, text in enumerate(texts):
+            buckets = [zlib.crc32(token.encode("utf-8")) % self.buckets for token in text.lower().split()]
+            if buckets:
+                embeddings[i] = self.projection[buckets].sum(axis=0)
+        if normalize_embeddings:
+            embeddings /= np.maximum(np.linalg.norm(embeddings, axis=1, keepdims=True), 1e-12)
+        return torch.from_numpy(embeddings) if convert_to_tensor else embeddings
+
+
+def fake_chat_openai(latency):
+    """Return a ChatOpenAI replacement answering every prompt of the app after `latency` seconds."""
+
+    def respond(prompt_value):
+        messages = prompt_value.to_messages()
+        system, query = messages[0].content, messages[-1].content
+        if "extracts meal preferences" in system:
+            words = set(query.lower().split())
+            content = {
+                "dietary": [word for word in DIETARY if word in words],
+                "sugar_content": "low",
+                "sharing": False,
+                "ingredients": [ingredient for ingredient in INGREDIENTS if ingredient in words],
+                "excluded_ingredients": [],
+                "is_recipe_request": True,
+                "language": "english",
+            }
+            return AIMessage(content=json.dumps(content))
+        if "translates recipes" in system:
+            recipes = json.loads(query)
+            translated = [
+                {
+                    "title": f"[es] {recipe['title']}",
+                    "ingredients": [f"[es] {item}" for item in recipe["ingredients"]],
+                    "directions": [f"[es] {item}" for item in recipe["directions"]],
+                }
+                for recipe in recipes
+            ]
+            return AIMessage(content=json.dumps(translated))
+        return AIMessage(content=f"[es] {query}")
+
+    def invoke(prompt_value):
+        time.sleep(latency)
+        return respond(prompt_value)
+
+    async def ainvoke(prompt_value):
+        await asyncio.sleep(latency)
+        return respond(prompt_value)
+
+    return lambda **kwargs: RunnableLambda(invoke, afunc=ainvoke)
+
+
+class FakeResponse:
+    """Minimal stand-in for both the OpenAI images response and the requests response."""
+
+    def __init__(self, url=None, content=b""):
+        self.data = [self]
+        self.url = url
+        self.content = content
+
+    def raise_for_status(self):
+        pass
+
+
+class FakeImagesClient:
+    """Replacement of the OpenAI client for the image generation, answering after `latency` seconds."""
+
+    def __init__(self, latency):
+        self.latency = latency
+        self.images = self
+
+    def generate(self, **kwargs):
+        time.sleep(self.latency)
+        return FakeResponse(url="https://images.local/fake.png")
+
+
+class FakeSession:
+    def get(self, url, timeout=None):
+        return FakeResponse(content=b"\x89PNG fake image")
+
+
+def generate_dataset(path, num_rows, seed=0):
+    """Write a synthetic CSV with the columns and list formats of the RecipeNLG dataset."""
+    rng = random.Random(seed)
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        writer.writerow(["", "title", "ingredients", "directions", "link", "source", "NER"])
+        for i in range(num_rows):
+            ner = rng.sample(INGREDIENTS, rng.randint(3, 9))
+            title = f"{rng.choice(ner).title()} {rng.choice(DISHES)}"
+            ingredients = [f"{rng.choice(UNITS)} {item}" for item in ner]
+            directions = rng.sample(STEPS, rng.randint(2, 5))
+            link = f"www.example.com/recipe/{i}"
+            writer.writerow([i, title, str(ingredients), str(directions), link, "Gathered", str(ner)])
+
+
+def random_profile(rng, language="english"):
+    return UserProfile(
+        {
+            "dietary": rng.sample(DIETARY, 1),
+            "ingredients": rng.sample(INGREDIENTS, rng.randint(1, 3)),
+            "sugar_content": rng.choice(["low", "normal", "high"]),
+            "excluded_ingredients": rng.sample(INGREDIENTS, rng.randint(0, 1)),
+            "language": language,
+            "is_recipe_request": True,
+        }
+    )
+
+
+def latency_summary(latencies):
+    latencies_ms = np.asarray(latencies) * 1000
+    return {
+        "count": len(latencies_ms),
+        "p50_ms": float(np.percentile(latencies_ms, 50)),
+        "p99_ms": float(np.percentile(latencies_ms, 99)),
+        "mean_ms": float(latencies_ms.mean()),
+    }
+
+
+def measure(function, arguments):
+    latencies = []
+    for argument in arguments:
+        start_time = time.perf_counter()
+        function(argument)
+        latencies.append(time.perf_counter() - start_time)
+    return latency_summary(latencies)
+
+
+def measure_concurrent(function, arguments, concurrency):
+    """Call the function from `concurrency` threads at once, like concurrent sessions, and summarize the latencies."""
+
+    def timed(argument):
+        start_time = time.perf_counter()
+        function(argument)
+        return time.perf_counter() - start_time
+
+    start_time = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        latencies = list(executor.map(timed, arguments))
+    run_time = time.perf_counter() - start_time
+    return {**latency_summary(latencies), "concurrency": concurrency, "requests_per_second": len(latencies) / run_time}
+
+
+def measure_cold_start():
+    """Time the imports of the front-ends in a fresh interpreter, as a new process would pay them."""
+    source_dir = Path(__file__).resolve().parents[1] / "src"
+    code = "import time; t = time.perf_counter(); import engine, image_generator, nlp; print(time.perf_counter() - t)"
+    output = subprocess.check_output([sys.executable, "-c", code], cwd=source_dir, text=True)
+    return {"import_seconds": float(output.strip().splitlines()[-1])}
+
+
+def peak_rss_mb():
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if platform.system() == "Darwin" else peak / 1024
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], text=True, stderr=subprocess.DEVNULL).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Run the offline TastyAI benchmark.")
+    parser.add_argument("--rows", type=int, default=10000, help="Number of synthetic recipes (10k to 2M).")
+    parser.add_argument("--queries", type=int, default=200, help="Number of timed queries per measurement.")
+    parser.add_argument("--llm-latency", type=float, default=0.05, help="Latency of the fake LLM, in seconds.")
+    parser.add_argument("--image-latency", type=float, default=0.5, help="Latency of the fake image API, in seconds.")
+    parser.add_argument(
+        "--encoder",
+        choices=["hashing", "minilm"],
+        default="hashing",
+        help=f"Use the offline hashing encoder or the real {MODEL_NAME} (must be available locally).",
+    )
+    parser.add_argument(
+        "--search-mode",
+        choices=["ann", "exact", "sharded", "compressed"],
+        default="ann",
+        help="Search mode to measure.",
+    )
+    parser.add_argument(
+        "--quantize-queries", action="store_true", help="Encode the queries with the int8 model (minilm encoder only)."
+    )
+    parser.add_argument(
+        "--dense-only", action="store_true", help="Search every recipe densely, without the BM25 candidate stage."
+    )
+    parser.add_argument("--concurrency", type=int, default=16, help="Number of concurrent simulated sessions.")
+    parser.add_argument(
+        "--max-batch-size", type=int, default=32, help="Maximum number of queries micro-batched together."
+    )
+    parser.add_argument(
+        "--max-batch-wait-ms", type=float, default=5.0, help="Maximum wait for other queries to join a batch."
+    )
+    parser.add_argument("--workdir", help="Directory for the dataset and the derived files (default: a temp dir).")
+    parser.add_argument("--output", default="benchmark_results.json", help="Where to write the JSON results.")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the synthetic data and queries.")
+    return parser.parse_args()
+
+
+def run():
+    args = parse_args()
+    workdir = Path(args.workdir or tempfile.mkdtemp(prefix="tastyai-benchmark-"))
+    workdir.mkdir(parents=True, exist_ok=True)
+    dataset_path = workdir / "full_dataset.csv"
+    rng = random.Random(args.seed)
+    results = {}
+
+    langchain_openai.ChatOpenAI = fake_chat_openai(args.llm_latency)
+    image_generator._session = FakeSession()
+
+    print(f"Generating {args.rows} synthetic recipes in {workdir}...")
+    start_time = time.perf_counter()
+    generate_dataset(dataset_path, args.rows, seed=args.seed)
+    results["dataset"] = {"rows": args.rows, "generation_seconds": time.perf_counter() - start_time}
+
+    print("Vectorizing...")
+    model = HashingEncoder() if args.encoder == "hashing" else None
+    vectorizer = Vectorizer(
+        str(dataset_path),
+        model=model,
+        num_shards=os.cpu_count() if args.search_mode == "sharded" else None,
+        compressed_dims=128 if args.search_mode == "compressed" else None,
+    )
+    start_time = time.perf_counter()
+    vectorizer.vectorize()
+    vectorize_seconds = time.perf_counter() - start_time
+    results["vectorize"] = {
+        "seconds": vectorize_seconds,
+        "rows_per_second": args.rows / vectorize_seconds,
+        "peak_rss_mb": peak_rss_mb(),
+    }
+
+    print("Measuring the cold start...")
+    results["cold_start"] = measure_cold_start()
+
+    print("Measuring recommendations...")
+    vectorizer.quantize_queries = args.quantize_queries
+    start_time = time.perf_counter()
+    recommendation = Recommendation(
+        vectorizer, openai_key="sk-benchmark", search_mode=args.search_mode, hybrid=not args.dense_only
+    )
+    results["recommendation_startup_seconds"] = time.perf_counter() - start_time
+    english_profiles = [random_profile(rng) for _ in range(args.queries)]
+    results["get_meal_recommendation"] = measure(
+        lambda profile: recommendation.get_meal_recommendation(profile, top_n=3), english_profiles
+    )
+    results["get_meal_recommendation_cached"] = measure(
+        lambda profile: recommendation.get_meal_recommendation(profile, top_n=3), english_profiles
+    )
+    results["search_caches"] = recommendation.cache_stats()
+
+    def recommend_uncached(profile):
+        recommendation.translation_cache = TranslationCache(":memory:")
+        recommendation.get_meal_recommendation(profile, top_n=3)
+
+    spanish_profiles = [random_profile(rng, language="spanish") for _ in range(max(1, args.queries // 10))]
+    results["get_meal_recommendation_translated"] = measure(recommend_uncached, spanish_profiles)
+    results["get_meal_recommendation"]["peak_rss_mb"] = peak_rss_mb()
+
+    print("Measuring concurrent searches...")
+    concurrent_profiles = [random_profile(rng) for _ in range(args.queries)]
+    Recommendation.clear_caches()
+    results["find_meals_concurrent"] = measure_concurrent(
+        lambda profile: recommendation.find_meals(profile, top_n=3), concurrent_profiles, args.concurrency
+    )
+    batched_recommendation = Recommendation(
+        vectorizer,
+        openai_key="sk-benchmark",
+        search_mode=args.search_mode,
+        hybrid=not args.dense_only,
+        max_batch_size=args.max_batch_size,
+        max_batch_wait=args.max_batch_wait_ms / 1000,
+    )
+    Recommendation.clear_caches()
+    results["find_meals_concurrent_batched"] = measure_concurrent(
+        lambda profile: batched_recommendation.find_meals(profile, top_n=3), concurrent_profiles, args.concurrency
+    )
+    if batched_recommendation.query_batcher is not None:
+        batched_recommendation.query_batcher.close()
+
+    print("Measuring user input processing...")
+    user_nlp = nlp.NLP(openai_api_key="sk-benchmark")
+    queries = [
+        f"I want a {rng.choice(DIETARY)} meal with {rng.choice(INGREDIENTS)} and {rng.choice(INGREDIENTS)} #{i}"
+        for i in range(max(1, args.queries // 10))
+    ]
+    results["process_user_input"] = measure(user_nlp.process_user_input, queries)
+    results["process_user_input_cached"] = measure(user_nlp.process_user_input, queries)
+
+    print("Measuring image generation...")
+    generator = ImageGenerator("sk-benchmark", cache_dir=workdir / "image_cache")
+    generator.client = FakeImagesClient(args.image_latency)
+    meals = recommendation.find_meals(english_profiles[0], top_n=3)
+    results["images"] = {
+        "cold": measure(lambda _: [future.result() for future in generator.submit_images(meals)], [None]),
+        "cached": measure(lambda _: [future.result() for future in generator.submit_images(meals)], [None]),
+    }
+
+    report = {
+        "commit": git_commit(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "config": {key: value for key, value in vars(args).items() if key not in ("workdir", "output")},
+        "results": results,
+        "peak_rss_mb": peak_rss_mb(),
+    }
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(json.dumps(results, indent=2))
+    print(f"Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    run()
@@ -0,0 +1,51 @@
+import argparse
+import os
+import sys
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).resolve().parents[1] / "src"))
+
+from recipe_store import RecipeStore  # noqa: E402
+from recommendation_stats import RecommendationStats  # noqa: E402
+from translation_cache import TranslationCache  # noqa: E402
+from translator import Translator  # noqa: E402
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Pre-translate the most recommended recipes into the translation cache."
+    )
+    parser.add_argument("--file-path", default="./tastyai/src/dataset/full_dataset.csv", help="Path to the dataset.")
+    parser.add_argument("--top", type=int, default=1000, help="Number of most recommended recipes to translate.")
+    parser.add_argument(
+        "--languages", nargs="+", default=["spanish", "portuguese"], help="Languages to translate the recipes into."
+    )
+    parser.add_argument(
+        "--openai-api-key", default=os.environ.get("OPENAI_API_KEY"), help="OpenAI API key (default: $OPENAI_API_KEY)."
+    )
+    return parser.parse_args()
+
+
+def run():
+    args = parse_args()
+    if not args.openai_api_key:
+        sys.exit("An OpenAI API key is required, use --openai-api-key or set OPENAI_API_KEY.")
+
+    dataset_path = Path(args.file_path)
+    recipes = RecipeStore(dataset_path.with_name("recipes"))
+    cache = TranslationCache(dataset_path.with_name("translation_cache.sqlite"))
+    recipe_ids = RecommendationStats(dataset_path.with_name("recommendation_stats.sqlite")).most_recommended(args.top)
+    print(f"Pre-translating {len(recipe_ids)} recipes into {', '.join(args.languages)}...")
+
+    for language in args.languages:
+        translator = Translator(openai_key=args.openai_api_key, language=language, cache=cache)
+        for i, recipe_id in enumerate(recipe_ids, start=1):
+            translator.translate_meal(recipes.get(recipe_id))
+            if i % 100 == 0:
+                print(f"{language}: {i}/{len(recipe_ids)} recipes translated")
+
+    print("Pre-translation complete.")
+
+
+if __name__ == "__main__":
+    run()
@@ -1,11 +1,46 @@
-from tastyai.src.vectorizer import Vectorizer
+import argparse
+import sys
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).resolve().parents[1] / "src"))
+
+from vectorizer import Vectorizer  # noqa: E402
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Vectorize the recipes dataset.")
+    parser.add_argument("--file-path", default="./tastyai/src/dataset/full_dataset.csv", help="Path to the dataset.")
+    parser.add_argument("--workers", type=int, default=1, help="Number of CPU worker processes used to encode.")
+    parser.add_argument("--chunk-size", type=int, default=50000, help="Number of rows read from the CSV at a time.")
+    parser.add_argument("--batch-size", type=int, default=32, help="Number of texts encoded per model call.")
+    parser.add_argument(
+        "--shards", type=int, default=0, help="Also write the embeddings as this many shards for the sharded search."
+    )
+    parser.add_argument(
+        "--compress-dims",
+        type=int,
+        default=0,
+        help=(
+            "Also write an int8 compressed copy of the embeddings, reduced to this many dimensions with PCA, for the "
+            "compressed search. It must be smaller than 384: int8 codes with every dimension are not faster to scan "
+            "than the embeddings."
+        ),
+    )
+    return parser.parse_args()
 
 
 def run():
+    args = parse_args()
     print("Running vectorize.py...")
-    vectorizer = Vectorizer("./tastyai/src/dataset/full_dataset.csv")
-    _ = vectorizer.vectorize()
-    print("Vectorization complete.")
+    vectorizer = Vectorizer(
+        args.file_path,
+        batch_size=args.batch_size,
+        chunk_size=args.chunk_size,
+        num_shards=args.shards,
+        compressed_dims=args.compress_dims,
+    )
+    embeddings = vectorizer.vectorize(num_workers=args.workers)
+    print(f"Vectorization complete: {embeddings.shape[0]} recipes.")
 
 
 if __name__ == "__main__":
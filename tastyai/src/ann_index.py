@@ -0,0 +1,146 @@
+import logging
+
+import numpy as np
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+def _normalize(vectors):
+    """Scale each row to unit length, leaving all-zero rows untouched."""
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+
+class IVFIndex:
+    """Inverted-file (IVF) approximate nearest-neighbour index over the recipe embeddings.
+
+    The embeddings are clustered with spherical k-means; each row is assigned to its closest centroid and a query
+    only scores the rows of the `nprobe` closest lists. The vectors themselves are not copied: the index keeps the
+    row ids grouped by list and reads the candidates straight from the (memory-mapped) embeddings.
+    """
+
+    def __init__(self, centroids, offsets, ids, norms):
+        self.centroids = centroids
+        self.offsets = offsets
+        self.ids = ids
+        self.norms = norms
+
+    @property
+    def n_lists(self):
+        return len(self.centroids)
+
+    @classmethod
+    def build(cls, embeddings, n_lists=None, sample_size=100000, n_iter=10, block_size=65536, seed=0, rows=None):
+        """Train the centroids on a sample of the embeddings and assign every row to a list.
+
+        With `rows`, a sorted array of row ids, only those rows are indexed.
+        """
+        num_rows = len(embeddings) if rows is None else len(rows)
+        n_lists = n_lists or max(1, int(np.sqrt(num_rows)))
+        rng = np.random.default_rng(seed)
+
+        sample_ids = np.sort(rng.choice(num_rows, size=min(sample_size, num_rows), replace=False))
+        if rows is not None:
+            sample_ids = rows[sample_ids]
+        sample = _normalize(np.asarray(embeddings[sample_ids], dtype=np.float32))
+        n_lists = min(n_lists, len(sample))
+        centroids = sample[rng.choice(len(sample), size=n_lists, replace=False)]
+
+        logger.debug(f"Training IVF index with {n_lists} lists on {len(sample)} samples...")
+        for _ in range(n_iter):
+            assignments = np.argmax(sample @ centroids.T, axis=1)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, assignments, sample)
+            counts = np.bincount(assignments, minlength=n_lists)
+            empty = counts == 0
+            # Re-seed empty lists with random samples so every list stays usable
+            sums[empty] = sample[rng.choice(len(sample), size=int(empty.sum()))]
+            centroids = _normalize(sums)
+
+        return cls.assign(embeddings, centroids, block_size=block_size, rows=rows)
+
+    @classmethod
+    def assign(cls, embeddings, centroids, block_size=65536, rows=None):
+        """Build the lists of already trained centroids, assigning every row (or only `rows`) to its closest
+        centroid."""
+        rows = np.arange(len(embeddings)) if rows is None else rows
+        n_lists = len(centroids)
+        assignments = np.empty(len(rows), dtype=np.int64)
+        norms = np.zeros(len(embeddings), dtype=np.float32)
+        for start in range(0, len(rows), block_size):
+            end = start + block_size
+            block_rows = rows[start:end]
+            block = np.asarray(embeddings[block_rows], dtype=np.float32)
+            norms[block_rows] = np.linalg.norm(block, axis=1)
+            assignments[start:end] = np.argmax(block @ centroids.T, axis=1)
+
+        ids = rows[np.argsort(assignments, kind="stable")]
+        offsets = np.zeros(n_lists + 1, dtype=np.int64)
+        np.cumsum(np.bincount(assignments, minlength=n_lists), out=offsets[1:])
+        return cls(centroids.astype(np.float32), offsets, ids, norms)
+
+    def search(self, query, embeddings, k, nprobe=16, excluded=None):
+        """Approximate cosine top-k, scanning the `nprobe` closest lists. Returns (scores, indices) sorted by score.
+
+        Rows flagged in the `excluded` boolean mask are dropped before scoring.
+        """
+        query = _normalize(np.asarray(query, dtype=np.float32))
+        nprobe = min(nprobe, self.n_lists)
+        centroid_scores = self.centroids @ query
+        probes = np.argpartition(-centroid_scores, nprobe - 1)[:nprobe]
+
+        starts, ends = self.offsets[probes], self.offsets[probes + 1]
+        candidates = np.sort(np.concatenate([self.ids[start:end] for start, end in zip(starts, ends)]))
+        if excluded is not None:
+            candidates = candidates[~excluded[candidates]]
+        if len(candidates) == 0:
+            return np.empty(0, dtype=np.float32), candidates
+
+        scores = np.asarray(embeddings[candidates], dtype=np.float32) @ query
+        scores /= np.maximum(self.norms[candidates], 1e-12)
+        k = min(k, len(candidates))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return scores[top], candidates[top]
+
+    def recall_at_k(self, embeddings, k=10, nprobe=16, num_queries=100, block_size=65536, seed=0, excluded=None):
+        """Measure the fraction of the exact top-k that the index returns.
+
+        Queries are the normalized average of two random recipes, so they do not trivially match a stored row. Rows
+        flagged in the `excluded` mask (e.g. the ones left out of the index) are left out of the exact top-k too.
+        """
+        rng = np.random.default_rng(seed)
+        pairs = np.sort(rng.choice(len(embeddings), size=(num_queries, 2)), axis=1)
+        pair_vectors = _normalize(np.asarray(embeddings[pairs.ravel()], dtype=np.float32))
+        queries = _normalize(pair_vectors.reshape(num_queries, 2, -1).mean(axis=1))
+
+        # Exact top-k of every query in a single blocked pass over the embeddings
+        best_scores = np.full((num_queries, k), -np.inf, dtype=np.float32)
+        best_ids = np.zeros((num_queries, k), dtype=np.int64)
+        for start in range(0, len(embeddings), block_size):
+            end = start + block_size
+            block = _normalize(np.asarray(embeddings[start:end], dtype=np.float32))
+            block_scores = queries @ block.T
+            if excluded is not None:
+                block_scores[:, excluded[start:end]] = -np.inf
+            scores = np.concatenate([best_scores, block_scores], axis=1)
+            block_ids = np.broadcast_to(np.arange(start, start + len(block)), (num_queries, len(block)))
+            ids = np.concatenate([best_ids, block_ids], axis=1)
+            keep = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+            best_scores, best_ids = np.take_along_axis(scores, keep, axis=1), np.take_along_axis(ids, keep, axis=1)
+
+        hits = 0
+        for query, exact_ids in zip(queries, best_ids):
+            _, approx_ids = self.search(query, embeddings, k, nprobe=nprobe)
+            hits += len(np.intersect1d(exact_ids, approx_ids))
+        return hits / (num_queries * k)
+
+    def save(self, path):
+        with open(path, "wb") as f:
+            np.savez(f, centroids=self.centroids, offsets=self.offsets, ids=self.ids, norms=self.norms)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            return cls(data["centroids"], data["offsets"], data["ids"], data["norms"])
@@ -1,17 +1,76 @@
 import logging
-from io import BytesIO
 
-import requests
 import streamlit as st
+import tracing
+from engine import RecommendationEngine
 from image_generator import ImageGenerator
 from nlp import NLP
-from PIL import Image
-from recommendation import Recommendation
-from vectorizer import Vectorizer
 
 logging.basicConfig(level=logging.ERROR)
 logger = logging.getLogger(__name__)
 
+
+@st.cache_resource(show_spinner="Loading recipes...")
+def load_engine():
+    """Create the recommendation engine once per server process, shared by every session."""
+    return RecommendationEngine()
+
+
+def render_meal(placeholder, meal, language):
+    """Render a meal inside a placeholder; untranslated meals are shown in english until their translation arrives."""
+    title = meal.get("translated_title", meal["title"])
+    ingredients = meal.get("translated_ingredients", meal["ingredients"])
+    directions = meal.get("translated_directions", meal["directions"])
+
+    with placeholder.container():
+        st.markdown(f"#### {title}")
+        if language == "spanish" or language == "portuguese":
+            st.markdown("**Ingredientes:**")
+        else:
+            st.markdown("**Ingredients:**")
+
+        st.markdown("\n".join([f"- {ingredient}" for ingredient in ingredients]))
+        if language == "spanish":
+            st.markdown("**Instrucciones:**")
+        elif language == "portuguese":
+            st.markdown("**Instruções:**")
+        else:
+            st.markdown("**Directions:**")
+
+        st.markdown("\n".join([f"{i + 1}. {step}" for i, step in enumerate(directions)]))
+
+
+def render_image_progress(placeholder, meal, language):
+    title = meal.get("translated_title", meal["title"])
+    spinner_message = f"Generating image for {title}..."
+    if language == "spanish":
+        spinner_message = f"Generando imagen para {title}..."
+    elif language == "portuguese":
+        spinner_message = f"Gerando imagem para {title}..."
+    placeholder.info(spinner_message)
+
+
+def render_image(placeholder, image_path, meal, language):
+    title = meal.get("translated_title", meal["title"])
+    if image_path:
+        from PIL import Image
+
+        img = Image.open(image_path)
+        if language == "spanish":
+            placeholder.image(img, caption=f"Imagen generada por IA de {title}")
+        elif language == "portuguese":
+            placeholder.image(img, caption=f"Imagem gerada por IA de {title}")
+        else:
+            placeholder.image(img, caption=f"AI-generated image of {title}")
+    else:
+        if language == "spanish":
+            placeholder.warning("No se pudo generar una imagen para esta comida.")
+        elif language == "portuguese":
+            placeholder.warning("Não foi possível gerar uma imagem para esta refeição.")
+        else:
+            placeholder.warning("Could not generate an image for this meal.")
+
+
 logger.debug("Starting TastyAI chat app")
 openai_api_key = st.sidebar.text_input("OpenAI API Key", type="password")
 
@@ -28,7 +87,8 @@ with st.form("my_form"):
         with st.spinner("Working on it..."):
             nlp = NLP(openai_api_key=openai_api_key)
 
-            user_profile = nlp.process_user_input(text)
+            with tracing.trace("user_input", frontend="chat"):
+                user_profile = nlp.process_user_input(text)
 
         if not user_profile.is_recipe_request:
             if user_profile.language == "spanish":
@@ -48,12 +108,9 @@ with st.form("my_form"):
                 initial_message = "Generating meal recommendations..."
 
         with st.spinner(initial_message):
-            vectorizer = Vectorizer("./tastyai/src/dataset/full_dataset.csv")
+            engine = load_engine()
             image_generator = ImageGenerator(openai_api_key)
-            recommendation = Recommendation(vectorizer, openai_api_key)
             logger.debug("Getting recommendations...")
-            recommendations = recommendation.get_meal_recommendation(user_profile, top_n=3)
-            logger.debug(f"Recommendations: {recommendations}")
 
             if user_profile.language == "spanish":
                 st.markdown("### Según tus preferencias, te recomiendo las siguientes comidas:")
@@ -62,54 +119,25 @@ with st.form("my_form"):
             else:
                 st.markdown("### Based on your preferences, I recommend the following meals:")
 
-            for meal in recommendations:
-                st.markdown(f"#### {meal['translated_title']}")
-                if user_profile.language == "spanish" or user_profile.language == "portuguese":
-                    st.markdown("**Ingredientes:**")
-                else:
-                    st.markdown("**Ingredients:**")
-
-                st.markdown("\n".join([f"- {ingredient}" for ingredient in meal["translated_ingredients"]]))
-                if user_profile.language == "spanish":
-                    st.markdown("**Instrucciones:**")
-                elif user_profile.language == "portuguese":
-                    st.markdown("**Instruções:**")
-                else:
-                    st.markdown("**Directions:**")
-
-                st.markdown("\n".join([f"{i + 1}. {step}" for i, step in enumerate(meal["translated_directions"])]))
-
-                spinner_message = f"Generating image for {meal['translated_title']}..."
-                if user_profile.language == "spanish":
-                    spinner_message = f"Generando imagen para {meal['translated_title']}..."
-                elif user_profile.language == "portuguese":
-                    spinner_message = f"Gerando imagem para {meal['translated_title']}..."
-                with st.spinner(spinner_message):
-                    image_url = image_generator.generate_image(meal)
-
-                if image_url:
-                    with st.spinner(spinner_message):
-                        response = requests.get(image_url)
-                        img = Image.open(BytesIO(response.content))
-                    if user_profile.language == "spanish":
-                        st.image(
-                            img,
-                            caption=(f"Imagen generada por IA de {meal['translated_title']}"),
-                        )
-                    elif user_profile.language == "portuguese":
-                        st.image(
-                            img,
-                            caption=(f"Imagem gerada por IA de {meal['translated_title']}"),
-                        )
-                    else:
-                        st.image(
-                            caption=(f"AI-generated image of {meal['translated_title']}"),
-                        )
-                else:
-                    if user_profile.language == "spanish":
-                        st.warning("No se pudo generar una imagen para esta comida.")
-                    elif user_profile.language == "portuguese":
-                        st.warning("Não foi possível gerar uma imagem para esta refeição.")
-                    else:
-                        st.warning("Could not generate an image for this meal.")
-                st.markdown("---")
+            with tracing.trace("recommendation", frontend="chat", language=user_profile.language):
+                meals = {}
+                placeholders = {}
+                for stage, position, payload in engine.stream_recommendations(
+                    user_profile, openai_api_key, image_generator, top_n=3
+                ):
+                    logger.debug(f"Recommendation event: {stage} {position}")
+                    if stage == "found":
+                        with st.container():
+                            placeholders[position] = (st.empty(), st.empty())
+                            st.markdown("---")
+                        text_placeholder, image_placeholder = placeholders[position]
+                        render_meal(text_placeholder, payload, user_profile.language)
+                        render_image_progress(image_placeholder, payload, user_profile.language)
+                        meals[position] = payload
+                    elif stage == "translated":
+                        text_placeholder, image_placeholder = placeholders[position]
+                        render_meal(text_placeholder, payload, user_profile.language)
+                        render_image_progress(image_placeholder, payload, user_profile.language)
+                        meals[position] = payload
+                    elif stage == "image":
+                        render_image(placeholders[position][1], payload, meals[position], user_profile.language)
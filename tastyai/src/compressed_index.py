@@ -0,0 +1,153 @@
+import logging
+import time
+
+import numpy as np
+from exact_index import ExactIndex, merge_top_k
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+class CompressedIndex:
+    """Compressed copy of the embeddings, searched first, with the shortlist re-ranked on the full vectors.
+
+    The embeddings are projected on their `dims` first principal components and every component is quantized to int8
+    with its own scale. The mean, the components and the scales form the codebook. A dot product with the codes
+    approximates the cosine similarity up to a constant, so the first pass scans the codes (4 * 384 / dims times
+    smaller than the float32 vectors) and only the `shortlist` best rows are read from the memory-mapped embeddings
+    and scored exactly.
+
+    The codes are converted to float32 a small block at a time, into a buffer reused for the whole scan, so the
+    matrix products still run on BLAS without allocating a float32 copy of each block. That conversion costs about
+    as much as scanning float32 vectors of the same size, so the codes are only faster to scan with fewer dimensions:
+    `dims` must be smaller than the dimension of the embeddings.
+    """
+
+    def __init__(self, mean, components, scales, codes, block_size=1024, scores_block_size=65536):
+        self.mean = mean
+        self.components = components
+        self.scales = scales
+        self.codes = codes
+        self.block_size = block_size
+        self.scores_block_size = scores_block_size
+
+    @property
+    def dims(self):
+        return self.components.shape[1]
+
+    @property
+    def nbytes(self):
+        """Size of the codes and the codebook."""
+        return self.codes.nbytes + self.mean.nbytes + self.components.nbytes + self.scales.nbytes
+
+    @classmethod
+    def build(cls, embeddings, codes_path, dims, sample_size=100000, block_size=65536, seed=0):
+        """Train the codebook on a sample of the embeddings and write the codes of every row to `codes_path`."""
+        num_rows, dimension = embeddings.shape
+        if not 0 < dims < dimension:
+            raise ValueError(
+                f"The compressed index needs between 1 and {dimension - 1} dimensions, got {dims}: int8 codes with "
+                "every dimension are not faster to scan than the float32 embeddings"
+            )
+        rng = np.random.default_rng(seed)
+        sample_ids = np.sort(rng.choice(num_rows, size=min(sample_size, num_rows), replace=False))
+        sample = np.asarray(embeddings[sample_ids], dtype=np.float32)
+
+        mean = sample.mean(axis=0)
+        _, _, components = np.linalg.svd(sample - mean, full_matrices=False)
+        components = np.ascontiguousarray(components[:dims].T)
+        projected = (sample - mean) @ components
+        scales = np.maximum(np.abs(projected).max(axis=0), 1e-12) / 127
+
+        codes = np.lib.format.open_memmap(codes_path, mode="w+", dtype=np.int8, shape=(num_rows, dims))
+        for start in range(0, num_rows, block_size):
+            end = start + block_size
+            block = (np.asarray(embeddings[start:end], dtype=np.float32) - mean) @ components
+            codes[start:end] = np.clip(np.rint(block / scales), -127, 127)
+        codes.flush()
+        del codes
+        return cls(
+            mean.astype(np.float32),
+            components.astype(np.float32),
+            scales.astype(np.float32),
+            np.load(codes_path, mmap_mode="r"),
+        )
+
+    def __scan(self, projected_query, k, excluded=None):
+        """Return the ids of the k rows whose codes score best against the projected query."""
+        num_rows = len(self.codes)
+        k = min(k, num_rows)
+        block_buffer = np.empty((self.block_size, self.dims), dtype=np.float32)
+        scores_buffer = np.empty(self.scores_block_size, dtype=np.float32)
+        best_scores = np.full(k, -np.inf, dtype=np.float32)
+        best_indices = np.zeros(k, dtype=np.int64)
+
+        for start in range(0, num_rows, self.scores_block_size):
+            end = min(start + self.scores_block_size, num_rows)
+            codes = self.codes[start:end]
+            scores = scores_buffer[: len(codes)]
+            for offset in range(0, len(codes), self.block_size):
+                offset_end = offset + self.block_size
+                block = codes[offset:offset_end]
+                np.copyto(block_buffer[: len(block)], block, casting="unsafe")
+                np.dot(block_buffer[: len(block)], projected_query, out=scores[offset:offset_end])
+            if excluded is not None:
+                scores[excluded[start:end]] = -np.inf
+            best_scores, best_indices = merge_top_k(best_scores, best_indices, scores, start, k)
+
+        return best_indices[np.isfinite(best_scores)]
+
+    def search(self, query, embeddings, k, shortlist=100, excluded=None):
+        """Return (scores, indices) of the k best rows sorted by their exact score.
+
+        The `shortlist` best rows of the compressed codes are re-ranked with the full-precision embeddings; `excluded`
+        works as in ExactIndex.search.
+        """
+        query = np.asarray(query, dtype=np.float32)
+        projected_query = (self.components.T @ query) * self.scales
+        candidates = self.__scan(projected_query, max(k, shortlist), excluded=excluded)
+        if len(candidates) == 0:
+            return np.empty(0, dtype=np.float32), candidates
+
+        # Reading the rows in order keeps the accesses to the memory-mapped embeddings sequential
+        candidates = np.sort(candidates)
+        scores = np.asarray(embeddings[candidates], dtype=np.float32) @ query
+        top = np.argsort(-scores)[:k]
+        return scores[top], candidates[top]
+
+    def evaluate(self, embeddings, k=10, shortlist=100, num_queries=100, seed=0):
+        """Measure the fraction of the exact float32 top-k that the compressed search returns, and the mean latency
+        of both searches.
+
+        Queries are the normalized average of two random recipes, like for the ANN index.
+        """
+        rng = np.random.default_rng(seed)
+        pairs = np.sort(rng.choice(len(embeddings), size=(num_queries, 2)), axis=1)
+        queries = np.asarray(embeddings[pairs.ravel()], dtype=np.float32).reshape(num_queries, 2, -1).mean(axis=1)
+        queries /= np.maximum(np.linalg.norm(queries, axis=1, keepdims=True), 1e-12)
+
+        exact_index = ExactIndex(embeddings)
+        hits, latency, exact_latency = 0, 0.0, 0.0
+        for query in queries:
+            start_time = time.perf_counter()
+            _, exact_ids = exact_index.search(query, k)
+            exact_latency += time.perf_counter() - start_time
+            start_time = time.perf_counter()
+            _, approx_ids = self.search(query, embeddings, k, shortlist=shortlist)
+            latency += time.perf_counter() - start_time
+            hits += len(np.intersect1d(exact_ids, approx_ids))
+        return {
+            f"recall@{k}": hits / (num_queries * k),
+            "latency_ms": latency / num_queries * 1000,
+            "exact_latency_ms": exact_latency / num_queries * 1000,
+        }
+
+    def save(self, path):
+        """Save the codebook; the codes are already in their own file."""
+        with open(path, "wb") as f:
+            np.savez(f, mean=self.mean, components=self.components, scales=self.scales)
+
+    @classmethod
+    def load(cls, path, codes_path):
+        with np.load(path) as data:
+            return cls(data["mean"], data["components"], data["scales"], np.load(codes_path, mmap_mode="r"))
@@ -0,0 +1,99 @@
+import hashlib
+import logging
+import re
+
+import numpy as np
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Minimum cosine similarity of the embeddings of two recipes with the same signature to collapse them
+DUPLICATE_SIMILARITY = 0.95
+
+
+def _signature(values):
+    """Return a 64-bit hash of a set of normalized strings, or 0 when it is empty."""
+    if not values:
+        return 0
+    digest = hashlib.blake2b("\n".join(sorted(values)).encode("utf-8"), digest_size=8).digest()
+    return int.from_bytes(digest, "little") or 1
+
+
+def _title_signature(title):
+    return _signature(set(re.findall(r"[a-z0-9]+", str(title).lower())))
+
+
+def _ingredient_signature(ner):
+    return _signature({" ".join(str(item).lower().split()) for item in ner} - {""})
+
+
+class DuplicateIndex:
+    """Mapping of every recipe to the representative of its group of near-duplicates.
+
+    Two recipes are near-duplicates when they have the same normalized title words or the same set of NER ingredients,
+    and their embeddings are almost identical. Each group is collapsed to its first row: the other rows are left out of
+    the ANN and BM25 indexes, and masked out of the searches that scan every row.
+    """
+
+    def __init__(self, representative_of):
+        self.representative_of = representative_of
+        self.mask = representative_of != np.arange(len(representative_of))
+        self.representatives = np.flatnonzero(~self.mask)
+
+    @property
+    def num_rows(self):
+        return len(self.representative_of)
+
+    @classmethod
+    def build(cls, recipe_store, embeddings, threshold=DUPLICATE_SIMILARITY, block_size=1024):
+        """Group the recipes that share a signature and whose embeddings have a cosine similarity above threshold."""
+        num_rows = len(recipe_store)
+        title_signatures = np.empty(num_rows, dtype=np.uint64)
+        ingredient_signatures = np.empty(num_rows, dtype=np.uint64)
+        for index in range(num_rows):
+            title_signatures[index] = _title_signature(recipe_store.get_column("title", index))
+            ingredient_signatures[index] = _ingredient_signature(recipe_store.get_column("NER", index))
+
+        parent = np.arange(num_rows)
+
+        def find(row):
+            while parent[row] != row:
+                parent[row] = parent[parent[row]]
+                row = parent[row]
+            return row
+
+        for signatures in (title_signatures, ingredient_signatures):
+            order = np.argsort(signatures, kind="stable")
+            sorted_signatures = signatures[order]
+            starts = np.flatnonzero(np.r_[True, sorted_signatures[1:] != sorted_signatures[:-1]])
+            ends = np.r_[starts[1:], num_rows]
+            for start, end in zip(starts, ends):
+                if end - start < 2 or sorted_signatures[start] == 0:
+                    continue
+                # The rows of a group are in dataset order, so each row is linked to the first earlier similar row
+                group = order[start:end]
+                vectors = np.asarray(embeddings[group], dtype=np.float32)
+                for block_start in range(1, len(group), block_size):
+                    block_end = block_start + block_size
+                    similar = vectors[block_start:block_end] @ vectors.T >= threshold
+                    similar &= np.arange(len(group)) < np.arange(block_start, block_start + len(similar))[:, None]
+                    for i in np.flatnonzero(similar.any(axis=1)):
+                        first, row = find(group[np.argmax(similar[i])]), find(group[block_start + i])
+                        parent[max(first, row)] = min(first, row)
+
+        # Every row ends up pointing to the lowest row of its group
+        while True:
+            grandparent = parent[parent]
+            if np.array_equal(grandparent, parent):
+                break
+            parent = grandparent
+        return cls(parent)
+
+    def save(self, path):
+        with open(path, "wb") as f:
+            np.savez(f, representative_of=self.representative_of)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            return cls(data["representative_of"])
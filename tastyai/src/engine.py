@@ -0,0 +1,101 @@
+import logging
+import os
+import queue
+import threading
+import time
+
+import tracing
+from recommendation import Recommendation
+from user_profile import UserProfile
+from vectorizer import Vectorizer
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+DATASET_PATH = "./tastyai/src/dataset/full_dataset.csv"
+# Set TASTYAI_QUANTIZE_QUERIES=1 to encode the queries with the int8 model
+QUANTIZE_QUERIES = os.environ.get("TASTYAI_QUANTIZE_QUERIES") == "1"
+# Set TASTYAI_HYBRID_SEARCH=0 to search every recipe with the dense model, without the BM25 candidate stage
+HYBRID_SEARCH = os.environ.get("TASTYAI_HYBRID_SEARCH", "1") != "0"
+# The queries of concurrent sessions arriving within TASTYAI_MAX_BATCH_WAIT_MS of each other are encoded and searched
+# together, up to TASTYAI_MAX_BATCH_SIZE queries per batch (1 disables the batching)
+MAX_BATCH_SIZE = int(os.environ.get("TASTYAI_MAX_BATCH_SIZE", "32"))
+MAX_BATCH_WAIT = float(os.environ.get("TASTYAI_MAX_BATCH_WAIT_MS", "5")) / 1000
+
+
+class RecommendationEngine:
+    """Long-lived recommendation engine shared by every request of a front-end.
+
+    The sentence transformer, the embeddings, the search indexes and the recipes are loaded once when the engine is
+    created; each request then only pays for the search itself (and the translation, when needed). The OpenAI key is
+    given per request, so users with different keys can share the same engine. With `quantize_queries`, the queries
+    are encoded by a dynamically quantized (int8) CPU model, as long as its results agree enough with the fp32 model.
+    With `hybrid`, the dense model only scores the candidates that the BM25 index finds for the profile.
+    The engine is shared by the threads of every session: with `max_batch_size` > 1, the queries that arrive within
+    `max_batch_wait` seconds of each other are encoded as one batch, and searched together when the search is exact.
+    """
+
+    def __init__(
+        self,
+        file_path=DATASET_PATH,
+        search_mode="ann",
+        nprobe=16,
+        quantize_queries=QUANTIZE_QUERIES,
+        hybrid=HYBRID_SEARCH,
+        max_batch_size=MAX_BATCH_SIZE,
+        max_batch_wait=MAX_BATCH_WAIT,
+    ):
+        start_time = time.time()
+        self.vectorizer = Vectorizer(file_path, quantize_queries=quantize_queries)
+        self.recommendation = Recommendation(
+            self.vectorizer,
+            openai_key=None,
+            search_mode=search_mode,
+            nprobe=nprobe,
+            hybrid=hybrid,
+            max_batch_size=max_batch_size,
+            max_batch_wait=max_batch_wait,
+        )
+        logger.info(f"Recommendation engine ready in {time.time() - start_time:.2f}s")
+
+    def stream_recommendations(self, user_profile: UserProfile, openai_key, image_generator=None, top_n=3):
+        """Yield the recommendations stage by stage, as soon as each one is ready.
+
+        The events are ("found", position, meal) for the untranslated recipes, ("translated", position, meal) for the
+        translated ones and, with an image generator, ("image", position, image_path) for the images, whose
+        generation starts right after the search. The recommendations are produced by a background thread and the
+        images by the image generator, both feeding the same queue, so the events come in the order they finish.
+        """
+        events = queue.Queue()
+
+        def produce():
+            try:
+                for stage, position, meal in self.recommendation.iter_meal_recommendation(
+                    user_profile, top_n=top_n, openai_key=openai_key
+                ):
+                    events.put((stage, position, meal))
+                    if stage == "found" and image_generator is not None:
+                        (future,) = image_generator.submit_images([meal])
+                        future.add_done_callback(
+                            lambda future, position=position: events.put(("image", position, future))
+                        )
+            except Exception as e:
+                events.put(("error", None, e))
+            else:
+                events.put(("done", None, None))
+
+        threading.Thread(target=tracing.propagate(produce), daemon=True).start()
+        pending_images, done = 0, False
+        while not done or pending_images:
+            stage, position, payload = events.get()
+            if stage == "error":
+                raise payload
+            elif stage == "done":
+                done = True
+                continue
+            elif stage == "image":
+                pending_images -= 1
+                payload = payload.result()
+            elif stage == "found" and image_generator is not None:
+                pending_images += 1
+            yield stage, position, payload
@@ -0,0 +1,96 @@
+import numpy as np
+
+
+def merge_top_k(best_scores, best_indices, scores, start, k):
+    """Merge the scores of a block of rows starting at row `start` into the running top-k, returned unsorted."""
+    # Only the entries that beat the current k-th best score can enter the top-k
+    candidates = np.flatnonzero(scores > best_scores.min())
+    if len(candidates) == 0:
+        return best_scores, best_indices
+    merged_scores = np.concatenate([best_scores, scores[candidates]])
+    merged_indices = np.concatenate([best_indices, candidates + start])
+    keep = np.argpartition(-merged_scores, k - 1)[:k]
+    return merged_scores[keep], merged_indices[keep]
+
+
+class ExactIndex:
+    """Exact cosine top-k over unit-normalized embeddings, scanned block by block straight from the memory map.
+
+    The embeddings are never copied: each block is a view of the memory-mapped file, so several processes can share
+    the same page-cached store. Every query only allocates a score buffer of one block plus its k best candidates.
+    """
+
+    def __init__(self, embeddings, block_size=65536):
+        self.embeddings = embeddings
+        self.block_size = block_size
+
+    def search(self, query, k, excluded=None):
+        """Return (scores, indices) of the k best rows sorted by score.
+
+        Rows flagged in the `excluded` boolean mask are never returned, so fewer than k rows may come back.
+        """
+        query = np.asarray(query, dtype=np.float32)
+        num_rows = len(self.embeddings)
+        k = min(k, num_rows)
+
+        scores_buffer = np.empty(self.block_size, dtype=np.float32)
+        best_scores = np.full(k, -np.inf, dtype=np.float32)
+        best_indices = np.zeros(k, dtype=np.int64)
+
+        for start in range(0, num_rows, self.block_size):
+            end = start + self.block_size
+            block = self.embeddings[start:end]
+            scores = np.dot(block, query, out=scores_buffer[: len(block)])
+            if excluded is not None:
+                scores[excluded[start:end]] = -np.inf
+
+            best_scores, best_indices = merge_top_k(best_scores, best_indices, scores, start, k)
+
+        found = np.isfinite(best_scores)
+        best_scores, best_indices = best_scores[found], best_indices[found]
+        order = np.argsort(-best_scores)
+        return best_scores[order], best_indices[order]
+
+    def search_batch(self, queries, k, excluded=None):
+        """Return (scores, indices) of the k best rows of several queries at once, each of shape (num_queries, k).
+
+        Every block is scored against all the queries with a single matrix-matrix product. `excluded` holds one
+        boolean mask (or None) per query; queries sharing the same mask object are filtered together. Rows are sorted
+        by score, and padded with -inf scores and -1 indices when fewer than k rows are left for a query.
+        """
+        queries = np.asarray(queries, dtype=np.float32)
+        num_queries, num_rows = len(queries), len(self.embeddings)
+        k = min(k, num_rows)
+
+        mask_groups = {}
+        for i, mask in enumerate(excluded if excluded is not None else []):
+            if mask is not None:
+                mask_groups.setdefault(id(mask), (mask, []))[1].append(i)
+
+        scores_buffer = np.empty((num_queries, self.block_size), dtype=np.float32)
+        best_scores = np.full((num_queries, k), -np.inf, dtype=np.float32)
+        best_indices = np.full((num_queries, k), -1, dtype=np.int64)
+
+        for start in range(0, num_rows, self.block_size):
+            end = start + self.block_size
+            block = self.embeddings[start:end]
+            # np.dot only writes to a contiguous buffer of the exact shape, which the last block does not have
+            scores = np.dot(queries, block.T, out=scores_buffer if len(block) == self.block_size else None)
+            for mask, rows in mask_groups.values():
+                masked = np.flatnonzero(mask[start:end])
+                if len(masked):
+                    scores[np.ix_(rows, masked)] = -np.inf
+
+            block_k = min(k, len(block))
+            top = np.argpartition(-scores, block_k - 1, axis=1)[:, :block_k]
+            merged_scores = np.concatenate([best_scores, np.take_along_axis(scores, top, axis=1)], axis=1)
+            merged_indices = np.concatenate([best_indices, top + start], axis=1)
+            keep = np.argpartition(-merged_scores, k - 1, axis=1)[:, :k]
+            best_scores = np.take_along_axis(merged_scores, keep, axis=1)
+            best_indices = np.take_along_axis(merged_indices, keep, axis=1)
+
+        order = np.argsort(-best_scores, axis=1)
+        best_scores = np.take_along_axis(best_scores, order, axis=1)
+        best_indices = np.take_along_axis(best_indices, order, axis=1)
+        best_indices[~np.isfinite(best_scores)] = -1
+        return best_scores, best_indices
@@ -1,14 +1,49 @@
+import functools
+import hashlib
+import json
 import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
 
-import openai
+import requests
+import tracing
+from lazy_import import lazy_import
+from requests.adapters import HTTPAdapter
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+openai = lazy_import("openai")
+
+DEFAULT_CACHE_DIR = "./tastyai/src/dataset/image_cache"
+
+# Shared by every ImageGenerator of the process, so the image downloads reuse pooled connections
+_session = requests.Session()
+_session.mount("https://", HTTPAdapter(pool_connections=4, pool_maxsize=16))
+_executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix="image-generator")
+_eviction_lock = threading.Lock()
+# The lazily imported openai module is not safe to load from several threads at once, and the first images of a
+# request are generated on several pool threads, so the first client creation is serialized
+_client_lock = threading.Lock()
+# Images used this recently are never evicted, so a path handed to a caller stays valid while it is rendered
+MIN_EVICTION_AGE = 60
+
 
 class ImageGenerator:
-    def __init__(self, api_key):
+    def __init__(self, api_key, cache_dir=DEFAULT_CACHE_DIR, max_cache_bytes=512 * 1024 * 1024):
         self.api_key = api_key
+        self.cache_dir = Path(cache_dir)
+        self.max_cache_bytes = max_cache_bytes
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+
+    @functools.cached_property
+    def client(self):
+        """The OpenAI client, created when the first image is generated."""
+        with _client_lock:
+            return openai.OpenAI(api_key=self.api_key)
 
     def __get_prompt(self, title, ingredients):
         prompt = f"A beautiful photo of {title} with ingredients: {', '.join(ingredients)}."
@@ -16,16 +51,63 @@ class ImageGenerator:
 
     def generate_image(self, meal: dict, model="dall-e-2"):
         """Generate an image using OpenAI's DALL-E API."""
-        openai.api_key = self.api_key
         try:
-            response = openai.images.generate(
+            response = self.client.images.generate(
                 prompt=self.__get_prompt(meal.get("title"), meal.get("ingredients")),
                 model=model,
                 n=1,
                 size="512x512",
             )
+            tracing.record_llm_call()
             image_url = response.data[0].url
             return image_url
         except Exception as e:
             logger.error(f"Error generating image: {e}")
             return None
+
+    def __cache_path(self, meal: dict, model):
+        prompt = self.__get_prompt(meal.get("title"), meal.get("ingredients"))
+        key = hashlib.sha256(json.dumps([meal.get("id"), prompt, model]).encode("utf-8")).hexdigest()
+        return self.cache_dir / f"{key}.png"
+
+    def __evict(self):
+        """Delete the least recently used images until the cache fits in max_cache_bytes."""
+        with _eviction_lock:
+            files = [entry for entry in os.scandir(self.cache_dir) if entry.name.endswith(".png")]
+            total_bytes = sum(entry.stat().st_size for entry in files)
+            for entry in sorted(files, key=lambda entry: entry.stat().st_mtime):
+                if total_bytes <= self.max_cache_bytes or time.time() - entry.stat().st_mtime < MIN_EVICTION_AGE:
+                    break
+                total_bytes -= entry.stat().st_size
+                os.remove(entry.path)
+                logger.debug(f"Evicted cached image {entry.name}")
+
+    def get_image(self, meal: dict, model="dall-e-2"):
+        """Return the path of the image of a meal, generating and downloading it only on a cache miss."""
+        with tracing.span("image_generation") as attributes:
+            path = self.__cache_path(meal, model)
+            attributes["cached"] = path.exists()
+            if attributes["cached"]:
+                # The modification time tracks the last use, for the eviction
+                path.touch()
+                return path
+
+            image_url = self.generate_image(meal, model=model)
+            if not image_url:
+                return None
+            try:
+                response = _session.get(image_url, timeout=60)
+                response.raise_for_status()
+            except requests.RequestException as e:
+                logger.error(f"Error downloading image: {e}")
+                return None
+
+            tmp_path = path.with_name(f"{path.name}.{threading.get_ident()}.tmp")
+            tmp_path.write_bytes(response.content)
+            os.replace(tmp_path, path)
+            self.__evict()
+            return path
+
+    def submit_images(self, meals, model="dall-e-2"):
+        """Start getting the images of several meals concurrently, returning one future per meal."""
+        return [_executor.submit(tracing.propagate(self.get_image), meal, model) for meal in meals]
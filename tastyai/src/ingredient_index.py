@@ -0,0 +1,85 @@
+import logging
+import re
+
+import numpy as np
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+class IngredientIndex:
+    """Inverted index from the ingredient names of the NER column to the recipes that contain them.
+
+    The vocabulary is kept as a single newline-separated string, so finding every ingredient that contains a term
+    (e.g. "sugar" matches "brown sugar" and "powdered sugar") is a plain substring search. The posting lists are
+    stored as one array of recipe ids grouped by ingredient, with the offset of each ingredient.
+    """
+
+    def __init__(self, vocabulary, offsets, ids, num_rows):
+        self.vocabulary = vocabulary
+        self.offsets = offsets
+        self.ids = ids
+        self.num_rows = num_rows
+        self.token_starts = np.zeros(len(offsets) - 1, dtype=np.int64)
+        if len(self.token_starts) > 1:
+            self.token_starts[1:] = np.cumsum([len(token) + 1 for token in vocabulary.split("\n")[:-1]])
+
+    @classmethod
+    def build(cls, recipe_store):
+        """Index the NER entries of every recipe in the store."""
+        token_ids = {}
+        row_ids = []
+        posting_tokens = []
+        for index in range(len(recipe_store)):
+            tokens = {str(token).strip().lower() for token in recipe_store.get_column("NER", index)}
+            for token in tokens:
+                if not token or "\n" in token:
+                    continue
+                row_ids.append(index)
+                posting_tokens.append(token_ids.setdefault(token, len(token_ids)))
+
+        posting_tokens = np.asarray(posting_tokens, dtype=np.int64)
+        order = np.argsort(posting_tokens, kind="stable")
+        ids = np.asarray(row_ids, dtype=np.int64)[order]
+        offsets = np.zeros(len(token_ids) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(posting_tokens, minlength=len(token_ids)), out=offsets[1:])
+
+        logger.info(f"Built ingredient index with {len(token_ids)} ingredients and {len(ids)} postings")
+        return cls("\n".join(token_ids), offsets, ids, len(recipe_store))
+
+    def __matching_tokens(self, term):
+        """Return the ids of every ingredient that contains the term."""
+        term = term.strip().lower()
+        if not term or "\n" in term:
+            return np.empty(0, dtype=np.int64)
+        positions = [match.start() for match in re.finditer(re.escape(term), self.vocabulary)]
+        return np.unique(np.searchsorted(self.token_starts, positions, side="right") - 1)
+
+    def rows_containing(self, term):
+        """Return the ids of the recipes with an ingredient that contains the term."""
+        token_ids = self.__matching_tokens(term)
+        if len(token_ids) == 0:
+            return np.empty(0, dtype=np.int64)
+        starts, ends = self.offsets[token_ids], self.offsets[token_ids + 1]
+        return np.concatenate([self.ids[start:end] for start, end in zip(starts, ends)])
+
+    def excluded_mask(self, excluded_ingredients, sugar_free=False):
+        """Return a boolean mask of the recipes that violate the constraints, or None if there is none."""
+        terms = list(excluded_ingredients) + (["sugar"] if sugar_free else [])
+        if not terms:
+            return None
+        mask = np.zeros(self.num_rows, dtype=bool)
+        for term in terms:
+            mask[self.rows_containing(term)] = True
+        return mask
+
+    def save(self, path):
+        with open(path, "wb") as f:
+            np.savez(
+                f, vocabulary=np.array(self.vocabulary), offsets=self.offsets, ids=self.ids, num_rows=self.num_rows
+            )
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            return cls(str(data["vocabulary"]), data["offsets"], data["ids"], int(data["num_rows"]))
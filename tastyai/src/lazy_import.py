@@ -0,0 +1,22 @@
+import importlib.util
+import sys
+
+
+def lazy_import(name):
+    """Return a module that is only executed when one of its attributes is first used.
+
+    The heavy dependencies (torch, pandas, sentence-transformers, openai) are imported this way, so the front-ends
+    start without paying for them until a request needs them. A module that is already imported is returned as is.
+    Loading is not thread-safe: the first attribute access must not happen from several threads at once.
+    """
+    if name in sys.modules:
+        return sys.modules[name]
+    spec = importlib.util.find_spec(name)
+    if spec is None:
+        raise ModuleNotFoundError(f"No module named '{name}'", name=name)
+    loader = importlib.util.LazyLoader(spec.loader)
+    spec.loader = loader
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    loader.exec_module(module)
+    return module
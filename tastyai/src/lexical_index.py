@@ -0,0 +1,129 @@
+import logging
+import re
+from array import array
+from collections import Counter
+
+import numpy as np
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+STOPWORDS = frozenset({"a", "an", "and", "for", "in", "of", "on", "or", "the", "to", "with"})
+# Terms found in more than this fraction of the recipes do not add candidates, they only score the others
+COMMON_TERM_FRACTION = 0.1
+
+
+def _tokenize(text):
+    return [token for token in re.findall(r"[a-z0-9]+", text.lower()) if token not in STOPWORDS]
+
+
+class BM25Index:
+    """BM25 inverted index over the title and the NER ingredients of the recipes.
+
+    The posting lists are stored like the ones of the ingredient index: one array of recipe ids (with the frequency of
+    the term in each recipe) grouped by term, plus the offset of each term. The recipe ids of a posting list are
+    sorted, so the score of a term can also be looked up for a given set of recipes.
+    """
+
+    def __init__(self, vocabulary, offsets, ids, frequencies, lengths, k1=1.2, b=0.75):
+        self.vocabulary = vocabulary
+        self.token_ids = {token: i for i, token in enumerate(vocabulary.split("\n"))} if vocabulary else {}
+        self.offsets = offsets
+        self.ids = ids
+        self.frequencies = frequencies
+        self.lengths = lengths
+        self.k1 = k1
+        self.b = b
+        # Rows left out of the index have no terms, so they do not count as documents
+        indexed_lengths = lengths[lengths > 0]
+        self.num_documents = len(indexed_lengths)
+        self.average_length = float(indexed_lengths.mean()) if len(indexed_lengths) else 0.0
+
+    @classmethod
+    def build(cls, recipe_store, rows=None):
+        """Index the words of the title and NER entries of every recipe in the store, or only of `rows`."""
+        token_ids = {}
+        posting_tokens, posting_ids, posting_frequencies = array("i"), array("i"), array("H")
+        lengths = np.zeros(len(recipe_store), dtype=np.int32)
+        for index in range(len(recipe_store)) if rows is None else rows.tolist():
+            ner = " ".join(str(item) for item in recipe_store.get_column("NER", index))
+            tokens = _tokenize(f"{recipe_store.get_column('title', index)} {ner}")
+            lengths[index] = len(tokens)
+            for token, frequency in Counter(tokens).items():
+                posting_tokens.append(token_ids.setdefault(token, len(token_ids)))
+                posting_ids.append(index)
+                posting_frequencies.append(min(frequency, 65535))
+
+        posting_tokens = np.frombuffer(posting_tokens, dtype=np.int32)
+        order = np.argsort(posting_tokens, kind="stable")
+        offsets = np.zeros(len(token_ids) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(posting_tokens, minlength=len(token_ids)), out=offsets[1:])
+        ids = np.frombuffer(posting_ids, dtype=np.int32)[order]
+        frequencies = np.frombuffer(posting_frequencies, dtype=np.uint16)[order]
+
+        logger.info(f"Built BM25 index with {len(token_ids)} terms and {len(ids)} postings")
+        return cls("\n".join(token_ids), offsets, ids, frequencies, lengths)
+
+    def __term_scores(self, token_id, start, end, positions=None):
+        """BM25 score of a term for the postings [start, end), or only for the given positions of that range."""
+        document_frequency = end - start
+        idf = np.log(1 + (self.num_documents - document_frequency + 0.5) / (document_frequency + 0.5))
+        ids = self.ids[start:end] if positions is None else self.ids[start:end][positions]
+        frequencies = self.frequencies[start:end] if positions is None else self.frequencies[start:end][positions]
+        frequencies = frequencies.astype(np.float32)
+        normalization = self.k1 * (1 - self.b + self.b * self.lengths[ids] / self.average_length)
+        return ids, idf * frequencies * (self.k1 + 1) / (frequencies + normalization)
+
+    def search(self, text, k, excluded=None):
+        """Return (scores, indices) of the k recipes with the best BM25 score for the text, sorted by score.
+
+        Only the recipes containing at least one of the rarer terms are candidates; the terms found in most recipes
+        (e.g. "salt") only add to their scores. Recipes flagged in the `excluded` mask are dropped.
+        """
+        token_ids = sorted({self.token_ids[token] for token in _tokenize(text) if token in self.token_ids})
+        if not token_ids:
+            return np.empty(0, dtype=np.float32), np.empty(0, dtype=np.int64)
+
+        ranges = [(token_id, self.offsets[token_id], self.offsets[token_id + 1]) for token_id in token_ids]
+        max_frequency = COMMON_TERM_FRACTION * self.num_documents
+        rare = [term for term in ranges if term[2] - term[1] <= max_frequency]
+        if not rare:
+            # Every term is common, so the rarest one still has to provide the candidates
+            rare = [min(ranges, key=lambda term: term[2] - term[1])]
+        common = [term for term in ranges if term not in rare]
+
+        ids, scores = zip(*(self.__term_scores(*term) for term in rare))
+        candidates, inverse = np.unique(np.concatenate(ids), return_inverse=True)
+        totals = np.bincount(inverse, weights=np.concatenate(scores), minlength=len(candidates))
+        for token_id, start, end in common:
+            positions = np.searchsorted(self.ids[start:end], candidates)
+            found = positions < end - start
+            found[found] = self.ids[start:end][positions[found]] == candidates[found]
+            _, term_scores = self.__term_scores(token_id, start, end, positions[found])
+            totals[found] += term_scores
+
+        if excluded is not None:
+            keep = ~excluded[candidates]
+            candidates, totals = candidates[keep], totals[keep]
+        if len(candidates) == 0:
+            return np.empty(0, dtype=np.float32), np.empty(0, dtype=np.int64)
+        k = min(k, len(candidates))
+        top = np.argpartition(-totals, k - 1)[:k]
+        top = top[np.argsort(-totals[top])]
+        return totals[top].astype(np.float32), candidates[top].astype(np.int64)
+
+    def save(self, path):
+        with open(path, "wb") as f:
+            np.savez(
+                f,
+                vocabulary=np.array(self.vocabulary),
+                offsets=self.offsets,
+                ids=self.ids,
+                frequencies=self.frequencies,
+                lengths=self.lengths,
+            )
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            return cls(str(data["vocabulary"]), data["offsets"], data["ids"], data["frequencies"], data["lengths"])
@@ -0,0 +1,72 @@
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+_STOP = object()
+
+
+class MicroBatcher:
+    """Group the calls made by concurrent threads into batches, processed one at a time by a worker thread.
+
+    The worker waits for a first request, then for at most `max_wait` seconds (or until `max_batch_size` requests
+    are queued) for others to join it, and calls `function` once with the whole list. `function` returns one result
+    per request, in order; each caller gets its own result, or the exception raised for the batch.
+    """
+
+    def __init__(self, function, max_batch_size=32, max_wait=0.005, name="micro-batcher"):
+        self.function = function
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.requests = queue.Queue()
+        self.thread = threading.Thread(target=self.__run, name=name, daemon=True)
+        self.thread.start()
+
+    def submit(self, request):
+        """Queue a request and return the future of its result."""
+        future = Future()
+        self.requests.put((request, future))
+        return future
+
+    def __call__(self, request):
+        return self.submit(request).result()
+
+    def close(self):
+        """Stop the worker once the requests already queued are processed."""
+        self.requests.put(_STOP)
+        self.thread.join()
+
+    def __run(self):
+        stopping = False
+        while not stopping:
+            first = self.requests.get()
+            if first is _STOP:
+                return
+            batch = [first]
+            deadline = time.perf_counter() + self.max_wait
+            while len(batch) < self.max_batch_size:
+                try:
+                    entry = self.requests.get(timeout=max(0.0, deadline - time.perf_counter()))
+                except queue.Empty:
+                    break
+                if entry is _STOP:
+                    stopping = True
+                    break
+                batch.append(entry)
+            self.__process(batch)
+
+    def __process(self, batch):
+        requests, futures = zip(*batch)
+        try:
+            results = self.function(list(requests))
+        except Exception as e:
+            logger.error(f"Error processing a batch of {len(batch)} requests: {e}")
+            for future in futures:
+                future.set_exception(e)
+            return
+        for future, result in zip(futures, results):
+            future.set_result(result)
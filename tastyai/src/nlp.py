@@ -1,19 +1,35 @@
+import copy
 import json
 import logging
 
-from langchain.prompts import ChatPromptTemplate
-from langchain.schema.runnable import RunnableSequence
-from langchain_openai import ChatOpenAI
+import tracing
+from lru_cache import LRUCache
 from translator import Translator
 from user_profile import UserProfile
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+SUPPORTED_LANGUAGES = ("english", "spanish", "portuguese")
+
+# Profiles of the queries already processed, shared by every NLP instance of the process
+_profile_cache = LRUCache(max_size=4096)
+
+
+def normalize_query(text):
+    """Normalize a query so trivially different spellings share a cache entry."""
+    return " ".join(text.lower().split())
+
 
 class NLP:
-    def __init__(self, model_name="gpt-4o-mini", openai_api_key=None):
+    def __init__(self, model_name="gpt-4o-mini", openai_api_key=None, fast_path=True):
+        # langchain is slow to import, so it is only imported once the first query is processed
+        from langchain.prompts import ChatPromptTemplate
+        from langchain.schema.runnable import RunnableSequence
+        from langchain_openai import ChatOpenAI
+
         self.openai_key = openai_api_key
+        self.fast_path = fast_path
         self.llm = ChatOpenAI(model_name=model_name, temperature=0, api_key=openai_api_key)
         self.prompt = ChatPromptTemplate.from_messages(
             [
@@ -29,12 +45,14 @@ class NLP:
                         "prompt. The user can ask things like: i want a meal, i want a dessert, i want a dinner, and "
                         "things like that. "
                         "If the user is not asking for a recipe, set 'is_recipe_request' to false."
+                        "Identify the language the user wrote in: 'english', 'spanish' or 'portuguese' (use "
+                        "'english' for any other language). "
                         "Return the information in "
                         "a JSON format with the following structure (return all translated to english, no matter the "
                         "language that the user used): "
                         '{{"dietary": [], "sugar_content": "low, normal, high", "sharing": bool, '
                         '"ingredients": [], "excluded_ingredients": [], '
-                        '"is_recipe_request": bool}}'
+                        '"is_recipe_request": bool, "language": "english, spanish, portuguese"}}'
                     ),
                 ),
                 ("human", "{query}"),
@@ -43,17 +61,47 @@ class NLP:
         self.chain = RunnableSequence(self.prompt | self.llm)
 
     def process_user_input(self, input_text):
-        translator = Translator(openai_key=self.openai_key)
-        language = translator.detect_language(input_text)
-        if language != "english":
-            input_text = translator.translate(input_text)
-        result = self.chain.invoke({"query": input_text})
+        """Extract the user profile of a query.
+
+        With the fast path, the language, the preferences (in english) and whether it is a recipe request come from a
+        single LLM call; otherwise the language is detected and the query translated before the extraction. Profiles
+        are cached by normalized query text, so repeated queries skip the LLM.
+        """
+        cache_key = (normalize_query(input_text), self.fast_path)
+        cached = _profile_cache.get(cache_key)
+        if cached is not None:
+            logger.info(f"User profile (cached): {cached}")
+            return copy.deepcopy(cached)
+
+        if self.fast_path:
+            user_profile = self.__extract_profile(input_text)
+        else:
+            translator = Translator(openai_key=self.openai_key)
+            with tracing.span("language_detection"):
+                language = translator.detect_language(input_text)
+            if language != "english":
+                with tracing.span("input_translation"):
+                    input_text = translator.translate(input_text)
+            user_profile = self.__extract_profile(input_text, language=language)
+
+        if user_profile is not None:
+            _profile_cache.put(cache_key, copy.deepcopy(user_profile))
+        return user_profile
+
+    def __extract_profile(self, input_text, language=None):
+        """Run the preference extraction prompt; the language is taken from the answer unless it is given."""
+        with tracing.span("preference_extraction"):
+            result = self.chain.invoke({"query": input_text})
+            tracing.record_llm_call(result)
         try:
             content = result.content
             preferences = json.loads(content)
             logger.info(f"Preferences: {preferences}")
 
             user_profile = UserProfile(preferences)
+            if language is None:
+                language = str(preferences.get("language", "english")).lower()
+                language = language if language in SUPPORTED_LANGUAGES else "english"
             user_profile.__setattr__("language", language)
             logger.info(f"User profile: {user_profile}")
             return user_profile
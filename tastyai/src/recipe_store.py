@@ -0,0 +1,125 @@
+import ast
+import json
+import logging
+import mmap
+import os
+import shutil
+from pathlib import Path
+
+import numpy as np
+from lazy_import import lazy_import
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Only needed to build the store from the CSV
+pd = lazy_import("pandas")
+
+COLUMNS = ("title", "ingredients", "directions", "NER")
+LIST_COLUMNS = ("ingredients", "directions", "NER")
+
+
+def string_to_list(s):
+    """Convert a string representation of a list into an actual list.
+
+    Malformed lists are split on commas, and missing values are empty lists. The store and the embeddings both parse
+    the dataset with this function, so they always see the same lists.
+    """
+    if not isinstance(s, str):
+        return []
+    try:
+        return ast.literal_eval(s)
+    except (SyntaxError, ValueError):
+        return [item.strip() for item in s.strip("[]").split(",")]
+
+
+class RecipeStore:
+    """Read-only columnar store of the recipes, built once from the CSV dataset.
+
+    Each column is saved as one binary file with the UTF-8 encoded values back to back, plus an array with the offset
+    of every row. List columns (ingredients, directions and NER) are stored already parsed, encoded as JSON. Both
+    files are memory-mapped, so opening the store is instant and fetching a recipe only reads that row from disk.
+    The `link` and `source` columns are not used at query time and are not stored.
+    """
+
+    def __init__(self, store_dir):
+        self.store_dir = Path(store_dir)
+        with open(self.store_dir / "manifest.json") as f:
+            manifest = json.load(f)
+        self.num_rows = manifest["num_rows"]
+        self.columns = tuple(manifest["columns"])
+
+        self.offsets = {}
+        self.data = {}
+        for column in self.columns:
+            self.offsets[column] = np.load(self.store_dir / f"{column}.offsets.npy", mmap_mode="r")
+            self.data[column] = self.__map(self.store_dir / f"{column}.bin")
+
+    @staticmethod
+    def __map(path):
+        """Memory-map a column file; mmap refuses empty files, which hold no data anyway."""
+        if os.path.getsize(path) == 0:
+            return b""
+        with open(path, "rb") as f:
+            return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def __len__(self):
+        return self.num_rows
+
+    def __read(self, column, index):
+        offsets = self.offsets[column]
+        start, end = offsets[index], offsets[index + 1]
+        value = self.data[column][start:end].decode("utf-8")
+        return json.loads(value) if column in LIST_COLUMNS else value
+
+    def get(self, index):
+        """Return the recipe stored at a row index as a dict."""
+        index = int(index)
+        recipe = {"id": index}
+        for column in self.columns:
+            recipe[column] = self.__read(column, index)
+        return recipe
+
+    def get_column(self, column, index):
+        """Return a single field of a recipe, without reading the other columns."""
+        return self.__read(column, int(index))
+
+    @classmethod
+    def build(cls, csv_path, store_dir, chunk_size=50000):
+        """Convert the CSV dataset into a columnar store, reading it in chunks."""
+        store_dir = Path(store_dir)
+        tmp_dir = store_dir.with_name(f"{store_dir.name}.tmp")
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        tmp_dir.mkdir(parents=True)
+
+        files = {column: open(tmp_dir / f"{column}.bin", "wb") for column in COLUMNS}
+        offsets = {column: [np.zeros(1, dtype=np.int64)] for column in COLUMNS}
+        positions = {column: 0 for column in COLUMNS}
+        num_rows = 0
+        try:
+            for chunk in pd.read_csv(csv_path, usecols=list(COLUMNS), chunksize=chunk_size):
+                for column in COLUMNS:
+                    values = chunk[column].fillna("").astype(str)
+                    if column in LIST_COLUMNS:
+                        values = values.apply(lambda x: json.dumps(string_to_list(x), ensure_ascii=False))
+                    encoded = [value.encode("utf-8") for value in values]
+
+                    lengths = np.fromiter(map(len, encoded), dtype=np.int64, count=len(encoded))
+                    offsets[column].append(positions[column] + np.cumsum(lengths))
+                    positions[column] += int(lengths.sum())
+                    files[column].write(b"".join(encoded))
+                num_rows += len(chunk)
+                logger.debug(f"Stored {num_rows} recipes...")
+        finally:
+            for f in files.values():
+                f.close()
+
+        for column in COLUMNS:
+            np.save(tmp_dir / f"{column}.offsets.npy", np.concatenate(offsets[column]))
+        with open(tmp_dir / "manifest.json", "w") as f:
+            json.dump({"num_rows": num_rows, "columns": list(COLUMNS)}, f)
+
+        shutil.rmtree(store_dir, ignore_errors=True)
+        os.replace(tmp_dir, store_dir)
+        logger.info(f"Built recipe store with {num_rows} recipes at {store_dir}")
+        return cls(store_dir)
@@ -1,82 +1,364 @@
-import ast
+import asyncio
+import logging
+import queue
+import threading
+from pathlib import Path
 
 import numpy as np
-import torch
-import torch.nn.functional as F
+import tracing
+from exact_index import ExactIndex
+from lru_cache import LRUCache
+from micro_batcher import MicroBatcher
+from nlp import normalize_query
+from recommendation_stats import RecommendationStats
+from translation_cache import TranslationCache
 from translator import Translator
 from user_profile import UserProfile
 from vectorizer import Vectorizer
 
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Upper bound of the uniform noise added to the similarity scores to avoid ties
+TIE_BREAK_NOISE = 0.01
+# Number of ANN candidates fetched per requested recommendation, so the tie-breaking noise can still reorder them
+CANDIDATES_PER_RESULT = 4
+# Number of rows of the compressed search re-ranked with the full vectors, per requested recommendation
+COMPRESSED_SHORTLIST_PER_RESULT = 20
+# Number of BM25 candidates scored by the dense model in a hybrid search
+LEXICAL_CANDIDATES = 1000
+# Weight of the BM25 score (scaled to [0, 1] by the best candidate) in the fused score of a hybrid search
+LEXICAL_WEIGHT = 0.3
+
+# Query vectors (by normalized query string) and rankings (by profile, exclusions and top_n), shared by every
+# Recommendation of the process, like the profile cache of the NLP
+_query_vector_cache = LRUCache(max_size=4096)
+_ranking_cache = LRUCache(max_size=4096)
+_cache_lock = threading.Lock()
+_cache_version = None
+
+
+def _invalidate_caches(store_version):
+    """Drop the cached query vectors and rankings when a Recommendation is created on another embedding store."""
+    global _cache_version
+    with _cache_lock:
+        if store_version != _cache_version:
+            _query_vector_cache.clear()
+            _ranking_cache.clear()
+            _cache_version = store_version
+
 
 class Recommendation:
-    def __init__(self, vectorizer: Vectorizer, openai_key):
+    def __init__(
+        self,
+        vectorizer: Vectorizer,
+        openai_key,
+        search_mode="ann",
+        nprobe=16,
+        hybrid=True,
+        max_batch_size=1,
+        max_batch_wait=0.005,
+    ):
         self.vectorizer = vectorizer
         self.embeddings = vectorizer.vectorize()
-        self.recipes_df = vectorizer.df
-        self.model = vectorizer.model
+        self.recipes = vectorizer.load_recipe_store()
+        self.model = vectorizer.query_model
         self.openai_key = openai_key
+        self.nprobe = nprobe
+
+        self.ann_index = vectorizer.load_ann_index() if search_mode == "ann" else None
+        if search_mode == "ann" and self.ann_index is None:
+            logger.warning("ANN index not found, falling back to exact search")
+        self.sharded_index = vectorizer.load_sharded_index() if search_mode == "sharded" else None
+        if search_mode == "sharded" and self.sharded_index is None:
+            logger.warning("Embedding shards not found, falling back to exact search")
+        self.compressed_index = vectorizer.load_compressed_index() if search_mode == "compressed" else None
+        if search_mode == "compressed" and self.compressed_index is None:
+            logger.warning("Compressed index not found or not faster, falling back to exact search")
+        self.exact_index = ExactIndex(self.embeddings)
+        self.ingredient_index = vectorizer.load_ingredient_index()
+        self.lexical_index = vectorizer.load_lexical_index() if hybrid else None
+        self.duplicate_index = vectorizer.load_duplicate_index()
+        self.translation_cache = TranslationCache(Path(vectorizer.file_path).with_name("translation_cache.sqlite"))
+        self.stats = RecommendationStats(vectorizer.stats_file_path)
+
+        # The cached query vectors and rankings are only valid for the embedding store and search they come from
+        self.store_version = vectorizer.store_version
+        self.search_config = (
+            search_mode,
+            nprobe,
+            vectorizer.quantize_queries,
+            self.lexical_index is not None,
+            self.ann_index is not None or self.sharded_index is not None or self.compressed_index is not None,
+        )
+        _invalidate_caches(self.store_version)
+
+        # With max_batch_size > 1, the queries of concurrent requests are encoded (and searched) together
+        self.__exact_only = self.ann_index is None and self.sharded_index is None and self.compressed_index is None
+        self.query_batcher = None
+        if max_batch_size > 1:
+            self.query_batcher = MicroBatcher(
+                self.__encode_batch, max_batch_size=max_batch_size, max_wait=max_batch_wait, name="query-batcher"
+            )
+
+    def __encode_batch(self, requests):
+        """Encode the query strings of a batch of (query string, query vector or None, k, excluded mask) requests with
+        a single model call, and search the top-k of the ones with k > 0 with a single pass over the embeddings.
+
+        Returns a (query vector, (scores, indices) or None, batch size) tuple per request.
+        """
+        query_vectors = [query_vector for _, query_vector, _, _ in requests]
+        missing = [i for i, query_vector in enumerate(query_vectors) if query_vector is None]
+        if missing:
+            encoded = self.model.encode(
+                [requests[i][0] for i in missing], batch_size=len(missing), normalize_embeddings=True
+            )
+            for i, query_vector in zip(missing, encoded):
+                query_vectors[i] = query_vector
+        query_vectors = np.asarray(query_vectors, dtype=np.float32)
+
+        results = [None] * len(requests)
+        searched = [i for i, (_, _, k, _) in enumerate(requests) if k]
+        if searched:
+            scores, indices = self.exact_index.search_batch(
+                query_vectors[searched],
+                max(requests[i][2] for i in searched),
+                excluded=[requests[i][3] for i in searched],
+            )
+            for row, i in enumerate(searched):
+                found = indices[row, : requests[i][2]] >= 0
+                results[i] = (scores[row, : requests[i][2]][found], indices[row, : requests[i][2]][found])
+        return [(query_vector, result, len(requests)) for query_vector, result in zip(query_vectors, results)]
+
+    def __rank(self, query_string, top_n, excluded=None, lexical_query=None, ingredient_excluded=None):
+        """Return the (scores, indices) of the top_n * CANDIDATES_PER_RESULT recipes closest to the query, sorted by
+        score and without any noise, so the ranking can be cached.
+
+        Recipes flagged in the `excluded` mask are skipped during the search itself, so they never take a slot. The
+        sharded search only gets the `ingredient_excluded` part of it, as its workers mask the near-duplicates.
+        With a `lexical_query`, only the recipes the BM25 index finds for it are scored by the dense model, and both
+        scores are fused; the dense search over every recipe is used when the lexical stage finds too few of them.
+        """
+        k = top_n * CANDIDATES_PER_RESULT
+        candidates = None
+        if self.lexical_index is not None and lexical_query:
+            with tracing.span("lexical_search") as attributes:
+                lexical_scores, candidates = self.lexical_index.search(
+                    lexical_query, LEXICAL_CANDIDATES, excluded=excluded
+                )
+                attributes["candidates"] = len(candidates)
+            if len(candidates) < k:
+                logger.debug("Not enough lexical candidates, falling back to dense search")
+                candidates = None
 
-        self.embeddings_tensor = torch.tensor(self.embeddings, dtype=torch.float32, device=self.vectorizer.device)
+        vector_key = (self.store_version, self.vectorizer.quantize_queries, query_string)
+        query_vector = _query_vector_cache.get(vector_key)
+        # The exact search over every recipe is done by the batch too, with the other queries of the batch
+        search_k = k if self.query_batcher is not None and candidates is None and self.__exact_only else 0
+        if search_k or (self.query_batcher is not None and query_vector is None):
+            with tracing.span("batched_search" if search_k else "query_encoding") as attributes:
+                query_vector, results, attributes["batch_size"] = self.query_batcher(
+                    (query_string, query_vector, search_k, excluded)
+                )
+            _query_vector_cache.put(vector_key, query_vector)
+            if results is not None:
+                return results
+        elif query_vector is None:
+            with tracing.span("query_encoding"):
+                query_vector = self.model.encode([query_string], normalize_embeddings=True)[0]
+            _query_vector_cache.put(vector_key, query_vector)
 
-    def __string_to_list(self, s):
-        """Convert a string representation of a list into an actual list."""
-        try:
-            return ast.literal_eval(s)
-        except (SyntaxError, ValueError):
-            return [item.strip() for item in s.strip("[]").split(",")]
+        if candidates is not None:
+            with tracing.span("similarity_search", mode="hybrid"):
+                # Reading the rows in order keeps the accesses to the memory-mapped embeddings sequential
+                order = np.argsort(candidates)
+                candidates, lexical_scores = candidates[order], lexical_scores[order]
+                dense_scores = self.embeddings[candidates] @ query_vector
+                lexical_scores = lexical_scores / lexical_scores.max()
+                scores = (1 - LEXICAL_WEIGHT) * dense_scores + LEXICAL_WEIGHT * lexical_scores
+                top = np.argsort(-scores)[:k]
+                return scores[top], candidates[top]
 
-    def get_meal_recommendation(self, user_profile: UserProfile, top_n=5):
-        """Generate personalized meal recommendations."""
-        query_string = " ".join(
-            user_profile.dietary_preferences + user_profile.preferred_ingredients + [user_profile.sugar_preference]
+        with tracing.span("similarity_search") as attributes:
+            if self.ann_index is not None:
+                attributes["mode"] = "ann"
+                scores, indices = self.ann_index.search(
+                    query_vector, self.embeddings, k=k, nprobe=self.nprobe, excluded=excluded
+                )
+                if len(indices) >= top_n:
+                    return scores, indices
+                logger.debug("Not enough ANN candidates left after filtering, falling back to exact search")
+
+            if self.compressed_index is not None:
+                attributes["mode"] = "compressed"
+                return self.compressed_index.search(
+                    query_vector,
+                    self.embeddings,
+                    k,
+                    shortlist=top_n * COMPRESSED_SHORTLIST_PER_RESULT,
+                    excluded=excluded,
+                )
+
+            if self.sharded_index is not None:
+                attributes["mode"] = "sharded"
+                return self.sharded_index.search(query_vector, k, excluded=ingredient_excluded)
+
+            attributes["mode"] = "exact"
+            return self.exact_index.search(query_vector, k, excluded=excluded)
+
+    @staticmethod
+    def __violates_constraints(meal, user_profile: UserProfile):
+        """Check a meal against the excluded ingredients and sugar constraint, like the ingredient index does."""
+        ingredients = [str(ingredient).lower() for ingredient in meal["NER"]]
+        terms = [term.strip().lower() for term in user_profile.excluded_ingredients]
+        if user_profile.sugar_preference == "sugar_free":
+            terms.append("sugar")
+        return any(term and term in ingredient for term in terms for ingredient in ingredients)
+
+    @staticmethod
+    def query_string(user_profile: UserProfile):
+        """Return the text encoded to search the recipes of a user profile, lowercased with single spaces (the model
+        is uncased), so equivalent profiles share their cache entries."""
+        return normalize_query(
+            " ".join(
+                user_profile.dietary_preferences + user_profile.preferred_ingredients + [user_profile.sugar_preference]
+            )
+        )
+
+    @staticmethod
+    def exclusion_key(user_profile: UserProfile):
+        """Return the hashable exclusion constraints of a profile, used to share its mask with similar profiles."""
+        excluded_ingredients = tuple(sorted({term.strip().lower() for term in user_profile.excluded_ingredients}))
+        return excluded_ingredients, user_profile.sugar_preference == "sugar_free"
+
+    def cache_stats(self):
+        """Return the hits, misses and size of the query vector and ranking caches."""
+        return {
+            name: {"hits": cache.hits, "misses": cache.misses, "size": len(cache)}
+            for name, cache in (("query_vectors", _query_vector_cache), ("rankings", _ranking_cache))
+        }
+
+    @staticmethod
+    def clear_caches():
+        """Drop every cached query vector and ranking, e.g. to measure uncached searches."""
+        _query_vector_cache.clear()
+        _ranking_cache.clear()
+
+    def find_meals(self, user_profile: UserProfile, top_n=5):
+        """Search the recipes matching a user profile, without translating them.
+
+        The ranking of each profile is cached; the random tie-breaking noise is added afterwards, so the
+        recommendations of a cached profile still vary.
+        """
+        query_string = self.query_string(user_profile)
+        lexical_query = normalize_query(" ".join(user_profile.dietary_preferences + user_profile.preferred_ingredients))
+        ranking_key = (
+            self.store_version,
+            self.search_config,
+            query_string,
+            lexical_query,
+            self.exclusion_key(user_profile),
+            top_n,
         )
+        ranking = _ranking_cache.get(ranking_key)
+        if ranking is None:
+            with tracing.span("filtering"):
+                ingredient_excluded = excluded = self.ingredient_index.excluded_mask(
+                    user_profile.excluded_ingredients, sugar_free=user_profile.sugar_preference == "sugar_free"
+                )
+                if self.duplicate_index is not None:
+                    # Only the representative of each group of near-duplicates can take a result slot
+                    mask = self.duplicate_index.mask
+                    excluded = mask if excluded is None else excluded | mask
+            ranking = self.__rank(
+                query_string,
+                top_n,
+                excluded=excluded,
+                lexical_query=lexical_query,
+                ingredient_excluded=ingredient_excluded,
+            )
+            _ranking_cache.put(ranking_key, ranking)
 
-        query_vector = self.model.encode([query_string], convert_to_tensor=True)
-        similarity_scores = F.cosine_similarity(query_vector, self.embeddings_tensor).cpu().numpy()
-        # Add small random noise to avoid ties
-        similarity_scores += np.random.uniform(0, 0.01, size=len(similarity_scores))
-        top_indices = similarity_scores.argsort()[-top_n:][::-1]
+        scores, indices = ranking
+        scores = scores + np.random.uniform(0, TIE_BREAK_NOISE, size=len(scores))
+        top_indices = indices[np.argsort(-scores)[:top_n]]
 
-        recommendations = []
-        for index in top_indices:
-            suggested_meal = self.recipes_df.iloc[index].copy()
+        with tracing.span("recipe_fetch"):
+            recommendations = [self.recipes.get(index) for index in top_indices]
+            self.stats.record(top_indices)
+            return [meal for meal in recommendations if not self.__violates_constraints(meal, user_profile)]
 
-            if isinstance(suggested_meal["ingredients"], str):
-                suggested_meal["ingredients"] = self.__string_to_list(suggested_meal["ingredients"])
-            if isinstance(suggested_meal["directions"], str):
-                suggested_meal["directions"] = self.__string_to_list(suggested_meal["directions"])
+    def get_meal_recommendation(self, user_profile: UserProfile, top_n=5, openai_key=None):
+        """Generate personalized meal recommendations.
 
-            recommendations.append(suggested_meal)
+        The openai_key overrides the one given at construction, so a single warm instance can serve several users.
+        """
+        return self.translate_recommendations(self.find_meals(user_profile, top_n), user_profile, openai_key)
 
-        return self.filter_recommendations(recommendations, user_profile)
+    def translate_recommendations(self, recommendations, user_profile: UserProfile, openai_key=None):
+        """Add the translated title, ingredients and directions to each meal, in the language of the user."""
+        if user_profile.language == "english":
+            translations = [
+                {
+                    "translated_title": meal["title"],
+                    "translated_ingredients": meal["ingredients"],
+                    "translated_directions": meal["directions"],
+                }
+                for meal in recommendations
+            ]
+        else:
+            translator = Translator(
+                openai_key=openai_key or self.openai_key, language=user_profile.language, cache=self.translation_cache
+            )
+            with tracing.span("output_translation", meals=len(recommendations)):
+                translations = translator.translate_meals(recommendations)
 
-    def filter_recommendations(self, recommendations, user_profile: UserProfile):
-        """Apply additional filtering based on user preferences and optimize translations."""
-        filtered_recommendations = []
-        for meal in recommendations:
-            if any(ingredient in meal["ingredients"] for ingredient in user_profile.excluded_ingredients):
-                continue
+        return [{**meal, **translation} for meal, translation in zip(recommendations, translations)]
 
-            if user_profile.sugar_preference == "sugar_free" and any(
-                "sugar" in ingredient.lower() for ingredient in meal["ingredients"]
-            ):
-                continue
+    def iter_translated_recommendations(self, recommendations, user_profile: UserProfile, openai_key=None):
+        """Yield (position, translated meal) pairs in the order the translations finish.
+
+        Each meal is translated by its own request, all of them running concurrently on an event loop in a background
+        thread, so the first meal can be shown after a single round trip.
+        """
+        if user_profile.language == "english":
+            yield from enumerate(self.translate_recommendations(recommendations, user_profile))
+            return
+
+        translator = Translator(
+            openai_key=openai_key or self.openai_key,
+            language=user_profile.language,
+            cache=self.translation_cache,
+            meals_per_request=1,
+        )
+        results = queue.Queue()
 
-            translated_meal = meal.copy()
-            if user_profile.language == "english":
-                translated_meal["translated_title"] = meal["title"]
-                translated_meal["translated_ingredients"] = meal["ingredients"]
-                translated_meal["translated_directions"] = meal["directions"]
-            else:
-                translator = Translator(openai_key=self.openai_key, language=user_profile.language)
+        async def translate(position, meal):
+            try:
+                with tracing.span("output_translation", meals=1):
+                    (translation,) = await translator.atranslate_meals([meal])
+                results.put((position, {**meal, **translation}))
+            except Exception as e:
+                results.put((position, e))
 
-                ingredients_text = " | ".join(meal["ingredients"])
-                directions_text = " | ".join(meal["directions"])
+        async def translate_all():
+            await asyncio.gather(*(translate(position, meal) for position, meal in enumerate(recommendations)))
 
-                translated_meal["translated_title"] = translator.translate(meal["title"])
-                translated_meal["translated_ingredients"] = translator.translate(ingredients_text).split(" | ")
-                translated_meal["translated_directions"] = translator.translate(directions_text).split(" | ")
+        threading.Thread(target=tracing.propagate(asyncio.run), args=(translate_all(),), daemon=True).start()
+        for _ in recommendations:
+            position, result = results.get()
+            if isinstance(result, Exception):
+                raise result
+            yield position, result
 
-            filtered_recommendations.append(translated_meal)
+    def iter_meal_recommendation(self, user_profile: UserProfile, top_n=5, openai_key=None):
+        """Streaming version of get_meal_recommendation.
 
-        return filtered_recommendations
+        Yields ("found", position, meal) for every recipe as soon as the search is done, then
+        ("translated", position, meal) as each translation finishes.
+        """
+        meals = self.find_meals(user_profile, top_n)
+        for position, meal in enumerate(meals):
+            yield "found", position, meal
+        for position, meal in self.iter_translated_recommendations(meals, user_profile, openai_key=openai_key):
+            yield "translated", position, meal
@@ -0,0 +1,66 @@
+import threading
+from collections import Counter
+
+import sqlite_util
+
+
+class RecommendationStats:
+    """Counts how many times each recipe was recommended, to find the ones worth pre-translating.
+
+    Recording only adds to in-memory counts; a background thread writes them to the SQLite file every
+    `flush_interval` seconds, so a recommendation never waits for a commit. The counts left are written at exit.
+    """
+
+    def __init__(self, path, flush_interval=1.0):
+        self.lock = threading.Lock()
+        self.connection = sqlite_util.connect(path)
+        with self.connection:
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS recommendations (recipe_id INTEGER PRIMARY KEY, count INTEGER NOT NULL)"
+            )
+        self.pending = Counter()
+        self.pending_lock = threading.Lock()
+        self.writer = sqlite_util.BackgroundWriter(self.flush, flush_interval, name="recommendation-stats")
+
+    def record(self, recipe_ids):
+        """Count one more recommendation of each recipe."""
+        with self.pending_lock:
+            self.pending.update(int(recipe_id) for recipe_id in recipe_ids)
+        self.writer.start()
+
+    def flush(self):
+        """Write the counts recorded since the last flush."""
+        with self.pending_lock:
+            pending, self.pending = self.pending, Counter()
+        if not pending:
+            return
+        with self.lock, self.connection:
+            self.connection.executemany(
+                "INSERT INTO recommendations (recipe_id, count) VALUES (?, ?) "
+                "ON CONFLICT (recipe_id) DO UPDATE SET count = count + excluded.count",
+                pending.items(),
+            )
+
+    def close(self):
+        """Stop the writer and write the counts left."""
+        self.writer.close()
+
+    def remap(self, new_ids):
+        """Move the counts to new recipe ids after the dataset changed; recipes missing from `new_ids` are dropped."""
+        self.flush()
+        with self.lock, self.connection:
+            rows = self.connection.execute("SELECT recipe_id, count FROM recommendations").fetchall()
+            self.connection.execute("DELETE FROM recommendations")
+            self.connection.executemany(
+                "INSERT INTO recommendations (recipe_id, count) VALUES (?, ?)",
+                [(new_ids[recipe_id], count) for recipe_id, count in rows if recipe_id in new_ids],
+            )
+
+    def most_recommended(self, limit):
+        """Return the ids of the `limit` most recommended recipes."""
+        self.flush()
+        with self.lock:
+            rows = self.connection.execute(
+                "SELECT recipe_id FROM recommendations ORDER BY count DESC LIMIT ?", (limit,)
+            ).fetchall()
+        return [row[0] for row in rows]
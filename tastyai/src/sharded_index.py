@@ -0,0 +1,167 @@
+import contextlib
+import json
+import logging
+import multiprocessing
+import os
+import shutil
+from pathlib import Path
+
+import numpy as np
+from duplicate_index import DuplicateIndex
+from exact_index import ExactIndex
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+MANIFEST_NAME = "manifest.json"
+BLAS_THREAD_VARIABLES = ("OMP_NUM_THREADS", "OPENBLAS_NUM_THREADS", "MKL_NUM_THREADS")
+
+# Shards already memory-mapped by the current worker process, by path
+_worker_shards = {}
+# Near-duplicate rows of the whole index, loaded once per worker process
+_worker_duplicate_mask = None
+
+
+def _init_worker(duplicate_index_path):
+    global _worker_duplicate_mask
+    if duplicate_index_path is not None:
+        _worker_duplicate_mask = DuplicateIndex.load(duplicate_index_path).mask
+
+
+def _search_shard(path, start, num_rows, query, k, excluded_rows):
+    """Search one shard inside a worker process, skipping the near-duplicates and the `excluded_rows` (ids local to
+    the shard), and return global row ids."""
+    index = _worker_shards.get(path)
+    if index is None:
+        index = _worker_shards[path] = ExactIndex(np.load(path, mmap_mode="r"))
+    excluded = None
+    if _worker_duplicate_mask is not None:
+        end = start + num_rows
+        excluded = _worker_duplicate_mask[start:end].copy()
+    if len(excluded_rows):
+        if excluded is None:
+            excluded = np.zeros(num_rows, dtype=bool)
+        excluded[excluded_rows] = True
+    scores, indices = index.search(query, k, excluded=excluded)
+    return scores, indices + start
+
+
+@contextlib.contextmanager
+def limit_blas_threads(num_threads):
+    """Limit the BLAS threads of the processes spawned inside the block, restoring the environment afterwards.
+
+    Spawned workers inherit the environment, so each one only gets its share of the BLAS threads while the calling
+    process keeps all of them.
+    """
+    previous_environment = {name: os.environ.get(name) for name in BLAS_THREAD_VARIABLES}
+    os.environ.update({name: str(num_threads) for name in BLAS_THREAD_VARIABLES})
+    try:
+        yield
+    finally:
+        for name, value in previous_environment.items():
+            if value is None:
+                os.environ.pop(name, None)
+            else:
+                os.environ[name] = value
+
+
+def read_manifest(shard_dir):
+    with open(Path(shard_dir) / MANIFEST_NAME) as f:
+        return json.load(f)
+
+
+def _write_manifest(shard_dir, manifest):
+    """Replace the manifest atomically, so readers never see a shard listed before its file is complete."""
+    tmp_path = Path(shard_dir) / f"{MANIFEST_NAME}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp_path, Path(shard_dir) / MANIFEST_NAME)
+
+
+def _write_shard(path, embeddings, block_size=65536):
+    shard = np.lib.format.open_memmap(path, mode="w+", dtype=np.float32, shape=embeddings.shape)
+    for start in range(0, len(embeddings), block_size):
+        end = start + block_size
+        shard[start:end] = embeddings[start:end]
+    shard.flush()
+
+
+class ShardedIndex:
+    """Exact cosine top-k over embeddings split into several shard files, searched in parallel by a process pool.
+
+    A manifest lists the shards in row order with the global id of their first row, so new recipes can be added as a
+    new shard without rewriting the others. Each worker memory-maps the shards it is asked to search, every shard
+    returns its own top-k and the results are merged into the global top-k.
+
+    The shards are a copy of the embeddings derived from the store, not the store itself. With a
+    `duplicate_index_path`, every worker loads the near-duplicate mask once and skips those rows itself, so a query
+    only sends the ids of the rows it excludes on top of them.
+    """
+
+    def __init__(self, shard_dir, num_workers=None, duplicate_index_path=None):
+        self.shard_dir = Path(shard_dir)
+        manifest = read_manifest(self.shard_dir)
+        self.num_rows = manifest["num_rows"]
+        self.shards = [
+            (str(self.shard_dir / shard["file"]), shard["start"], shard["num_rows"]) for shard in manifest["shards"]
+        ]
+        self.num_workers = num_workers or max(1, min(len(self.shards), os.cpu_count() or 1))
+
+        with limit_blas_threads(max(1, (os.cpu_count() or 1) // self.num_workers)):
+            self.pool = multiprocessing.get_context("spawn").Pool(
+                self.num_workers, initializer=_init_worker, initargs=(duplicate_index_path,)
+            )
+        logger.info(f"Searching {len(self.shards)} embedding shards with {self.num_workers} processes")
+
+    def search(self, query, k, excluded=None):
+        """Return (scores, indices) of the k best rows over all the shards, sorted by score.
+
+        The arguments are the ones of ExactIndex.search; the `excluded` mask covers every row of the index, and the
+        near-duplicates are skipped even when they are not in it.
+        """
+        query = np.asarray(query, dtype=np.float32)
+        excluded_rows = np.flatnonzero(excluded) if excluded is not None else np.empty(0, dtype=np.int64)
+        results = []
+        for path, start, num_rows in self.shards:
+            low, high = np.searchsorted(excluded_rows, [start, start + num_rows])
+            shard_rows = (excluded_rows[low:high] - start).astype(np.int32)
+            results.append(self.pool.apply_async(_search_shard, (path, start, num_rows, query, k, shard_rows)))
+        shard_scores, shard_indices = zip(*(result.get() for result in results))
+        scores, indices = np.concatenate(shard_scores), np.concatenate(shard_indices)
+        order = np.argsort(-scores)[:k]
+        return scores[order], indices[order]
+
+    def close(self):
+        self.pool.terminate()
+
+    @staticmethod
+    def build(embeddings, shard_dir, num_shards):
+        """Split the embeddings into `num_shards` shard files of about the same size, replacing any previous ones."""
+        shard_dir = Path(shard_dir)
+        tmp_dir = shard_dir.with_name(f"{shard_dir.name}.tmp")
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        tmp_dir.mkdir(parents=True)
+
+        num_rows = len(embeddings)
+        bounds = np.linspace(0, num_rows, max(1, min(num_shards, num_rows)) + 1).astype(np.int64)
+        shards = []
+        for shard_id, (start, end) in enumerate(zip(bounds[:-1], bounds[1:])):
+            file_name = f"shard-{shard_id:05d}.npy"
+            _write_shard(tmp_dir / file_name, embeddings[start:end])
+            shards.append({"file": file_name, "start": int(start), "num_rows": int(end - start)})
+        _write_manifest(tmp_dir, {"num_rows": num_rows, "dim": int(embeddings.shape[1]), "shards": shards})
+
+        shutil.rmtree(shard_dir, ignore_errors=True)
+        os.replace(tmp_dir, shard_dir)
+        logger.info(f"Wrote {num_rows} embeddings as {len(shards)} shards to {shard_dir}")
+
+    @staticmethod
+    def add_shard(shard_dir, embeddings):
+        """Append the embeddings of new rows as a new shard, after the rows already in the index."""
+        manifest = read_manifest(shard_dir)
+        file_name = f"shard-{len(manifest['shards']):05d}.npy"
+        _write_shard(Path(shard_dir) / file_name, embeddings)
+        manifest["shards"].append({"file": file_name, "start": manifest["num_rows"], "num_rows": len(embeddings)})
+        manifest["num_rows"] += len(embeddings)
+        _write_manifest(shard_dir, manifest)
+        logger.info(f"Added shard {file_name} with {len(embeddings)} embeddings")
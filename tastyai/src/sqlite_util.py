@@ -0,0 +1,53 @@
+import atexit
+import logging
+import sqlite3
+import threading
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+def connect(path):
+    """Open a SQLite file shared by several threads and processes, in WAL mode so readers do not block the writer."""
+    connection = sqlite3.connect(path, timeout=30, check_same_thread=False)
+    connection.execute("PRAGMA journal_mode=WAL")
+    return connection
+
+
+class BackgroundWriter:
+    """Call `flush` every `interval` seconds from a daemon thread, and once more at exit.
+
+    Used to keep the SQLite commits of the writes buffered in memory off the request path. The thread is only started
+    by the first `start`, so the processes that never buffer anything do not run it.
+    """
+
+    def __init__(self, flush, interval=1.0, name="sqlite-writer"):
+        self.flush = flush
+        self.interval = interval
+        self.name = name
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.thread = None
+
+    def start(self):
+        if self.thread is not None:
+            return
+        with self.lock:
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.__run, name=self.name, daemon=True)
+                self.thread.start()
+                atexit.register(self.close)
+
+    def close(self):
+        """Stop the thread and flush what is left."""
+        self.stopped.set()
+        if self.thread is not None:
+            self.thread.join()
+        self.flush()
+
+    def __run(self):
+        while not self.stopped.wait(self.interval):
+            try:
+                self.flush()
+            except Exception as e:
+                logger.error(f"Error in the {self.name} thread: {e}")
@@ -1,9 +1,9 @@
 import logging
 
+import tracing
+from engine import RecommendationEngine
 from image_generator import ImageGenerator
 from nlp import NLP
-from recommendation import Recommendation
-from vectorizer import Vectorizer
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -24,8 +24,11 @@ if openai_api_key.startswith("sk-"):
         print("Exiting...")
         exit()
     nlp = NLP(openai_api_key=openai_api_key)
+    image_generator = ImageGenerator(openai_api_key)
+    engine = RecommendationEngine()
 
-    user_profile = nlp.process_user_input(text)
+    with tracing.trace("user_input", frontend="terminal"):
+        user_profile = nlp.process_user_input(text)
 
     while not user_profile.is_recipe_request:
         if user_profile.language == "spanish":
@@ -49,12 +52,7 @@ if openai_api_key.startswith("sk-"):
             initial_message = "Generating meal recommendations..."
 
         print(initial_message)
-        vectorizer = Vectorizer("./tastyai/src/dataset/full_dataset.csv")
-        image_generator = ImageGenerator(openai_api_key)
-        recommendation = Recommendation(vectorizer, openai_api_key)
         logger.debug("Getting recommendations...")
-        recommendations = recommendation.get_meal_recommendation(user_profile, top_n=1)
-        logger.debug(f"Recommendations: {recommendations}")
 
         if user_profile.language == "spanish":
             print("### Según tus preferencias, te recomiendo las siguientes comidas:")
@@ -63,46 +61,55 @@ if openai_api_key.startswith("sk-"):
         else:
             print("### Based on your preferences, I recommend the following meals:")
 
-        for meal in recommendations:
-            print(f"#### {meal['translated_title']}")
-            if user_profile.language == "spanish" or user_profile.language == "portuguese":
-                print("**Ingredientes:**")
-            else:
-                print("**Ingredients:**")
-
-            print("\n".join([f"- {ingredient}" for ingredient in meal["translated_ingredients"]]))
-            if user_profile.language == "spanish":
-                print("**Instrucciones:**")
-            elif user_profile.language == "portuguese":
-                print("**Instruções:**")
-            else:
-                print("**Directions:**")
-
-            print("\n".join([f"{i + 1}. {step}" for i, step in enumerate(meal["translated_directions"])]))
-
-            spinner_message = f"Generating image for {meal['translated_title']}..."
-            if user_profile.language == "spanish":
-                spinner_message = f"Generando imagen para {meal['translated_title']}..."
-            elif user_profile.language == "portuguese":
-                spinner_message = f"Gerando imagem para {meal['translated_title']}..."
-            print(spinner_message)
-            image_url = image_generator.generate_image(meal)
-
-            if image_url:
-                if user_profile.language == "spanish":
-                    print(f"Imagen generada por IA de {meal['translated_title']}: {image_url}")
-                elif user_profile.language == "portuguese":
-                    print(f"Imagem gerada por IA de {meal['translated_title']}: {image_url}")
-                else:
-                    print(f"AI-generated image of {meal['translated_title']}: {image_url}")
-            else:
-                if user_profile.language == "spanish":
-                    print("No se pudo generar una imagen para esta comida.")
-                elif user_profile.language == "portuguese":
-                    print("Não foi possível gerar uma imagem para esta refeição.")
-                else:
-                    print("Could not generate an image for this meal.")
-            print("---")
+        # Meals are printed as soon as they are translated, and the images as soon as they are ready
+        with tracing.trace("recommendation", frontend="terminal", language=user_profile.language):
+            titles = {}
+            for stage, position, payload in engine.stream_recommendations(
+                user_profile, openai_api_key, image_generator, top_n=1
+            ):
+                logger.debug(f"Recommendation event: {stage} {position}")
+                if stage == "translated":
+                    meal = payload
+                    titles[position] = meal["translated_title"]
+                    print(f"#### {meal['translated_title']}")
+                    if user_profile.language == "spanish" or user_profile.language == "portuguese":
+                        print("**Ingredientes:**")
+                    else:
+                        print("**Ingredients:**")
+
+                    print("\n".join([f"- {ingredient}" for ingredient in meal["translated_ingredients"]]))
+                    if user_profile.language == "spanish":
+                        print("**Instrucciones:**")
+                    elif user_profile.language == "portuguese":
+                        print("**Instruções:**")
+                    else:
+                        print("**Directions:**")
+
+                    print("\n".join([f"{i + 1}. {step}" for i, step in enumerate(meal["translated_directions"])]))
+
+                    spinner_message = f"Generating image for {meal['translated_title']}..."
+                    if user_profile.language == "spanish":
+                        spinner_message = f"Generando imagen para {meal['translated_title']}..."
+                    elif user_profile.language == "portuguese":
+                        spinner_message = f"Gerando imagem para {meal['translated_title']}..."
+                    print(spinner_message)
+                    print("---")
+                elif stage == "image":
+                    image_path = payload
+                    if image_path:
+                        if user_profile.language == "spanish":
+                            print(f"Imagen generada por IA de {titles[position]}: {image_path}")
+                        elif user_profile.language == "portuguese":
+                            print(f"Imagem gerada por IA de {titles[position]}: {image_path}")
+                        else:
+                            print(f"AI-generated image of {titles[position]}: {image_path}")
+                    else:
+                        if user_profile.language == "spanish":
+                            print(f"No se pudo generar una imagen para {titles[position]}.")
+                        elif user_profile.language == "portuguese":
+                            print(f"Não foi possível gerar uma imagem para {titles[position]}.")
+                        else:
+                            print(f"Could not generate an image for {titles[position]}.")
 
         print("\n")
         text = input(initial_chat_message)
@@ -0,0 +1,249 @@
+import contextvars
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from collections import defaultdict
+from contextlib import contextmanager
+from pathlib import Path
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Prometheus text file rewritten after every request, e.g. for the textfile collector of the node exporter.
+# Set TASTYAI_METRICS_PATH to an empty string to disable it.
+METRICS_PATH = os.environ.get("TASTYAI_METRICS_PATH", "./tastyai/src/dataset/metrics.prom")
+# Upper bounds, in seconds, of the buckets of the stage duration histograms
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+_current_trace = contextvars.ContextVar("current_trace", default=None)
+_current_span = contextvars.ContextVar("current_span", default=None)
+
+
+class JsonFormatter(logging.Formatter):
+    """Format log records as one JSON object per line; dict messages are merged into the object."""
+
+    def format(self, record):
+        entry = {
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(record.created)) + f".{int(record.msecs):03d}Z",
+            "level": record.levelname,
+            "logger": record.name,
+        }
+        if isinstance(record.msg, dict):
+            entry.update(record.msg)
+        else:
+            entry["message"] = record.getMessage()
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+# Traces are always logged as JSON, on their own handler, whatever the format of the other logs
+trace_logger = logging.getLogger("tastyai.trace")
+trace_logger.setLevel(logging.INFO)
+trace_logger.propagate = False
+if not trace_logger.handlers:
+    _handler = logging.StreamHandler()
+    _handler.setFormatter(JsonFormatter())
+    trace_logger.addHandler(_handler)
+
+
+class Metrics:
+    """Process-wide, thread-safe aggregates of every stage and LLM call, rendered in the Prometheus text format."""
+
+    def __init__(self, buckets=DURATION_BUCKETS):
+        self.buckets = buckets
+        self.lock = threading.Lock()
+        self.duration_buckets = defaultdict(lambda: [0] * len(self.buckets))
+        self.duration_sum = defaultdict(float)
+        self.duration_count = defaultdict(int)
+        self.llm_calls = defaultdict(int)
+        self.llm_tokens = defaultdict(int)
+        self.requests = defaultdict(int)
+
+    def observe(self, stage, seconds):
+        with self.lock:
+            buckets = self.duration_buckets[stage]
+            for i, bound in enumerate(self.buckets):
+                if seconds <= bound:
+                    buckets[i] += 1
+            self.duration_sum[stage] += seconds
+            self.duration_count[stage] += 1
+
+    def count_llm_call(self, stage, prompt_tokens, completion_tokens):
+        with self.lock:
+            self.llm_calls[stage] += 1
+            self.llm_tokens[(stage, "prompt")] += prompt_tokens
+            self.llm_tokens[(stage, "completion")] += completion_tokens
+
+    def count_request(self, name):
+        with self.lock:
+            self.requests[name] += 1
+
+    def render(self):
+        """Return every metric in the Prometheus text exposition format."""
+        lines = [
+            "# HELP tastyai_stage_duration_seconds Duration of each stage of the recommendation pipeline.",
+            "# TYPE tastyai_stage_duration_seconds histogram",
+        ]
+        with self.lock:
+            for stage in sorted(self.duration_count):
+                for bound, count in zip(self.buckets, self.duration_buckets[stage]):
+                    lines.append(f'tastyai_stage_duration_seconds_bucket{{stage="{stage}",le="{bound}"}} {count}')
+                count = self.duration_count[stage]
+                lines.append(f'tastyai_stage_duration_seconds_bucket{{stage="{stage}",le="+Inf"}} {count}')
+                lines.append(f'tastyai_stage_duration_seconds_sum{{stage="{stage}"}} {self.duration_sum[stage]:.6f}')
+                lines.append(f'tastyai_stage_duration_seconds_count{{stage="{stage}"}} {count}')
+
+            lines.append("# HELP tastyai_llm_calls_total Number of calls to the OpenAI API, by stage.")
+            lines.append("# TYPE tastyai_llm_calls_total counter")
+            for stage in sorted(self.llm_calls):
+                lines.append(f'tastyai_llm_calls_total{{stage="{stage}"}} {self.llm_calls[stage]}')
+
+            lines.append("# HELP tastyai_llm_tokens_total Number of tokens used by the OpenAI API, by stage.")
+            lines.append("# TYPE tastyai_llm_tokens_total counter")
+            for stage, kind in sorted(self.llm_tokens):
+                tokens = self.llm_tokens[(stage, kind)]
+                lines.append(f'tastyai_llm_tokens_total{{stage="{stage}",type="{kind}"}} {tokens}')
+
+            lines.append("# HELP tastyai_requests_total Number of traced requests.")
+            lines.append("# TYPE tastyai_requests_total counter")
+            for name in sorted(self.requests):
+                lines.append(f'tastyai_requests_total{{name="{name}"}} {self.requests[name]}')
+        return "\n".join(lines) + "\n"
+
+    def write(self, path):
+        """Write the metrics to a file atomically, so a scraper never reads a partial file."""
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_name(f"{path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+        tmp_path.write_text(self.render())
+        os.replace(tmp_path, path)
+
+
+metrics = Metrics()
+
+
+class Trace:
+    """The spans and LLM usage of a single request, possibly recorded from several threads."""
+
+    def __init__(self, name, attributes):
+        self.name = name
+        self.request_id = uuid.uuid4().hex
+        self.attributes = attributes
+        self.start_time = time.perf_counter()
+        self.lock = threading.Lock()
+        self.spans = []
+        self.llm_calls = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+
+    def add_span(self, span):
+        with self.lock:
+            self.spans.append(span)
+
+    def add_llm_call(self, prompt_tokens, completion_tokens):
+        with self.lock:
+            self.llm_calls += 1
+            self.prompt_tokens += prompt_tokens
+            self.completion_tokens += completion_tokens
+
+    def to_dict(self):
+        with self.lock:
+            return {
+                "event": "trace",
+                "name": self.name,
+                "request_id": self.request_id,
+                **self.attributes,
+                "duration_ms": round((time.perf_counter() - self.start_time) * 1000, 3),
+                "llm_calls": self.llm_calls,
+                "prompt_tokens": self.prompt_tokens,
+                "completion_tokens": self.completion_tokens,
+                "spans": sorted(self.spans, key=lambda span: span["start_ms"]),
+            }
+
+
+@contextmanager
+def trace(name, **attributes):
+    """Trace a request: every span and LLM call made inside it, in this thread or in the ones it starts with
+    `propagate`, is attached to it. When the request ends, it is logged as JSON and the metrics file is updated.
+
+    Nested calls reuse the trace already in progress.
+    """
+    if _current_trace.get() is not None:
+        yield _current_trace.get()
+        return
+
+    current = Trace(name, attributes)
+    token = _current_trace.set(current)
+    try:
+        yield current
+    finally:
+        _current_trace.reset(token)
+        metrics.count_request(name)
+        trace_logger.info(current.to_dict())
+        if METRICS_PATH:
+            try:
+                metrics.write(METRICS_PATH)
+            except OSError as e:
+                logger.error(f"Error writing the metrics file: {e}")
+
+
+@contextmanager
+def span(stage, **attributes):
+    """Time a stage of the pipeline; the attributes are only kept in the trace, not in the metrics."""
+    token = _current_span.set(stage)
+    start_time = time.perf_counter()
+    error = None
+    try:
+        yield attributes
+    except BaseException as e:
+        error = type(e).__name__
+        raise
+    finally:
+        seconds = time.perf_counter() - start_time
+        _current_span.reset(token)
+        metrics.observe(stage, seconds)
+        current = _current_trace.get()
+        if current is not None:
+            record = {
+                "stage": stage,
+                "start_ms": round((start_time - current.start_time) * 1000, 3),
+                "duration_ms": round(seconds * 1000, 3),
+                "thread": threading.current_thread().name,
+                **attributes,
+            }
+            if error is not None:
+                record["error"] = error
+            current.add_span(record)
+
+
+def record_llm_call(result=None):
+    """Count an OpenAI call, and its tokens when the result reports them, under the current stage and request."""
+    prompt_tokens, completion_tokens = 0, 0
+    usage = getattr(result, "usage_metadata", None)
+    if usage:
+        prompt_tokens, completion_tokens = usage.get("input_tokens", 0), usage.get("output_tokens", 0)
+    else:
+        usage = (getattr(result, "response_metadata", None) or {}).get("token_usage") or {}
+        prompt_tokens, completion_tokens = usage.get("prompt_tokens", 0), usage.get("completion_tokens", 0)
+
+    metrics.count_llm_call(_current_span.get() or "unknown", prompt_tokens, completion_tokens)
+    current = _current_trace.get()
+    if current is not None:
+        current.add_llm_call(prompt_tokens, completion_tokens)
+
+
+def propagate(function):
+    """Wrap a function so it runs in the tracing context of the caller, e.g. in another thread.
+
+    The context is copied when wrapping, so wrap the function once per thread or task that runs it.
+    """
+    context = contextvars.copy_context()
+
+    def run(*args, **kwargs):
+        return context.run(function, *args, **kwargs)
+
+    return run
@@ -0,0 +1,94 @@
+import hashlib
+import json
+import logging
+import threading
+import time
+
+import sqlite_util
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+class TranslationCache:
+    """Persistent, content-addressed cache of translations, shared by every process through a SQLite file.
+
+    Entries are keyed by a hash of (source text, target language, prompt version), so changing the translation
+    prompt invalidates them. The cache holds at most `max_entries` translations and evicts the least recently used
+    ones when it grows past that. A hit only reads the file: the access times of the entries read are kept in memory
+    and written by a background thread every `flush_interval` seconds, and before any eviction.
+    """
+
+    def __init__(self, path, max_entries=200000, flush_interval=1.0):
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        self.accesses = {}
+        self.accesses_lock = threading.Lock()
+        self.writer = sqlite_util.BackgroundWriter(self.flush, flush_interval, name="translation-cache")
+        self.connection = sqlite_util.connect(path)
+        with self.connection:
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS translations "
+                "(key TEXT PRIMARY KEY, translation TEXT NOT NULL, last_access REAL NOT NULL)"
+            )
+            self.connection.execute("CREATE INDEX IF NOT EXISTS translations_last_access ON translations (last_access)")
+            (self.size,) = self.connection.execute("SELECT COUNT(*) FROM translations").fetchone()
+
+    @staticmethod
+    def key(text, language, prompt_version):
+        return hashlib.sha256(json.dumps([text, language, prompt_version]).encode("utf-8")).hexdigest()
+
+    def get(self, text, language, prompt_version):
+        """Return the cached translation, or None on a miss."""
+        key = self.key(text, language, prompt_version)
+        with self.lock:
+            row = self.connection.execute("SELECT translation FROM translations WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        with self.accesses_lock:
+            self.accesses[key] = time.time()
+        self.writer.start()
+        return row[0]
+
+    def put(self, text, language, prompt_version, translation):
+        """Store a translation, evicting the least recently used entries if the cache is full."""
+        key = self.key(text, language, prompt_version)
+        with self.lock, self.connection:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO translations (key, translation, last_access) VALUES (?, ?, ?)",
+                (key, translation, time.time()),
+            )
+            self.size += 1
+            if self.size <= self.max_entries:
+                return
+            # Other processes may share the file, so the real size is only counted when the bound seems reached
+            (self.size,) = self.connection.execute("SELECT COUNT(*) FROM translations").fetchone()
+            if self.size > self.max_entries:
+                self.__write_accesses()
+                # Evict a little more than needed so the next inserts do not evict again right away
+                evict = self.size - int(self.max_entries * 0.9)
+                self.connection.execute(
+                    "DELETE FROM translations WHERE key IN "
+                    "(SELECT key FROM translations ORDER BY last_access LIMIT ?)",
+                    (evict,),
+                )
+                self.size -= evict
+                logger.debug(f"Evicted {evict} translations from the cache")
+
+    def flush(self):
+        """Write the access times of the entries read since the last flush."""
+        with self.lock, self.connection:
+            self.__write_accesses()
+
+    def close(self):
+        """Stop the background writer and write the access times left."""
+        self.writer.close()
+
+    def __write_accesses(self):
+        with self.accesses_lock:
+            accesses, self.accesses = self.accesses, {}
+        if accesses:
+            self.connection.executemany(
+                "UPDATE translations SET last_access = ? WHERE key = ?",
+                [(access_time, key) for key, access_time in accesses.items()],
+            )
@@ -1,20 +1,28 @@
+import asyncio
 import json
 import logging
 
-from langchain.prompts import ChatPromptTemplate
-from langchain.schema.runnable import RunnableSequence
-from langchain_openai import ChatOpenAI
-from langdetect import detect
+import tracing
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Bump when the translation prompt changes, so the cached translations of the old prompt are not reused
+PROMPT_VERSION = 1
+
 
 class Translator:
-    def __init__(self, openai_key, language="english"):
+    def __init__(self, openai_key, language="english", cache=None, llm=None, max_concurrency=4, meals_per_request=3):
+        # langchain is slow to import, so it is only imported once a translator is needed
+        from langchain.prompts import ChatPromptTemplate
+        from langchain_openai import ChatOpenAI
+
         self.openai_key = openai_key
         self.language = language
-        self.llm = ChatOpenAI(model_name="gpt-4o-mini", temperature=0, api_key=openai_key)
+        self.cache = cache
+        self.max_concurrency = max_concurrency
+        self.meals_per_request = meals_per_request
+        self.llm = llm or ChatOpenAI(model_name="gpt-4o-mini", temperature=0, api_key=openai_key)
         self.prompt = ChatPromptTemplate.from_messages(
             [
                 (
@@ -29,19 +37,152 @@ class Translator:
                 ("human", "{query}"),
             ]
         )
+        self.batch_prompt = ChatPromptTemplate.from_messages(
+            [
+                (
+                    "system",
+                    (
+                        "You are an AI assistant that translates recipes from english to another language. You will "
+                        'receive a JSON list of recipes, each one with a "title" string and "ingredients" and '
+                        '"directions" lists of strings. Translate every string to the following language: '
+                        f"'''{self.language}'''. Return only a JSON list with the translated recipes, in the same "
+                        "order and with the same structure and number of items, without any other text."
+                    ),
+                ),
+                ("human", "{query}"),
+            ]
+        )
 
     def translate(self, text):
+        if self.cache is not None:
+            cached = self.cache.get(text, self.language, PROMPT_VERSION)
+            if cached is not None:
+                logger.debug(f"Translation cache hit: {cached}")
+                return cached
+
+        from langchain.schema.runnable import RunnableSequence
+
         chain = RunnableSequence(self.prompt | self.llm)
         result = chain.invoke({"query": text})
+        tracing.record_llm_call(result)
         try:
             content = result.content
             logger.info(f"Translation: {content}")
-            return content
         except json.JSONDecodeError:
             logger.error("Error: Unable to parse JSON response from ChatGPT")
             return None
 
+        if self.cache is not None:
+            self.cache.put(text, self.language, PROMPT_VERSION, content)
+        return content
+
+    def translate_meal(self, meal):
+        """Translate the title, ingredients and directions of a meal.
+
+        Ingredients and directions are joined with a separator so each of them only needs one call.
+        """
+        ingredients_text = " | ".join(meal["ingredients"])
+        directions_text = " | ".join(meal["directions"])
+
+        return {
+            "translated_title": self.translate(meal["title"]),
+            "translated_ingredients": self.translate(ingredients_text).split(" | "),
+            "translated_directions": self.translate(directions_text).split(" | "),
+        }
+
+    def __cached_meal(self, meal):
+        """Return the translated fields of a meal if all three are cached, otherwise None."""
+        if self.cache is None:
+            return None
+        texts = [meal["title"], " | ".join(meal["ingredients"]), " | ".join(meal["directions"])]
+        cached = [self.cache.get(text, self.language, PROMPT_VERSION) for text in texts]
+        if any(translation is None for translation in cached):
+            return None
+        return {
+            "translated_title": cached[0],
+            "translated_ingredients": cached[1].split(" | "),
+            "translated_directions": cached[2].split(" | "),
+        }
+
+    def __cache_meal(self, meal, translation):
+        if self.cache is None:
+            return
+        self.cache.put(meal["title"], self.language, PROMPT_VERSION, translation["translated_title"])
+        self.cache.put(
+            " | ".join(meal["ingredients"]),
+            self.language,
+            PROMPT_VERSION,
+            " | ".join(translation["translated_ingredients"]),
+        )
+        self.cache.put(
+            " | ".join(meal["directions"]),
+            self.language,
+            PROMPT_VERSION,
+            " | ".join(translation["translated_directions"]),
+        )
+
+    async def __atranslate_batch(self, meals, semaphore):
+        """Translate several meals with one structured request, falling back to one meal at a time on a bad answer."""
+        payload = [
+            {"title": meal["title"], "ingredients": list(meal["ingredients"]), "directions": list(meal["directions"])}
+            for meal in meals
+        ]
+        from langchain.schema.runnable import RunnableSequence
+
+        chain = RunnableSequence(self.batch_prompt | self.llm)
+        async with semaphore:
+            result = await chain.ainvoke({"query": json.dumps(payload, ensure_ascii=False)})
+        tracing.record_llm_call(result)
+
+        try:
+            translated = json.loads(result.content)
+            if not isinstance(translated, list) or len(translated) != len(meals):
+                raise ValueError(f"expected {len(meals)} recipes")
+            translations = [
+                {
+                    "translated_title": item["title"],
+                    "translated_ingredients": list(item["ingredients"]),
+                    "translated_directions": list(item["directions"]),
+                }
+                for item in translated
+            ]
+        except (json.JSONDecodeError, KeyError, TypeError, ValueError) as e:
+            logger.error(f"Error: Unable to parse batch translation from ChatGPT ({e}), translating one by one")
+            return await asyncio.gather(*(asyncio.to_thread(self.translate_meal, meal) for meal in meals))
+
+        for meal, translation in zip(meals, translations):
+            self.__cache_meal(meal, translation)
+        return translations
+
+    async def atranslate_meals(self, meals):
+        """Translate the title, ingredients and directions of several meals concurrently.
+
+        Cached meals are served from the cache; the others are grouped into structured requests of
+        `meals_per_request` meals, issued concurrently with at most `max_concurrency` requests in flight.
+        """
+        translations = [self.__cached_meal(meal) for meal in meals]
+        missing = [i for i, translation in enumerate(translations) if translation is None]
+        batches = []
+        for start in range(0, len(missing), self.meals_per_request):
+            end = start + self.meals_per_request
+            batches.append(missing[start:end])
+
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+        results = await asyncio.gather(
+            *(self.__atranslate_batch([meals[i] for i in batch], semaphore) for batch in batches)
+        )
+        for batch, batch_translations in zip(batches, results):
+            for i, translation in zip(batch, batch_translations):
+                translations[i] = translation
+        return translations
+
+    def translate_meals(self, meals):
+        """Blocking version of atranslate_meals."""
+        return asyncio.run(self.atranslate_meals(meals))
+
     def detect_language(self, text):
+        from langdetect import detect
+
         language = detect(text)
         logger.info(f"Detected language: {language} on text {text}")
         if language == "es":
@@ -1,44 +1,183 @@
-import ast
+import hashlib
 import logging
+import multiprocessing
+import os
 import time
+from collections import deque
 from pathlib import Path
 
 import numpy as np
-import pandas as pd
-import torch
-from sentence_transformers import SentenceTransformer
-from torch.utils.data import DataLoader
+from ann_index import IVFIndex
+from compressed_index import CompressedIndex
+from duplicate_index import DuplicateIndex
+from exact_index import ExactIndex
+from ingredient_index import IngredientIndex
+from lazy_import import lazy_import
+from lexical_index import BM25Index
+from recipe_store import RecipeStore, string_to_list
+from recommendation_stats import RecommendationStats
+from sharded_index import MANIFEST_NAME, ShardedIndex, read_manifest
+
+pd = lazy_import("pandas")
+torch = lazy_import("torch")
+sentence_transformers = lazy_import("sentence_transformers")
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+MODEL_NAME = "all-MiniLM-L6-v2"
+# Above this fraction of new or changed rows, the centroids of the ANN index are trained again instead of reused
+ANN_RETRAIN_FRACTION = 0.25
+# Minimum fraction of the fp32 top-k that the int8 query encoder must return to be used
+QUANTIZED_AGREEMENT_THRESHOLD = 0.9
+
+_worker_model = None
+_worker_batch_size = None
+
+
+def _init_worker(model_name, batch_size, num_threads):
+    """Load a private CPU model in each worker process of the parallel vectorization pool."""
+    global _worker_model, _worker_batch_size
+    torch.set_num_threads(num_threads)
+    _worker_model = sentence_transformers.SentenceTransformer(model_name, device="cpu")
+    _worker_batch_size = batch_size
+
+
+def _hash_texts(texts):
+    """Return a 64-bit content hash of each text, used to find the rows that changed between two runs."""
+    digests = b"".join(hashlib.blake2b(str(text).encode("utf-8"), digest_size=8).digest() for text in texts)
+    return np.frombuffer(digests, dtype="<u8")
+
+
+def _quantize(model):
+    """Dynamically quantize the linear layers of a CPU model to int8, in place."""
+    return torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8, inplace=True)
+
+
+def _encode_block(texts):
+    """Encode a block of already combined texts inside a worker process."""
+    embeddings = _worker_model.encode(texts, batch_size=_worker_batch_size, normalize_embeddings=True)
+    return embeddings.astype(np.float32)
+
 
 class Vectorizer:
-    def __init__(self, file_path, batch_size=32, use_gpu=True, chunk_size=50000):
+    def __init__(
+        self,
+        file_path,
+        batch_size=32,
+        use_gpu=True,
+        chunk_size=50000,
+        model=None,
+        num_shards=None,
+        quantize_queries=False,
+        compressed_dims=None,
+    ):
         self.file_path = file_path
         self.batch_size = batch_size
         self.chunk_size = chunk_size
-        self.device = "cuda" if torch.cuda.is_available() and use_gpu else "cpu"
-        logger.debug(f"Using device: {self.device}")
-        self.model = SentenceTransformer("all-MiniLM-L6-v2", device=self.device)
+        self.num_shards = num_shards
+        self.compressed_dims = compressed_dims
+        self.use_gpu = use_gpu
+        self.quantize_queries = quantize_queries
+        self.__device = None
+        self.__model = model
+        self.__custom_model = model is not None
+        self.__query_model = None
         self.embeddings_file_path = Path(self.file_path).with_name("embeddings.npy")
         self.metadata_file_path = Path(self.file_path).with_name("metadata.pkl")
+        self.partial_embeddings_file_path = Path(self.file_path).with_name("embeddings.partial.npy")
+        self.row_hashes_file_path = Path(self.file_path).with_name("row_hashes.npy")
+        self.partial_row_hashes_file_path = Path(self.file_path).with_name("row_hashes.partial.npy")
+        self.checkpoint_file_path = Path(self.file_path).with_name("embeddings.checkpoint.pkl")
+        self.ann_index_file_path = Path(self.file_path).with_name("ann_index.npz")
+        self.recipe_store_path = Path(self.file_path).with_name("recipes")
+        self.ingredient_index_file_path = Path(self.file_path).with_name("ingredient_index.npz")
+        self.lexical_index_file_path = Path(self.file_path).with_name("lexical_index.npz")
+        self.duplicate_index_file_path = Path(self.file_path).with_name("duplicate_index.npz")
+        self.stats_file_path = Path(self.file_path).with_name("recommendation_stats.sqlite")
+        self.shard_dir = Path(self.file_path).with_name("embedding_shards")
+        self.compressed_index_file_path = Path(self.file_path).with_name("compressed_index.npz")
+        self.compressed_codes_file_path = Path(self.file_path).with_name("compressed_codes.npy")
         logger.debug(f"Embeddings file path: {self.embeddings_file_path}")
         logger.debug(f"Metadata file path: {self.metadata_file_path}")
 
-        self.df = pd.read_csv(self.file_path)
+    @property
+    def device(self):
+        if self.__device is None:
+            self.__device = "cuda" if torch.cuda.is_available() and self.use_gpu else "cpu"
+            logger.debug(f"Using device: {self.__device}")
+        return self.__device
+
+    @property
+    def model(self):
+        """The fp32 sentence transformer, only loaded when something has to be encoded."""
+        if self.__model is None:
+            self.__model = sentence_transformers.SentenceTransformer(MODEL_NAME, device=self.device)
+        return self.__model
 
-    def __string_to_list(self, s):
-        """Convert a string representation of a list into an actual list."""
-        try:
-            return ast.literal_eval(s)
-        except (SyntaxError, ValueError):
-            return []
+    @property
+    def query_model(self):
+        """The model used to encode the queries: the int8 CPU model when enabled and accurate enough, else `model`."""
+        if not self.quantize_queries:
+            return self.model
+        if self.__query_model is None:
+            self.__query_model = self.__load_quantized_model()
+        return self.__query_model
+
+    @property
+    def store_version(self):
+        """Version of the embedding store: the checksum of the dataset it was built from, which changes with every
+        update of the embeddings."""
+        fingerprint = self.__load_metadata().get("dataset") or {}
+        return fingerprint.get("sha256") or str(self.embeddings_file_path.stat().st_mtime_ns)
+
+    def __load_quantized_model(self):
+        if self.__model is not None and not isinstance(self.__model, sentence_transformers.SentenceTransformer):
+            logger.warning("Quantized queries are only supported with the default model, using the given model")
+            return self.model
+
+        check = self.__load_metadata().get("quantized_query_encoder") or self.check_quantized_encoder()
+        agreement = check["agreement"]
+        if agreement < QUANTIZED_AGREEMENT_THRESHOLD:
+            logger.warning(
+                f"The int8 query encoder only returns {agreement:.3f} of the fp32 top-{check['k']} "
+                f"(threshold {QUANTIZED_AGREEMENT_THRESHOLD}), using the fp32 model"
+            )
+            return self.model
+        logger.info(f"Using the int8 query encoder (top-{check['k']} agreement with fp32: {agreement:.3f})")
+        return _quantize(sentence_transformers.SentenceTransformer(MODEL_NAME, device="cpu"))
+
+    def check_quantized_encoder(self, num_queries=200, k=10, seed=0):
+        """Measure how much of the fp32 top-k the int8 query encoder returns, and save it to the metadata.
+
+        The queries are built like the ones of the recommendations, from the ingredients of random recipes.
+        """
+        embeddings = np.load(self.embeddings_file_path, mmap_mode="r")
+        recipes = self.load_recipe_store()
+        rng = np.random.default_rng(seed)
+        rows = rng.choice(len(recipes), size=min(num_queries, len(recipes)), replace=False)
+        queries = [
+            " ".join([str(item) for item in recipes.get_column("NER", row)[:3]] + [str(rng.choice(["low", "normal"]))])
+            for row in rows
+        ]
+
+        quantized_model = _quantize(sentence_transformers.SentenceTransformer(MODEL_NAME, device="cpu"))
+        index = ExactIndex(embeddings)
+        _, fp32_ids = index.search_batch(self.model.encode(queries, normalize_embeddings=True), k)
+        _, int8_ids = index.search_batch(quantized_model.encode(queries, normalize_embeddings=True), k)
+        agreement = float(np.mean([len(np.intersect1d(a, b)) / k for a, b in zip(fp32_ids, int8_ids)]))
+
+        check = {"agreement": agreement, "k": k, "num_queries": len(queries)}
+        logger.info(f"Top-{k} agreement of the int8 query encoder with fp32: {agreement:.3f}")
+        metadata = self.__load_metadata()
+        metadata["quantized_query_encoder"] = check
+        pd.to_pickle(metadata, self.metadata_file_path)
+        return check
 
     def __get_combined_features(self, df):
         """Combine title, ingredients, and named entities (NER) into a single text feature."""
-        df["NER"] = df["NER"].apply(self.__string_to_list)
-        df["ingredients"] = df["ingredients"].apply(self.__string_to_list)
+        df["NER"] = df["NER"].apply(string_to_list)
+        df["ingredients"] = df["ingredients"].apply(string_to_list)
 
         return (
             df["title"]
@@ -48,48 +187,561 @@ class Vectorizer:
             + df["ingredients"].apply(lambda x: " ".join(x))
         ).tolist()
 
-    def vectorize(self):
-        """Efficiently process and vectorize dataset in chunks without loading everything into memory."""
-        if self.embeddings_file_path.exists():
-            logger.debug("Loading existing embeddings from disk...")
-            return np.load(self.embeddings_file_path, mmap_mode="r")
+    def __dataset_signature(self):
+        """Return the size and modification time of the dataset, used to validate a checkpoint."""
+        stat = os.stat(self.file_path)
+        return {"size": stat.st_size, "mtime": stat.st_mtime}
 
-        logger.debug(f"Processing dataset in chunks (Chunk Size: {self.chunk_size})...")
+    def __dataset_checksum(self):
+        """Return the SHA-256 of the dataset file, read in 1 MB blocks."""
+        checksum = hashlib.sha256()
+        with open(self.file_path, "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                checksum.update(block)
+        return checksum.hexdigest()
 
-        start_time = time.time()
+    def __fingerprint(self, num_rows, checksum=None):
+        """Return the fingerprint of the dataset saved in the metadata, to detect when it changes."""
+        return {**self.__dataset_signature(), "sha256": checksum or self.__dataset_checksum(), "num_rows": num_rows}
+
+    def __count_rows(self):
+        """Count the dataset rows with a cheap single-column pass over the CSV."""
+        return sum(len(chunk) for chunk in pd.read_csv(self.file_path, usecols=[0], chunksize=self.chunk_size))
 
-        first_pass = True
-        total_rows = 0
-        embeddings_list = []
+    def __load_checkpoint(self):
+        """Load the checkpoint of an interrupted run, if it still matches the dataset on disk."""
+        partial_files = [
+            self.checkpoint_file_path,
+            self.partial_embeddings_file_path,
+            self.partial_row_hashes_file_path,
+        ]
+        if not all(path.exists() for path in partial_files):
+            return None
+        checkpoint = pd.read_pickle(self.checkpoint_file_path)
+        if checkpoint.get("dataset") != self.__dataset_signature():
+            logger.info("Dataset changed since the last checkpoint, restarting vectorization...")
+            return None
+        return checkpoint
 
+    def __save_checkpoint(self, checkpoint):
+        """Atomically persist the checkpoint so a crash never leaves it half-written."""
+        tmp_path = self.checkpoint_file_path.with_suffix(".tmp")
+        pd.to_pickle(checkpoint, tmp_path)
+        os.replace(tmp_path, self.checkpoint_file_path)
+
+    def __open_store(self):
+        """Open the preallocated embedding and row hash stores, resuming from the last checkpoint when possible."""
+        checkpoint = self.__load_checkpoint()
+        if checkpoint is not None:
+            logger.info(f"Resuming vectorization at row {checkpoint['completed_rows']} of {checkpoint['num_rows']}...")
+            embeddings = np.lib.format.open_memmap(self.partial_embeddings_file_path, mode="r+")
+            row_hashes = np.lib.format.open_memmap(self.partial_row_hashes_file_path, mode="r+")
+            return embeddings, row_hashes, checkpoint
+
+        num_rows = self.__count_rows()
+        embedding_dim = self.model.get_sentence_embedding_dimension()
+        embeddings = np.lib.format.open_memmap(
+            self.partial_embeddings_file_path, mode="w+", dtype=np.float32, shape=(num_rows, embedding_dim)
+        )
+        row_hashes = np.lib.format.open_memmap(
+            self.partial_row_hashes_file_path, mode="w+", dtype=np.uint64, shape=(num_rows,)
+        )
+        checkpoint = {
+            "dataset": self.__dataset_signature(),
+            "num_rows": num_rows,
+            "completed_rows": 0,
+            "time_taken": 0.0,
+        }
+        self.__save_checkpoint(checkpoint)
+        return embeddings, row_hashes, checkpoint
+
+    def __encode(self, texts):
+        """Encode a list of texts in batches and return a float32 numpy array."""
+        from torch.utils.data import DataLoader
+
+        data_loader = DataLoader(texts, batch_size=self.batch_size, shuffle=False)
+
+        batches = []
+        for batch in data_loader:
+            batch_embeddings = self.model.encode(
+                batch, convert_to_tensor=True, device=self.device, normalize_embeddings=True
+            )
+            batches.append(batch_embeddings.cpu().numpy())
+
+        return np.vstack(batches).astype(np.float32, copy=False)
+
+    def __load_metadata(self):
+        """Load the metadata saved next to the embeddings, or an empty dict if there is none."""
+        return pd.read_pickle(self.metadata_file_path) if self.metadata_file_path.exists() else {}
+
+    def __normalize_store(self, block_size=65536):
+        """Scale the rows of an embeddings file written before normalization was done at index time to unit length."""
+        logger.info("Normalizing existing embeddings in place...")
+        embeddings = np.load(self.embeddings_file_path, mmap_mode="r+")
+        for start in range(0, len(embeddings), block_size):
+            end = start + block_size
+            block = embeddings[start:end]
+            block /= np.maximum(np.linalg.norm(block, axis=1, keepdims=True), 1e-12)
+        embeddings.flush()
+        del embeddings
+
+        # The ANN index stores the norms of the old vectors, so it has to be rebuilt
+        self.ann_index_file_path.unlink(missing_ok=True)
+        metadata = self.__load_metadata()
+        metadata["normalized"] = True
+        pd.to_pickle(metadata, self.metadata_file_path)
+
+    def __iter_pending_chunks(self, completed_rows):
+        """Yield (start_row, combined_texts) for every chunk of the dataset not yet written to the store."""
+        row_offset = 0
         for chunk in pd.read_csv(self.file_path, chunksize=self.chunk_size):
-            chunk_start_time = time.time()
-            combined_texts = self.__get_combined_features(chunk)
+            chunk_start, row_offset = row_offset, row_offset + len(chunk)
+            if row_offset <= completed_rows:
+                continue
+            # A previous run may have used a different chunk size, so only skip the rows already written
+            if chunk_start < completed_rows:
+                skipped = completed_rows - chunk_start
+                chunk, chunk_start = chunk.iloc[skipped:].copy(), completed_rows
+            yield chunk_start, self.__get_combined_features(chunk)
+
+    @staticmethod
+    def __hash_chunks(chunks, row_hashes):
+        """Write the content hash of every row to `row_hashes` while passing the chunks through."""
+        for chunk_start, texts in chunks:
+            chunk_end = chunk_start + len(texts)
+            row_hashes[chunk_start:chunk_end] = _hash_texts(texts)
+            yield chunk_start, texts
+
+    def __encode_parallel(self, pending_chunks, num_workers):
+        """Encode chunks across a pool of CPU worker processes, yielding (start_row, embeddings) in row order.
+
+        The calling process parses the next chunks while the workers encode the blocks already submitted, with at
+        most a few blocks per worker in flight to keep memory bounded.
+        """
+        if self.device != "cpu":
+            logger.warning("Parallel vectorization runs on CPU worker processes, the GPU will not be used")
+
+        block_size = max(self.batch_size, self.chunk_size // (num_workers * 4))
+        max_in_flight = num_workers * 4
+        num_threads = max(1, (os.cpu_count() or 1) // num_workers)
+        context = multiprocessing.get_context("spawn")
+
+        with context.Pool(
+            num_workers, initializer=_init_worker, initargs=(MODEL_NAME, self.batch_size, num_threads)
+        ) as pool:
+            in_flight = deque()
+            for chunk_start, texts in pending_chunks:
+                for offset in range(0, len(texts), block_size):
+                    offset_end = offset + block_size
+                    block = texts[offset:offset_end]
+                    in_flight.append((chunk_start + offset, pool.apply_async(_encode_block, (block,))))
+                    if len(in_flight) >= max_in_flight:
+                        block_start, result = in_flight.popleft()
+                        yield block_start, result.get()
+            while in_flight:
+                block_start, result = in_flight.popleft()
+                yield block_start, result.get()
+
+    def __check_dataset(self):
+        """Compare the dataset with the fingerprint saved with the embeddings.
+
+        Returns the checksum of the dataset if its content changed, None if the embeddings are up to date. Embeddings
+        written before the row hashes were kept are assumed to match the dataset when the number of rows is the same,
+        otherwise they are deleted so the next step vectorizes the dataset from scratch.
+        """
+        metadata = self.__load_metadata()
+        fingerprint = metadata.get("dataset")
+        if fingerprint is not None and all(
+            fingerprint[key] == value for key, value in self.__dataset_signature().items()
+        ):
+            return None
+
+        checksum = self.__dataset_checksum()
+        if fingerprint is not None and fingerprint["sha256"] == checksum:
+            # Only the modification time changed
+            metadata["dataset"] = self.__fingerprint(fingerprint["num_rows"], checksum)
+            pd.to_pickle(metadata, self.metadata_file_path)
+            return None
+
+        if self.row_hashes_file_path.exists():
+            return checksum
+
+        logger.info("Embeddings have no row hashes, hashing the dataset...")
+        num_rows = len(np.load(self.embeddings_file_path, mmap_mode="r"))
+        row_hashes = np.concatenate([_hash_texts(texts) for _, texts in self.__iter_pending_chunks(0)])
+        if len(row_hashes) != num_rows:
+            logger.warning("The dataset does not match the existing embeddings, vectorizing it again...")
+            self.embeddings_file_path.unlink()
+            return None
+        np.save(self.row_hashes_file_path, row_hashes)
+        metadata["dataset"] = self.__fingerprint(num_rows, checksum)
+        pd.to_pickle(metadata, self.metadata_file_path)
+        return None
+
+    def __update_store(self, checksum):
+        """Re-vectorize only the new and changed rows of the dataset, reusing the embeddings of every other row.
+
+        Rows are matched by the hash of their combined text, so appended, edited, deleted and reordered rows are all
+        handled. The derived indexes are then updated: the ANN index keeps its centroids unless too many rows changed.
+        """
+        start_time = time.time()
+        old_embeddings = np.load(self.embeddings_file_path, mmap_mode="r")
+        old_hashes = np.load(self.row_hashes_file_path)
+        order = np.argsort(old_hashes, kind="stable")
+        sorted_hashes = old_hashes[order]
+
+        num_rows = self.__count_rows()
+        embeddings = np.lib.format.open_memmap(
+            self.partial_embeddings_file_path, mode="w+", dtype=np.float32, shape=(num_rows, old_embeddings.shape[1])
+        )
+        row_hashes = np.empty(num_rows, dtype=np.uint64)
+        source_rows = np.full(num_rows, -1, dtype=np.int64)
+
+        pending_rows, pending_texts = [], []
+        for chunk_start, texts in self.__hash_chunks(self.__iter_pending_chunks(0), row_hashes):
+            rows = np.arange(chunk_start, chunk_start + len(texts))
+            hashes = row_hashes[rows]
+            positions = np.minimum(np.searchsorted(sorted_hashes, hashes), max(len(sorted_hashes) - 1, 0))
+            matched = sorted_hashes[positions] == hashes if len(sorted_hashes) else np.zeros(len(rows), dtype=bool)
 
-            data_loader = DataLoader(combined_texts, batch_size=self.batch_size, shuffle=False)
+            source_rows[rows[matched]] = order[positions[matched]]
+            embeddings[rows[matched]] = old_embeddings[order[positions[matched]]]
+            for i in np.flatnonzero(~matched):
+                pending_rows.append(rows[i])
+                pending_texts.append(texts[i])
+            if len(pending_texts) >= self.chunk_size:
+                embeddings[pending_rows] = self.__encode(pending_texts)
+                pending_rows, pending_texts = [], []
+        if pending_texts:
+            embeddings[pending_rows] = self.__encode(pending_texts)
+        embeddings.flush()
 
-            chunk_embeddings = []
-            for batch in data_loader:
-                batch_embeddings = self.model.encode(batch, convert_to_tensor=True, device=self.device)
-                chunk_embeddings.append(batch_embeddings.cpu().numpy())
+        encoded_rows = int((source_rows < 0).sum())
+        deleted_rows = len(old_hashes) - len(np.unique(source_rows[source_rows >= 0]))
+        del embeddings, old_embeddings
+        np.save(self.partial_row_hashes_file_path, row_hashes)
+        os.replace(self.partial_embeddings_file_path, self.embeddings_file_path)
+        os.replace(self.partial_row_hashes_file_path, self.row_hashes_file_path)
+        run_time = time.time() - start_time
+        logger.info(
+            f"Updated embeddings in {run_time:.2f}s: {num_rows} recipes, {encoded_rows} new or changed, "
+            f"{deleted_rows} removed"
+        )
 
-            chunk_embeddings = np.vstack(chunk_embeddings)
-            embeddings_list.append(chunk_embeddings)
-            total_rows += len(chunk)
+        metadata = self.__load_metadata()
+        metadata.update(
+            {
+                "num_rows": num_rows,
+                "dataset": self.__fingerprint(num_rows, checksum),
+                "last_update": {"encoded_rows": encoded_rows, "deleted_rows": deleted_rows, "time_taken": run_time},
+            }
+        )
+        pd.to_pickle(metadata, self.metadata_file_path)
 
-            logger.debug(f"Processed {total_rows} recipes... (Chunk Time: {time.time() - chunk_start_time:.2f}s)")
+        # The row ids changed, so the recommendation counts follow their recipes
+        if self.stats_file_path.exists():
+            new_rows = np.flatnonzero(source_rows >= 0)
+            RecommendationStats(self.stats_file_path).remap(
+                dict(zip(source_rows[new_rows].tolist(), new_rows.tolist()))
+            )
 
-            if first_pass:
-                np.save(self.embeddings_file_path, chunk_embeddings)
-                first_pass = False
+        embeddings = np.load(self.embeddings_file_path, mmap_mode="r")
+        self.build_recipe_store()
+        self.build_duplicate_index(embeddings)
+        previous_index = self.load_ann_index()
+        if previous_index is not None and encoded_rows <= ANN_RETRAIN_FRACTION * num_rows:
+            self.build_ann_index(embeddings, centroids=previous_index.centroids)
+        else:
+            self.build_ann_index(embeddings)
+        self.build_ingredient_index()
+        self.build_lexical_index()
+
+        if self.__has_shards():
+            # When rows were only appended, the existing shards are still valid and the new rows become a new shard
+            old_rows = len(old_hashes)
+            appended_only = num_rows > old_rows and np.array_equal(source_rows[:old_rows], np.arange(old_rows))
+            manifest_path = self.shard_dir / MANIFEST_NAME
+            if appended_only and manifest_path.exists() and read_manifest(self.shard_dir)["num_rows"] == old_rows:
+                ShardedIndex.add_shard(self.shard_dir, embeddings[old_rows:])
             else:
-                existing_data = np.load(self.embeddings_file_path, mmap_mode="r")
-                updated_data = np.vstack([existing_data, chunk_embeddings])
-                np.save(self.embeddings_file_path, updated_data)
+                self.build_shards(embeddings)
+        if self.__has_compressed_index():
+            self.build_compressed_index(embeddings)
+
+    def vectorize(self, num_workers=1):
+        """Vectorize the dataset chunk by chunk into a preallocated, memory-mapped and resumable store.
+
+        The embeddings are normalized to unit length, so a dot product with a normalized query is the cosine similarity.
+        When the embeddings already exist but the dataset changed since they were written, only the new and changed
+        rows are encoded again.
+
+        With num_workers > 1 the encoding is spread over that many CPU worker processes, each with its own copy of the
+        default model; a model passed to the constructor is only used in this process.
+        """
+        if self.embeddings_file_path.exists():
+            logger.debug("Loading existing embeddings from disk...")
+            if not self.__load_metadata().get("normalized"):
+                self.__normalize_store()
+            checksum = self.__check_dataset()
+            if checksum is not None:
+                logger.info("Dataset changed since the last vectorization, updating the embeddings...")
+                self.__update_store(checksum)
+
+        if self.embeddings_file_path.exists():
+            embeddings = np.load(self.embeddings_file_path, mmap_mode="r")
+            if not self.recipe_store_path.exists():
+                self.build_recipe_store()
+            if not self.duplicate_index_file_path.exists():
+                self.build_duplicate_index(embeddings)
+                # The ANN and BM25 indexes of the store still contain the duplicates, so they are built again
+                self.ann_index_file_path.unlink(missing_ok=True)
+                self.lexical_index_file_path.unlink(missing_ok=True)
+            if not self.ann_index_file_path.exists():
+                self.build_ann_index(embeddings)
+            if not self.ingredient_index_file_path.exists():
+                self.build_ingredient_index()
+            if not self.lexical_index_file_path.exists():
+                self.build_lexical_index()
+            if self.num_shards and not (self.shard_dir / MANIFEST_NAME).exists():
+                self.build_shards(embeddings)
+            if self.compressed_dims and not self.compressed_index_file_path.exists():
+                self.build_compressed_index(embeddings)
+            return embeddings
+
+        logger.debug(f"Processing dataset in chunks (Chunk Size: {self.chunk_size}, Workers: {num_workers})...")
 
-        total_time = time.time() - start_time
+        start_time = time.time()
+        embeddings, row_hashes, checkpoint = self.__open_store()
+        previous_time = checkpoint["time_taken"]
+        pending_chunks = self.__hash_chunks(self.__iter_pending_chunks(checkpoint["completed_rows"]), row_hashes)
+
+        if num_workers > 1 and self.__custom_model:
+            # The workers load their own MODEL_NAME, which would not match the embeddings of the injected model
+            logger.warning("Parallel vectorization only supports the default model, encoding in this process instead")
+            num_workers = 1
+        if num_workers > 1:
+            encoded_blocks = self.__encode_parallel(pending_chunks, num_workers)
+        else:
+            encoded_blocks = ((start, self.__encode(texts)) for start, texts in pending_chunks)
+
+        processed_rows = 0
+        for block_start, block_embeddings in encoded_blocks:
+            block_end = block_start + len(block_embeddings)
+            embeddings[block_start:block_end] = block_embeddings
+            embeddings.flush()
+            row_hashes.flush()
+
+            checkpoint["completed_rows"] = block_end
+            checkpoint["time_taken"] = previous_time + time.time() - start_time
+            self.__save_checkpoint(checkpoint)
+
+            processed_rows += len(block_embeddings)
+            rows_per_second = processed_rows / (time.time() - start_time)
+            logger.debug(f"Processed {block_end} recipes... ({rows_per_second:.1f} rows/sec)")
+
+        completed_rows = checkpoint["completed_rows"]
+        if completed_rows != checkpoint["num_rows"]:
+            raise RuntimeError(f"Expected {checkpoint['num_rows']} rows but vectorized {completed_rows}")
+
+        del embeddings, row_hashes
+        os.replace(self.partial_embeddings_file_path, self.embeddings_file_path)
+        os.replace(self.partial_row_hashes_file_path, self.row_hashes_file_path)
+
+        run_time = time.time() - start_time
+        rows_per_second = processed_rows / run_time if run_time > 0 else 0.0
+        logger.info(f"Vectorized {processed_rows} recipes in {run_time:.2f}s ({rows_per_second:.1f} rows/sec)")
+        total_time = checkpoint["time_taken"]
         logger.debug(f"Total embedding time: {total_time:.2f} seconds ({total_time / 60:.2f} minutes)")
 
-        pd.to_pickle({"num_rows": total_rows, "time_taken": total_time}, self.metadata_file_path)
+        pd.to_pickle(
+            {
+                "num_rows": completed_rows,
+                "time_taken": total_time,
+                "num_workers": num_workers,
+                "rows_per_second": rows_per_second,
+                "normalized": True,
+                "dataset": self.__fingerprint(completed_rows),
+            },
+            self.metadata_file_path,
+        )
+        self.checkpoint_file_path.unlink()
+
+        embeddings = np.load(self.embeddings_file_path, mmap_mode="r")
+        self.build_recipe_store()
+        self.build_duplicate_index(embeddings)
+        self.build_ann_index(embeddings)
+        self.build_ingredient_index()
+        self.build_lexical_index()
+        if self.__has_shards():
+            self.build_shards(embeddings)
+        if self.__has_compressed_index():
+            self.build_compressed_index(embeddings)
+        return embeddings
+
+    def build_ann_index(self, embeddings, n_lists=None, nprobe=16, k=10, centroids=None):
+        """Build the IVF index next to the embeddings and report its recall@k against exact search.
+
+        With `centroids`, the lists are rebuilt around those centroids instead of training new ones. Near-duplicate
+        recipes are left out of the index, only their representative is kept.
+        """
+        start_time = time.time()
+        duplicates = self.load_duplicate_index()
+        rows = duplicates.representatives if duplicates is not None else None
+        if centroids is not None:
+            index = IVFIndex.assign(embeddings, centroids, rows=rows)
+        else:
+            index = IVFIndex.build(embeddings, n_lists=n_lists, rows=rows)
+        index.save(self.ann_index_file_path)
+        build_time = time.time() - start_time
+
+        recall = index.recall_at_k(
+            embeddings, k=k, nprobe=nprobe, excluded=duplicates.mask if duplicates is not None else None
+        )
+        logger.info(
+            f"Built ANN index with {index.n_lists} lists in {build_time:.2f}s "
+            f"(recall@{k} with nprobe={nprobe}: {recall:.3f})"
+        )
+
+        metadata = self.__load_metadata()
+        metadata["ann_index"] = {"n_lists": index.n_lists, "nprobe": nprobe, f"recall@{k}": recall}
+        pd.to_pickle(metadata, self.metadata_file_path)
+        return index
+
+    def __has_shards(self):
+        """Whether the embeddings are (or must be) also kept as shards for the sharded search."""
+        return bool(self.num_shards) or (self.shard_dir / MANIFEST_NAME).exists()
+
+    def build_shards(self, embeddings, num_shards=None):
+        """Split the embeddings into shard files for the sharded search, keeping the current number of shards by
+        default."""
+        num_shards = num_shards or self.num_shards or len(read_manifest(self.shard_dir)["shards"])
+        ShardedIndex.build(embeddings, self.shard_dir, num_shards)
+
+    def load_sharded_index(self, num_workers=None):
+        """Open the shards with a pool of search processes, or return None if the embeddings are not sharded."""
+        if not (self.shard_dir / MANIFEST_NAME).exists():
+            return None
+        duplicate_index_path = self.duplicate_index_file_path if self.duplicate_index_file_path.exists() else None
+        return ShardedIndex(self.shard_dir, num_workers=num_workers, duplicate_index_path=duplicate_index_path)
+
+    def __has_compressed_index(self):
+        """Whether the compressed copy of the embeddings is (or must be) kept for the compressed search."""
+        return bool(self.compressed_dims) or self.compressed_index_file_path.exists()
+
+    def build_compressed_index(self, embeddings, dims=None, k=10, shortlist=100):
+        """Build the PCA and int8 compressed copy of the embeddings and report its size, its recall@k and its latency
+        against the float32 embeddings. The number of dimensions of the current index is kept by default."""
+        if dims is None:
+            dims = self.compressed_dims
+        if not dims and self.compressed_index_file_path.exists():
+            with np.load(self.compressed_index_file_path) as data:
+                dims = data["components"].shape[1]
+        start_time = time.time()
+        index = CompressedIndex.build(embeddings, self.compressed_codes_file_path, dims=dims)
+        index.save(self.compressed_index_file_path)
+        build_time = time.time() - start_time
+
+        evaluation = index.evaluate(embeddings, k=k, shortlist=shortlist)
+        ratio = embeddings.nbytes / index.nbytes
+        logger.info(
+            f"Built compressed index with {index.dims} int8 dimensions in {build_time:.2f}s: "
+            f"{index.nbytes / 2**20:.1f} MiB instead of {embeddings.nbytes / 2**20:.1f} MiB ({ratio:.1f}x smaller, "
+            f"recall@{k} with a shortlist of {shortlist}: {evaluation[f'recall@{k}']:.3f}, "
+            f"{evaluation['latency_ms']:.1f} ms per search instead of {evaluation['exact_latency_ms']:.1f} ms)"
+        )
+        if evaluation["latency_ms"] >= evaluation["exact_latency_ms"]:
+            logger.warning(
+                "The compressed search is not faster than the exact search on this machine, it will not be used: "
+                "build it with fewer dimensions"
+            )
+
+        metadata = self.__load_metadata()
+        metadata["compressed_index"] = {
+            "dims": index.dims,
+            "bytes": index.nbytes,
+            "float32_bytes": embeddings.nbytes,
+            "shortlist": shortlist,
+            **evaluation,
+        }
+        pd.to_pickle(metadata, self.metadata_file_path)
+        return index
+
+    def load_compressed_index(self):
+        """Load the compressed copy of the embeddings, or return None if there is none or if its build measured it
+        slower than the exact search."""
+        if not self.compressed_index_file_path.exists():
+            return None
+        evaluation = self.__load_metadata().get("compressed_index", {})
+        if evaluation.get("latency_ms", 0) >= evaluation.get("exact_latency_ms", np.inf):
+            logger.warning(
+                f"The compressed search took {evaluation['latency_ms']:.1f} ms instead of "
+                f"{evaluation['exact_latency_ms']:.1f} ms for the exact search when it was built, it is not used"
+            )
+            return None
+        return CompressedIndex.load(self.compressed_index_file_path, self.compressed_codes_file_path)
+
+    def build_recipe_store(self):
+        """Convert the dataset into the columnar recipe store read at query time."""
+        return RecipeStore.build(self.file_path, self.recipe_store_path, chunk_size=self.chunk_size)
+
+    def load_recipe_store(self):
+        """Open the columnar recipe store, building it first if needed."""
+        if not self.recipe_store_path.exists():
+            return self.build_recipe_store()
+        return RecipeStore(self.recipe_store_path)
+
+    def build_ingredient_index(self):
+        """Build the inverted index of NER ingredients used to pre-filter the search."""
+        index = IngredientIndex.build(self.load_recipe_store())
+        index.save(self.ingredient_index_file_path)
+        return index
+
+    def load_ingredient_index(self):
+        """Load the ingredient index, building it first if needed."""
+        if not self.ingredient_index_file_path.exists():
+            return self.build_ingredient_index()
+        return IngredientIndex.load(self.ingredient_index_file_path)
+
+    def build_duplicate_index(self, embeddings):
+        """Find the near-duplicate recipes, map each of them to the representative of its group and report how much
+        smaller the ANN and BM25 indexes get without them."""
+        start_time = time.time()
+        index = DuplicateIndex.build(self.load_recipe_store(), embeddings)
+        index.save(self.duplicate_index_file_path)
+
+        num_rows, num_representatives = index.num_rows, len(index.representatives)
+        shrink = 1 - num_representatives / num_rows if num_rows else 0.0
+        logger.info(
+            f"Collapsed {num_rows - num_representatives} near-duplicate recipes in {time.time() - start_time:.2f}s: "
+            f"the ANN and BM25 indexes shrank from {num_rows} to {num_representatives} recipes ({shrink:.1%} smaller), "
+            f"the exact, sharded and compressed searches still scan the {num_rows} recipes and mask the duplicates"
+        )
+        metadata = self.__load_metadata()
+        metadata["duplicates"] = {"num_rows": num_rows, "representatives": num_representatives, "shrink": shrink}
+        pd.to_pickle(metadata, self.metadata_file_path)
+        return index
+
+    def load_duplicate_index(self):
+        """Load the mapping of the near-duplicate recipes to their representatives, or None if there is none."""
+        if not self.duplicate_index_file_path.exists():
+            return None
+        return DuplicateIndex.load(self.duplicate_index_file_path)
+
+    def build_lexical_index(self):
+        """Build the BM25 index over the titles and NER ingredients used to select the candidates of a search."""
+        duplicates = self.load_duplicate_index()
+        index = BM25Index.build(self.load_recipe_store(), rows=duplicates.representatives if duplicates else None)
+        index.save(self.lexical_index_file_path)
+        return index
+
+    def load_lexical_index(self):
+        """Load the BM25 index, building it first if needed."""
+        if not self.lexical_index_file_path.exists():
+            return self.build_lexical_index()
+        return BM25Index.load(self.lexical_index_file_path)
 
-        return np.load(self.embeddings_file_path, mmap_mode="r")
+    def load_ann_index(self):
+        """Load the IVF index built at vectorization time, or None if there is none."""
+        if not self.ann_index_file_path.exists():
+            return None
+        return IVFIndex.load(self.ann_index_file_path)
@@ -0,0 +1,30 @@
+import numpy as np
+
+
+def random_embeddings(num_rows, dim=16, seed=0):
+    """Random unit-length rows, so dot products are cosine similarities."""
+    embeddings = np.random.default_rng(seed).standard_normal((num_rows, dim)).astype(np.float32)
+    return embeddings / np.linalg.norm(embeddings, axis=1, keepdims=True)
+
+
+def brute_force_top_k(embeddings, query, k, rows=None, excluded=None):
+    """Exact top-k of a query over every row, or only `rows`, leaving out the rows flagged in `excluded`."""
+    rows = np.arange(len(embeddings)) if rows is None else rows
+    if excluded is not None:
+        rows = rows[~excluded[rows]]
+    scores = embeddings[rows] @ query
+    order = np.argsort(-scores, kind="stable")[:k]
+    return scores[order], rows[order]
+
+
+class FakeRecipeStore:
+    """In-memory stand-in for RecipeStore, with the columns the indexes read."""
+
+    def __init__(self, recipes):
+        self.recipes = recipes
+
+    def __len__(self):
+        return len(self.recipes)
+
+    def get_column(self, column, index):
+        return self.recipes[int(index)][column]
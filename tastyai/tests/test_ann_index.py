@@ -0,0 +1,60 @@
+import numpy as np
+from ann_index import IVFIndex
+
+from .fakes import brute_force_top_k, random_embeddings
+
+
+def test_every_row_is_in_exactly_one_list():
+    embeddings = random_embeddings(200)
+    index = IVFIndex.build(embeddings, n_lists=8, block_size=32)
+    assert index.offsets[-1] == len(index.ids) == 200
+    np.testing.assert_array_equal(np.sort(index.ids), np.arange(200))
+
+
+def test_search_probing_every_list_is_exact():
+    embeddings = random_embeddings(200)
+    index = IVFIndex.build(embeddings, n_lists=8, block_size=32)
+    for query in random_embeddings(5, seed=1):
+        scores, indices = index.search(query, embeddings, 10, nprobe=index.n_lists)
+        expected_scores, expected_indices = brute_force_top_k(embeddings, query, 10)
+        np.testing.assert_array_equal(indices, expected_indices)
+        np.testing.assert_allclose(scores, expected_scores, atol=1e-6)
+    assert index.recall_at_k(embeddings, k=10, nprobe=index.n_lists, num_queries=10, block_size=32) == 1.0
+
+
+def test_search_only_returns_probed_rows():
+    embeddings = random_embeddings(200)
+    index = IVFIndex.build(embeddings, n_lists=8)
+    query = random_embeddings(1, seed=1)[0]
+    closest_list = int(np.argmax(index.centroids @ query))
+    _, indices = index.search(query, embeddings, 500, nprobe=1)
+    start, end = index.offsets[closest_list], index.offsets[closest_list + 1]
+    np.testing.assert_array_equal(np.sort(indices), np.sort(index.ids[start:end]))
+
+
+def test_rows_subset_and_excluded_mask():
+    embeddings = random_embeddings(200)
+    rows = np.flatnonzero(np.random.default_rng(2).random(200) < 0.6)
+    index = IVFIndex.build(embeddings, n_lists=6, rows=rows)
+    np.testing.assert_array_equal(np.sort(index.ids), rows)
+
+    excluded = np.random.default_rng(3).random(200) < 0.5
+    query = random_embeddings(1, seed=1)[0]
+    scores, indices = index.search(query, embeddings, 300, nprobe=index.n_lists, excluded=excluded)
+    expected_scores, expected_indices = brute_force_top_k(embeddings, query, 300, rows=rows, excluded=excluded)
+    np.testing.assert_array_equal(indices, expected_indices)
+    np.testing.assert_allclose(scores, expected_scores, atol=1e-6)
+
+    left_out = np.ones(200, dtype=bool)
+    left_out[rows] = False
+    assert index.recall_at_k(embeddings, k=5, nprobe=index.n_lists, num_queries=10, excluded=left_out) == 1.0
+
+
+def test_save_and_load(tmp_path):
+    embeddings = random_embeddings(100)
+    index = IVFIndex.build(embeddings, n_lists=4)
+    index.save(tmp_path / "ann_index.npz")
+    loaded = IVFIndex.load(tmp_path / "ann_index.npz")
+    query = random_embeddings(1, seed=1)[0]
+    for expected, actual in zip(index.search(query, embeddings, 10), loaded.search(query, embeddings, 10)):
+        np.testing.assert_array_equal(actual, expected)
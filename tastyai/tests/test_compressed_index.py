@@ -0,0 +1,55 @@
+import numpy as np
+import pytest
+from compressed_index import CompressedIndex
+
+from .fakes import brute_force_top_k, random_embeddings
+
+
+@pytest.fixture
+def embeddings():
+    return random_embeddings(300, dim=32)
+
+
+def build(embeddings, tmp_path, dims=8):
+    index = CompressedIndex.build(embeddings, tmp_path / "compressed_codes.npy", dims=dims)
+    # Small blocks, so the scan goes through several partial blocks
+    index.block_size, index.scores_block_size = 16, 100
+    return index
+
+
+def test_a_shortlist_of_every_row_is_exact(embeddings, tmp_path):
+    index = build(embeddings, tmp_path)
+    excluded = np.random.default_rng(1).random(300) < 0.4
+    for query in random_embeddings(5, dim=32, seed=2):
+        scores, indices = index.search(query, embeddings, 10, shortlist=300, excluded=excluded)
+        expected_scores, expected_indices = brute_force_top_k(embeddings, query, 10, excluded=excluded)
+        np.testing.assert_array_equal(indices, expected_indices)
+        np.testing.assert_allclose(scores, expected_scores, atol=1e-6)
+
+
+def test_the_scan_returns_the_best_codes(embeddings, tmp_path):
+    index = build(embeddings, tmp_path)
+    query = random_embeddings(1, dim=32, seed=2)[0]
+    _, indices = index.search(query, embeddings, 20, shortlist=20)
+    code_scores = index.codes.astype(np.float32) @ ((index.components.T @ query) * index.scales)
+    np.testing.assert_array_equal(np.sort(indices), np.sort(np.argsort(-code_scores)[:20]))
+
+
+def test_every_row_excluded(embeddings, tmp_path):
+    index = build(embeddings, tmp_path)
+    scores, indices = index.search(embeddings[0], embeddings, 5, excluded=np.ones(300, dtype=bool))
+    assert len(scores) == len(indices) == 0
+
+
+def test_every_dimension_is_rejected(embeddings, tmp_path):
+    with pytest.raises(ValueError):
+        CompressedIndex.build(embeddings, tmp_path / "compressed_codes.npy", dims=32)
+
+
+def test_save_and_load(embeddings, tmp_path):
+    index = build(embeddings, tmp_path)
+    index.save(tmp_path / "compressed_index.npz")
+    loaded = CompressedIndex.load(tmp_path / "compressed_index.npz", tmp_path / "compressed_codes.npy")
+    query = random_embeddings(1, dim=32, seed=2)[0]
+    for expected, actual in zip(index.search(query, embeddings, 10), loaded.search(query, embeddings, 10)):
+        np.testing.assert_array_equal(actual, expected)
@@ -0,0 +1,65 @@
+import numpy as np
+import pytest
+from duplicate_index import DUPLICATE_SIMILARITY, DuplicateIndex, _ingredient_signature, _title_signature
+
+from .fakes import FakeRecipeStore
+
+
+def make_dataset(seed=0):
+    """Recipes drawn from a few originals, with near-copies that share either the title or the ingredients."""
+    rng = np.random.default_rng(seed)
+    originals = rng.standard_normal((20, 16)).astype(np.float32)
+    recipes, embeddings = [], []
+    for _ in range(120):
+        source = int(rng.integers(len(originals)))
+        title = f"Recipe {source}" if rng.random() < 0.7 else f"Recipe {source} variant {rng.integers(1000)}"
+        ner = [f"item {source}", f"item {source + 1}"] if rng.random() < 0.5 else [f"item {rng.integers(1000)}"]
+        # Small perturbations keep the copies above the similarity threshold, large ones bring them below it
+        noise = 0.02 if rng.random() < 0.7 else 0.5
+        vector = originals[source] + noise * rng.standard_normal(16).astype(np.float32)
+        recipes.append({"title": title, "NER": ner})
+        embeddings.append(vector / np.linalg.norm(vector))
+    return recipes, np.array(embeddings)
+
+
+def brute_force(recipes, embeddings, threshold=DUPLICATE_SIMILARITY):
+    """Connected components of the pairs sharing a signature and above the threshold, mapped to their lowest row."""
+    num_rows = len(recipes)
+    titles = [_title_signature(recipe["title"]) for recipe in recipes]
+    ingredients = [_ingredient_signature(recipe["NER"]) for recipe in recipes]
+    representative_of = np.arange(num_rows)
+    for i in range(num_rows):
+        for j in range(i):
+            same_signature = (titles[i] != 0 and titles[i] == titles[j]) or (
+                ingredients[i] != 0 and ingredients[i] == ingredients[j]
+            )
+            if same_signature and embeddings[i] @ embeddings[j] >= threshold:
+                low, high = sorted((representative_of[i], representative_of[j]))
+                representative_of[representative_of == high] = low
+    return representative_of
+
+
+@pytest.mark.parametrize("block_size", [3, 1024])
+def test_build_matches_brute_force(block_size):
+    recipes, embeddings = make_dataset()
+    index = DuplicateIndex.build(FakeRecipeStore(recipes), embeddings, block_size=block_size)
+    expected = brute_force(recipes, embeddings)
+    np.testing.assert_array_equal(index.representative_of, expected)
+    assert 0 < index.mask.sum() < len(recipes)
+    np.testing.assert_array_equal(index.representatives, np.flatnonzero(expected == np.arange(len(recipes))))
+
+
+def test_empty_signatures_are_not_duplicates():
+    recipes = [{"title": "", "NER": []}, {"title": "!!", "NER": [" "]}]
+    embeddings = np.ones((2, 4), dtype=np.float32) / 2
+    index = DuplicateIndex.build(FakeRecipeStore(recipes), embeddings)
+    np.testing.assert_array_equal(index.representative_of, [0, 1])
+
+
+def test_save_and_load(tmp_path):
+    recipes, embeddings = make_dataset()
+    index = DuplicateIndex.build(FakeRecipeStore(recipes), embeddings)
+    index.save(tmp_path / "duplicate_index.npz")
+    loaded = DuplicateIndex.load(tmp_path / "duplicate_index.npz")
+    np.testing.assert_array_equal(loaded.representative_of, index.representative_of)
+    np.testing.assert_array_equal(loaded.mask, index.mask)
@@ -0,0 +1,66 @@
+import time
+from concurrent.futures import Future
+
+import pytest
+
+pytest.importorskip("torch")
+pytest.importorskip("sentence_transformers")
+
+from engine import RecommendationEngine  # noqa: E402
+from user_profile import UserProfile  # noqa: E402
+
+
+class SlowTranslationRecommendation:
+    """Stand-in for Recommendation whose translations take `delay` seconds each."""
+
+    def __init__(self, meals, delay):
+        self.meals = meals
+        self.delay = delay
+
+    def iter_meal_recommendation(self, user_profile, top_n=5, openai_key=None):
+        for position, meal in enumerate(self.meals[:top_n]):
+            yield "found", position, meal
+        for position, meal in enumerate(self.meals[:top_n]):
+            time.sleep(self.delay)
+            yield "translated", position, {**meal, "translated_title": meal["title"].upper()}
+
+
+class InstantImageGenerator:
+    def submit_images(self, meals):
+        futures = []
+        for meal in meals:
+            future = Future()
+            future.set_result(f"{meal['title']}.png")
+            futures.append(future)
+        return futures
+
+
+def make_engine(recommendation):
+    engine = RecommendationEngine.__new__(RecommendationEngine)
+    engine.recommendation = recommendation
+    return engine
+
+
+def test_stream_recommendations_yields_the_images_before_the_slow_translations():
+    meals = [{"title": f"recipe {i}"} for i in range(3)]
+    engine = make_engine(SlowTranslationRecommendation(meals, delay=0.05))
+
+    events = list(engine.stream_recommendations(UserProfile({"language": "spanish"}), "key", InstantImageGenerator()))
+
+    stages = [stage for stage, _, _ in events]
+    last_translated = len(stages) - 1 - stages[::-1].index("translated")
+    assert stages.index("image") < last_translated
+    assert sorted(position for stage, position, _ in events if stage == "image") == [0, 1, 2]
+    assert sorted(position for stage, position, _ in events if stage == "translated") == [0, 1, 2]
+    assert ("image", 1, "recipe 1.png") in events
+
+
+def test_stream_recommendations_raises_the_errors_of_the_recommendation():
+    class FailingRecommendation:
+        def iter_meal_recommendation(self, user_profile, top_n=5, openai_key=None):
+            yield "found", 0, {"title": "recipe"}
+            raise RuntimeError("translation failed")
+
+    engine = make_engine(FailingRecommendation())
+    with pytest.raises(RuntimeError, match="translation failed"):
+        list(engine.stream_recommendations(UserProfile({"language": "spanish"}), "key"))
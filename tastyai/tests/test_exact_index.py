@@ -0,0 +1,70 @@
+import numpy as np
+import pytest
+from exact_index import ExactIndex
+
+from .fakes import brute_force_top_k, random_embeddings
+
+
+@pytest.mark.parametrize("num_rows,block_size", [(50, 7), (50, 50), (50, 64), (1, 4)])
+@pytest.mark.parametrize("k", [1, 5, 80])
+def test_search_matches_brute_force_top_k(num_rows, block_size, k):
+    embeddings = random_embeddings(num_rows)
+    query = random_embeddings(1, seed=1)[0]
+    scores, indices = ExactIndex(embeddings, block_size=block_size).search(query, k)
+    expected_scores, expected_indices = brute_force_top_k(embeddings, query, k)
+    np.testing.assert_array_equal(indices, expected_indices)
+    np.testing.assert_allclose(scores, expected_scores, atol=1e-6)
+
+
+@pytest.mark.parametrize("k", [3, 40])
+def test_search_skips_excluded_rows(k):
+    embeddings = random_embeddings(50)
+    query = random_embeddings(1, seed=1)[0]
+    excluded = np.random.default_rng(2).random(50) < 0.7
+    scores, indices = ExactIndex(embeddings, block_size=8).search(query, k, excluded=excluded)
+    expected_scores, expected_indices = brute_force_top_k(embeddings, query, k, excluded=excluded)
+    np.testing.assert_array_equal(indices, expected_indices)
+    np.testing.assert_allclose(scores, expected_scores, atol=1e-6)
+    # k is larger than the number of rows left, so only those come back
+    assert len(indices) == min(k, int((~excluded).sum()))
+
+
+def test_search_with_every_row_excluded():
+    embeddings = random_embeddings(20)
+    scores, indices = ExactIndex(embeddings, block_size=8).search(embeddings[0], 5, excluded=np.ones(20, dtype=bool))
+    assert len(scores) == len(indices) == 0
+
+
+@pytest.mark.parametrize("block_size", [7, 64])
+def test_search_batch_matches_search(block_size):
+    embeddings = random_embeddings(50)
+    queries = random_embeddings(5, seed=1)
+    rng = np.random.default_rng(2)
+    shared = rng.random(50) < 0.5
+    mostly_excluded = rng.random(50) < 0.95
+    excluded = [None, shared, shared, mostly_excluded, np.ones(50, dtype=bool)]
+    k = 6
+    index = ExactIndex(embeddings, block_size=block_size)
+
+    scores, indices = index.search_batch(queries, k, excluded=excluded)
+
+    assert scores.shape == indices.shape == (len(queries), k)
+    for i, (query, mask) in enumerate(zip(queries, excluded)):
+        expected_scores, expected_indices = brute_force_top_k(embeddings, query, k, excluded=mask)
+        found = len(expected_indices)
+        np.testing.assert_array_equal(indices[i, :found], expected_indices)
+        np.testing.assert_allclose(scores[i, :found], expected_scores, atol=1e-6)
+        # Queries with fewer than k rows left are padded
+        assert np.all(indices[i, found:] == -1)
+        assert np.all(scores[i, found:] == -np.inf)
+
+
+def test_search_batch_without_masks_and_k_above_the_number_of_rows():
+    embeddings = random_embeddings(10)
+    queries = random_embeddings(3, seed=1)
+    scores, indices = ExactIndex(embeddings, block_size=4).search_batch(queries, 25)
+    assert indices.shape == (3, 10)
+    for query, row_scores, row_indices in zip(queries, scores, indices):
+        expected_scores, expected_indices = brute_force_top_k(embeddings, query, 10)
+        np.testing.assert_array_equal(row_indices, expected_indices)
+        np.testing.assert_allclose(row_scores, expected_scores, atol=1e-6)
@@ -0,0 +1,52 @@
+import random
+
+import numpy as np
+import pytest
+from ingredient_index import IngredientIndex
+
+from .fakes import FakeRecipeStore
+
+INGREDIENTS = ["sugar", "brown sugar", "powdered sugar", "flour", "butter", "peanut butter", "eggs", "Salt", " milk "]
+
+
+def random_recipes(num_rows, seed=0):
+    rng = random.Random(seed)
+    return [{"NER": rng.sample(INGREDIENTS, rng.randint(0, 4))} for _ in range(num_rows)]
+
+
+def brute_force(recipes, term):
+    term = term.strip().lower()
+    return np.array(
+        [row for row, recipe in enumerate(recipes) if any(term in item.strip().lower() for item in recipe["NER"])],
+        dtype=np.int64,
+    )
+
+
+@pytest.mark.parametrize("term", ["sugar", "brown sugar", "butter", "SALT", "milk", "egg", "r", "tofu", ""])
+def test_rows_containing_matches_brute_force(term):
+    recipes = random_recipes(200)
+    index = IngredientIndex.build(FakeRecipeStore(recipes))
+    rows = index.rows_containing(term)
+    expected = brute_force(recipes, term) if term else np.empty(0, dtype=np.int64)
+    # A recipe comes back once per matching ingredient
+    np.testing.assert_array_equal(np.unique(rows), expected)
+
+
+def test_excluded_mask():
+    recipes = random_recipes(200)
+    index = IngredientIndex.build(FakeRecipeStore(recipes))
+    assert index.excluded_mask([]) is None
+
+    mask = index.excluded_mask(["butter", "eggs"], sugar_free=True)
+    expected = np.zeros(200, dtype=bool)
+    for term in ["butter", "eggs", "sugar"]:
+        expected[brute_force(recipes, term)] = True
+    np.testing.assert_array_equal(mask, expected)
+
+
+def test_save_and_load(tmp_path):
+    recipes = random_recipes(50)
+    IngredientIndex.build(FakeRecipeStore(recipes)).save(tmp_path / "ingredient_index.npz")
+    loaded = IngredientIndex.load(tmp_path / "ingredient_index.npz")
+    assert loaded.num_rows == 50
+    np.testing.assert_array_equal(np.unique(loaded.rows_containing("sugar")), brute_force(recipes, "sugar"))
@@ -0,0 +1,86 @@
+import random
+from collections import Counter
+
+import numpy as np
+import pytest
+from lexical_index import COMMON_TERM_FRACTION, BM25Index, _tokenize
+
+from .fakes import FakeRecipeStore
+
+WORDS = ["apple", "banana", "cherry", "date", "egg", "flour", "garlic", "honey", "salt", "sugar", "butter", "milk"]
+
+
+def random_recipes(num_rows, seed=0):
+    rng = random.Random(seed)
+    recipes = []
+    for _ in range(num_rows):
+        # salt and sugar are in most recipes, so they are common terms
+        ner = (
+            rng.sample(WORDS[:8], rng.randint(1, 4))
+            + ["salt"] * (rng.random() < 0.9)
+            + ["sugar"] * (rng.random() < 0.8)
+        )
+        recipes.append({"title": f"{rng.choice(WORDS)} {rng.choice(['cake', 'pie', 'soup'])}", "NER": ner})
+    return recipes
+
+
+def brute_force(recipes, text, k, rows=None, excluded=None, k1=1.2, b=0.75):
+    """BM25 of every indexed recipe containing at least one candidate term of the text."""
+    rows = range(len(recipes)) if rows is None else rows
+    documents = {row: Counter(_tokenize(f"{recipes[row]['title']} {' '.join(recipes[row]['NER'])}")) for row in rows}
+    average_length = np.mean([sum(terms.values()) for terms in documents.values()])
+    terms = sorted(set(token for token in _tokenize(text) if any(token in terms for terms in documents.values())))
+    document_frequencies = {term: sum(term in terms for terms in documents.values()) for term in terms}
+    rare = [term for term in terms if document_frequencies[term] <= COMMON_TERM_FRACTION * len(documents)]
+    if terms and not rare:
+        rare = [min(terms, key=lambda term: (document_frequencies[term], terms.index(term)))]
+
+    scores = {}
+    for row, document in documents.items():
+        if not any(term in document for term in rare) or (excluded is not None and excluded[row]):
+            continue
+        length = sum(document.values())
+        score = 0.0
+        for term in terms:
+            frequency, frequency_count = document[term], document_frequencies[term]
+            idf = np.log(1 + (len(documents) - frequency_count + 0.5) / (frequency_count + 0.5))
+            score += idf * frequency * (k1 + 1) / (frequency + k1 * (1 - b + b * length / average_length))
+        scores[row] = score
+    return sorted(scores.values(), reverse=True)[:k], scores
+
+
+@pytest.mark.parametrize(
+    "text", ["apple cake", "cherry date egg", "salt sugar", "salt", "garlic soup with salt", "xyz"]
+)
+@pytest.mark.parametrize("k", [5, 500])
+def test_search_matches_brute_force(text, k):
+    recipes = random_recipes(300)
+    index = BM25Index.build(FakeRecipeStore(recipes))
+    scores, indices = index.search(text, k)
+    expected_scores, all_scores = brute_force(recipes, text, k)
+    np.testing.assert_allclose(scores, expected_scores, rtol=1e-5)
+    # Equal scores may come back in any order, but each row must have its own score
+    np.testing.assert_allclose(scores, [all_scores[row] for row in indices], rtol=1e-5)
+    assert len(set(indices.tolist())) == len(indices)
+
+
+def test_search_with_rows_subset_and_excluded_mask():
+    recipes = random_recipes(300)
+    rows = np.flatnonzero(np.random.default_rng(1).random(300) < 0.7)
+    excluded = np.random.default_rng(2).random(300) < 0.3
+    index = BM25Index.build(FakeRecipeStore(recipes), rows=rows)
+    assert index.num_documents == len(rows)
+
+    scores, indices = index.search("apple banana", 50, excluded=excluded)
+    expected_scores, all_scores = brute_force(recipes, "apple banana", 50, rows=rows.tolist(), excluded=excluded)
+    np.testing.assert_allclose(scores, expected_scores, rtol=1e-5)
+    np.testing.assert_allclose(scores, [all_scores[row] for row in indices], rtol=1e-5)
+    assert np.isin(indices, rows).all() and not excluded[indices].any()
+
+
+def test_save_and_load(tmp_path):
+    index = BM25Index.build(FakeRecipeStore(random_recipes(50)))
+    index.save(tmp_path / "lexical_index.npz")
+    loaded = BM25Index.load(tmp_path / "lexical_index.npz")
+    for expected, actual in zip(index.search("apple pie", 10), loaded.search("apple pie", 10)):
+        np.testing.assert_array_equal(actual, expected)
@@ -0,0 +1,74 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+from micro_batcher import MicroBatcher
+
+
+class Recorder:
+    def __init__(self, delay=0.0):
+        self.delay = delay
+        self.batches = []
+
+    def __call__(self, requests):
+        self.batches.append(list(requests))
+        time.sleep(self.delay)
+        return [request * 2 for request in requests]
+
+
+def test_concurrent_callers_get_their_own_results():
+    recorder = Recorder(delay=0.01)
+    batcher = MicroBatcher(recorder, max_batch_size=8, max_wait=0.02)
+    try:
+        with ThreadPoolExecutor(max_workers=32) as pool:
+            results = list(pool.map(batcher, range(100)))
+    finally:
+        batcher.close()
+
+    assert results == [i * 2 for i in range(100)]
+    assert sorted(request for batch in recorder.batches for request in batch) == list(range(100))
+    assert max(len(batch) for batch in recorder.batches) <= 8
+    # The callers were waiting together, so at least some requests were grouped
+    assert len(recorder.batches) < 100
+
+
+def test_requests_wait_for_others_to_join():
+    recorder = Recorder()
+    batcher = MicroBatcher(recorder, max_batch_size=4, max_wait=0.5)
+    try:
+        futures = [batcher.submit(i) for i in range(4)]
+        assert [future.result(timeout=1) for future in futures] == [0, 2, 4, 6]
+    finally:
+        batcher.close()
+    assert recorder.batches == [[0, 1, 2, 3]]
+
+
+def test_a_failed_batch_raises_in_every_caller():
+    def fail(requests):
+        raise RuntimeError("model unavailable")
+
+    batcher = MicroBatcher(fail, max_batch_size=4, max_wait=0.05)
+    try:
+        futures = [batcher.submit(i) for i in range(3)]
+        for future in futures:
+            with pytest.raises(RuntimeError, match="model unavailable"):
+                future.result(timeout=1)
+    finally:
+        batcher.close()
+
+
+def test_close_processes_the_queued_requests():
+    started = threading.Event()
+
+    def slow(requests):
+        started.set()
+        time.sleep(0.05)
+        return requests
+
+    batcher = MicroBatcher(slow, max_batch_size=2, max_wait=0.0)
+    futures = [batcher.submit(i) for i in range(5)]
+    started.wait(1)
+    batcher.close()
+    assert [future.result(timeout=0) for future in futures] == list(range(5))
+    assert not batcher.thread.is_alive()
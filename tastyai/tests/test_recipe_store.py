@@ -0,0 +1,19 @@
+import math
+
+import pytest
+from recipe_store import string_to_list
+
+
+@pytest.mark.parametrize(
+    "value,expected",
+    [
+        ("['1 c. flour', '2 eggs']", ["1 c. flour", "2 eggs"]),
+        ("[]", []),
+        ("[flour, 2 eggs ]", ["flour", "2 eggs"]),
+        ("['unterminated, 'quote']", ["'unterminated", "'quote'"]),
+        (math.nan, []),
+        (None, []),
+    ],
+)
+def test_string_to_list(value, expected):
+    assert string_to_list(value) == expected
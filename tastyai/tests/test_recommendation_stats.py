@@ -0,0 +1,38 @@
+import time
+
+from recommendation_stats import RecommendationStats
+
+
+def test_counts_are_written_in_the_background(tmp_path):
+    path = tmp_path / "recommendation_stats.sqlite"
+    stats = RecommendationStats(path, flush_interval=0.01)
+    stats.record([3, 1, 3])
+    stats.record([3, 2])
+
+    # Another process reading the file sees the counts once they are written
+    reader = RecommendationStats(path)
+    deadline = time.monotonic() + 2
+    while len(reader.most_recommended(10)) < 3:
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+    assert reader.most_recommended(1) == [3]
+    stats.close()
+
+
+def test_most_recommended_includes_the_pending_counts(tmp_path):
+    stats = RecommendationStats(tmp_path / "recommendation_stats.sqlite", flush_interval=60)
+    stats.record([5, 7, 7])
+    assert stats.most_recommended(2) == [7, 5]
+    stats.record([5, 5])
+    assert stats.most_recommended(1) == [5]
+    stats.close()
+
+
+def test_remap_moves_the_counts(tmp_path):
+    path = tmp_path / "recommendation_stats.sqlite"
+    stats = RecommendationStats(path, flush_interval=60)
+    stats.record([0, 1, 1, 2, 2, 2])
+    stats.remap({1: 10, 2: 20})
+    assert stats.most_recommended(10) == [20, 10]
+    stats.close()
+    assert RecommendationStats(path).most_recommended(10) == [20, 10]
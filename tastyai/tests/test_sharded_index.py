@@ -0,0 +1,53 @@
+import os
+
+import numpy as np
+import pytest
+from duplicate_index import DuplicateIndex
+from sharded_index import BLAS_THREAD_VARIABLES, ShardedIndex, limit_blas_threads
+
+from .fakes import brute_force_top_k, random_embeddings
+
+
+@pytest.fixture
+def embeddings():
+    return random_embeddings(200)
+
+
+@pytest.fixture
+def duplicates(tmp_path):
+    representative_of = np.arange(200)
+    representative_of[1::7] = 0
+    DuplicateIndex(representative_of).save(tmp_path / "duplicate_index.npz")
+    return DuplicateIndex(representative_of)
+
+
+def test_search_matches_brute_force(embeddings, duplicates, tmp_path):
+    ShardedIndex.build(embeddings[:150], tmp_path / "shards", num_shards=3)
+    ShardedIndex.add_shard(tmp_path / "shards", embeddings[150:])
+    index = ShardedIndex(tmp_path / "shards", num_workers=2, duplicate_index_path=tmp_path / "duplicate_index.npz")
+    try:
+        assert index.num_rows == 200 and len(index.shards) == 4
+        excluded = np.random.default_rng(1).random(200) < 0.3
+        for query in random_embeddings(3, seed=2):
+            # The caller only passes its own exclusions, the workers add the near-duplicates
+            scores, indices = index.search(query, 10, excluded=excluded)
+            expected_scores, expected_indices = brute_force_top_k(
+                embeddings, query, 10, excluded=excluded | duplicates.mask
+            )
+            np.testing.assert_array_equal(indices, expected_indices)
+            np.testing.assert_allclose(scores, expected_scores, atol=1e-6)
+
+        scores, indices = index.search(embeddings[0], 500)
+        np.testing.assert_array_equal(np.sort(indices), duplicates.representatives)
+    finally:
+        index.close()
+
+
+def test_limit_blas_threads_restores_the_environment(monkeypatch):
+    monkeypatch.setenv(BLAS_THREAD_VARIABLES[0], "8")
+    for name in BLAS_THREAD_VARIABLES[1:]:
+        monkeypatch.delenv(name, raising=False)
+    with limit_blas_threads(2):
+        assert all(os.environ[name] == "2" for name in BLAS_THREAD_VARIABLES)
+    assert os.environ[BLAS_THREAD_VARIABLES[0]] == "8"
+    assert all(name not in os.environ for name in BLAS_THREAD_VARIABLES[1:])
@@ -0,0 +1,119 @@
+import json
+
+import pytest
+from langchain_core.messages import AIMessage
+from langchain_core.runnables import RunnableLambda
+from translation_cache import TranslationCache
+from translator import PROMPT_VERSION, Translator
+
+
+def make_meal(i):
+    return {
+        "title": f"Recipe {i}",
+        "ingredients": [f"{i} eggs", "salt"],
+        "directions": ["Mix well.", f"Bake for {i} minutes."],
+    }
+
+
+def expected_translation(meal):
+    return {
+        "translated_title": f"[es] {meal['title']}",
+        "translated_ingredients": [f"[es] {item}" for item in meal["ingredients"]],
+        "translated_directions": [f"[es] {item}" for item in meal["directions"]],
+    }
+
+
+class StubLLM:
+    """Answers the translation prompts like the model would, recording the batch requests it receives."""
+
+    def __init__(self, batch_answer=None):
+        self.batch_answer = batch_answer
+        self.batches = []
+        self.texts = []
+        self.runnable = RunnableLambda(self.respond)
+
+    def respond(self, prompt_value):
+        messages = prompt_value.to_messages()
+        system, query = messages[0].content, messages[-1].content
+        if "translates recipes" in system:
+            recipes = json.loads(query)
+            self.batches.append(recipes)
+            if self.batch_answer is not None:
+                return AIMessage(content=self.batch_answer)
+            translated = [
+                {
+                    "title": f"[es] {recipe['title']}",
+                    "ingredients": [f"[es] {item}" for item in recipe["ingredients"]],
+                    "directions": [f"[es] {item}" for item in recipe["directions"]],
+                }
+                for recipe in recipes
+            ]
+            return AIMessage(content=json.dumps(translated))
+        self.texts.append(query)
+        return AIMessage(content=" | ".join(f"[es] {part}" for part in query.split(" | ")))
+
+
+@pytest.fixture
+def cache(tmp_path):
+    return TranslationCache(tmp_path / "translation_cache.sqlite")
+
+
+def test_translate_meals_splits_the_meals_into_batches():
+    llm = StubLLM()
+    translator = Translator(openai_key="test", language="spanish", llm=llm.runnable, meals_per_request=3)
+    meals = [make_meal(i) for i in range(7)]
+
+    translations = translator.translate_meals(meals)
+
+    assert translations == [expected_translation(meal) for meal in meals]
+    assert sorted(len(batch) for batch in llm.batches) == [1, 3, 3]
+    assert sorted(recipe["title"] for batch in llm.batches for recipe in batch) == sorted(
+        meal["title"] for meal in meals
+    )
+    assert llm.texts == []
+
+
+def test_translate_meals_writes_back_and_reuses_the_cache(cache):
+    meals = [make_meal(i) for i in range(4)]
+    llm = StubLLM()
+    Translator(
+        openai_key="test", language="spanish", cache=cache, llm=llm.runnable, meals_per_request=2
+    ).translate_meals(meals[:3])
+    assert cache.get("Recipe 1", "spanish", PROMPT_VERSION) == "[es] Recipe 1"
+    assert cache.get("1 eggs | salt", "spanish", PROMPT_VERSION) == "[es] 1 eggs | [es] salt"
+
+    llm = StubLLM()
+    translator = Translator(openai_key="test", language="spanish", cache=cache, llm=llm.runnable, meals_per_request=2)
+    translations = translator.translate_meals(meals)
+
+    assert translations == [expected_translation(meal) for meal in meals]
+    # Only the meal missing from the cache is sent to the model
+    assert [[recipe["title"] for recipe in batch] for batch in llm.batches] == [["Recipe 3"]]
+
+
+@pytest.mark.parametrize("batch_answer", ["not json", json.dumps([{"title": "only one"}]), json.dumps({"a": 1})])
+def test_translate_meals_falls_back_to_translate_meal_on_a_bad_answer(cache, batch_answer):
+    llm = StubLLM(batch_answer=batch_answer)
+    translator = Translator(openai_key="test", language="spanish", cache=cache, llm=llm.runnable, meals_per_request=2)
+    meals = [make_meal(i) for i in range(2)]
+
+    translations = translator.translate_meals(meals)
+
+    assert translations == [expected_translation(meal) for meal in meals]
+    assert len(llm.batches) == 1
+    # translate_meal translates the title, the ingredients and the directions of each meal separately
+    assert len(llm.texts) == 6
+    assert cache.get("Recipe 0", "spanish", PROMPT_VERSION) == "[es] Recipe 0"
+
+
+def test_cache_hits_refresh_the_access_time_before_evicting(tmp_path):
+    cache = TranslationCache(tmp_path / "translation_cache.sqlite", max_entries=3, flush_interval=60)
+    for text in ["first", "second", "third"]:
+        cache.put(text, "spanish", PROMPT_VERSION, text.upper())
+    # The hit is only recorded in memory, but it still protects "first" from the eviction
+    assert cache.get("first", "spanish", PROMPT_VERSION) == "FIRST"
+    cache.put("fourth", "spanish", PROMPT_VERSION, "FOURTH")
+
+    assert cache.get("first", "spanish", PROMPT_VERSION) == "FIRST"
+    assert cache.get("second", "spanish", PROMPT_VERSION) is None
+    cache.close()
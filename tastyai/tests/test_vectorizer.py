@@ -0,0 +1,132 @@
+import hashlib
+
+import numpy as np
+import pandas as pd
+import pytest
+
+torch = pytest.importorskip("torch")
+pytest.importorskip("sentence_transformers")
+
+from ann_index import IVFIndex  # noqa: E402
+from lexical_index import BM25Index  # noqa: E402
+from vectorizer import Vectorizer  # noqa: E402
+
+
+class FakeEncoder:
+    """Deterministic stand-in for the sentence transformer, counting the texts it encodes."""
+
+    dim = 16
+
+    def __init__(self):
+        self.num_encoded = 0
+
+    def get_sentence_embedding_dimension(self):
+        return self.dim
+
+    def encode(self, texts, convert_to_tensor=False, normalize_embeddings=False, **kwargs):
+        self.num_encoded += len(texts)
+        seeds = [int.from_bytes(hashlib.sha256(text.encode("utf-8")).digest()[:8], "little") for text in texts]
+        embeddings = np.array([np.random.default_rng(seed).standard_normal(self.dim) for seed in seeds], np.float32)
+        if normalize_embeddings:
+            embeddings /= np.linalg.norm(embeddings, axis=1, keepdims=True)
+        return torch.from_numpy(embeddings) if convert_to_tensor else embeddings
+
+
+def make_recipe(i):
+    ner = [f"ingredient {i % 7}", f"ingredient {i % 11}", f"spice {i}"]
+    return {
+        "title": f"Recipe number {i}",
+        "ingredients": str([f"1 c. {item}" for item in ner]),
+        "directions": str(["Mix well.", f"Bake for {i} minutes."]),
+        "link": f"www.example.com/{i}",
+        "source": "Gathered",
+        "NER": str(ner),
+    }
+
+
+def write_dataset(path, recipes):
+    pd.DataFrame(recipes).to_csv(path)
+
+
+def vectorize(path):
+    encoder = FakeEncoder()
+    vectorizer = Vectorizer(str(path), model=encoder, chunk_size=16, batch_size=8)
+    vectorizer.vectorize()
+    return vectorizer, encoder
+
+
+def test_incremental_update_matches_a_full_build(tmp_path):
+    recipes = [make_recipe(i) for i in range(60)]
+    (tmp_path / "updated").mkdir()
+    (tmp_path / "scratch").mkdir()
+    updated_path, scratch_path = tmp_path / "updated" / "dataset.csv", tmp_path / "scratch" / "dataset.csv"
+    write_dataset(updated_path, recipes)
+    vectorize(updated_path)
+
+    # Edit one row, delete another, swap two and append a few
+    recipes[3] = {**recipes[3], "title": "Edited recipe"}
+    del recipes[10]
+    recipes[20], recipes[21] = recipes[21], recipes[20]
+    recipes += [make_recipe(i) for i in range(100, 105)]
+    write_dataset(updated_path, recipes)
+    write_dataset(scratch_path, recipes)
+
+    updated, updated_encoder = vectorize(updated_path)
+    scratch, _ = vectorize(scratch_path)
+
+    # Only the edited and the appended rows are encoded again
+    assert updated_encoder.num_encoded == 6
+    np.testing.assert_allclose(np.load(updated.embeddings_file_path), np.load(scratch.embeddings_file_path), atol=1e-6)
+    np.testing.assert_array_equal(np.load(updated.row_hashes_file_path), np.load(scratch.row_hashes_file_path))
+
+    store = updated.load_recipe_store()
+    assert len(store) == len(recipes)
+    assert store.get_column("title", 3) == "Edited recipe"
+    assert store.get_column("title", 20) == recipes[20]["title"]
+
+    embeddings = np.load(updated.embeddings_file_path, mmap_mode="r")
+    ann_index = updated.load_ann_index()
+    np.testing.assert_array_equal(np.sort(ann_index.ids), updated.load_duplicate_index().representatives)
+    query = embeddings[40]
+    _, indices = ann_index.search(query, embeddings, 5, nprobe=ann_index.n_lists)
+    np.testing.assert_array_equal(indices, np.argsort(-(embeddings @ query))[:5])
+
+    for query in ["spice 102", "Edited", "ingredient 3"]:
+        updated_results = updated.load_lexical_index().search(query, 10)
+        scratch_results = scratch.load_lexical_index().search(query, 10)
+        np.testing.assert_allclose(updated_results[0], scratch_results[0], rtol=1e-6)
+    np.testing.assert_array_equal(
+        np.unique(updated.load_ingredient_index().rows_containing("spice 101")), [len(recipes) - 4]
+    )
+
+
+def test_duplicates_are_left_out_of_the_indexes_of_an_existing_store(tmp_path):
+    recipes = [make_recipe(i) for i in range(40)] + [make_recipe(i) for i in range(5)]
+    path = tmp_path / "dataset.csv"
+    write_dataset(path, recipes)
+    vectorizer, _ = vectorize(path)
+    representatives = np.arange(40)
+    np.testing.assert_array_equal(vectorizer.load_duplicate_index().representatives, representatives)
+
+    # A store vectorized before the duplicates were collapsed has indexes over every row
+    embeddings = np.load(vectorizer.embeddings_file_path, mmap_mode="r")
+    vectorizer.duplicate_index_file_path.unlink()
+    IVFIndex.build(embeddings).save(vectorizer.ann_index_file_path)
+    BM25Index.build(vectorizer.load_recipe_store()).save(vectorizer.lexical_index_file_path)
+    assert len(vectorizer.load_ann_index().ids) == len(recipes)
+
+    vectorizer, encoder = vectorize(path)
+    assert encoder.num_encoded == 0
+    np.testing.assert_array_equal(np.sort(vectorizer.load_ann_index().ids), representatives)
+    assert vectorizer.load_lexical_index().num_documents == len(representatives)
+
+
+def test_parallel_vectorization_keeps_an_injected_model(tmp_path):
+    path = tmp_path / "dataset.csv"
+    write_dataset(path, [make_recipe(i) for i in range(20)])
+    encoder = FakeEncoder()
+    vectorizer = Vectorizer(str(path), model=encoder, chunk_size=16, batch_size=8)
+    embeddings = vectorizer.vectorize(num_workers=2)
+    # The workers would have encoded every row with their own default model
+    assert encoder.num_encoded == 20
+    assert embeddings.shape == (20, FakeEncoder.dim)